@@ -3,7 +3,8 @@ from django.contrib import admin
 from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
-from .models import MailTemplate, Client, Mail
+from .models import MailTemplate, Client, Mail, MailBody
+from .models.mail import utc_now
 # custom models
 from django.forms.widgets import DateTimeInput
 admin.site.site_header = _('Mailing API Admin')
@@ -67,11 +68,20 @@ class MailForm(forms.ModelForm):
         fields = '__all__'
 
     def clean(self):
+        # a retry rescheduled by hand is claimed on its new date
+        if 'next_retry_date' in self.changed_data:
+            self.cleaned_data['due_at'] = self.cleaned_data.get('next_retry_date') or utc_now()
         return self.cleaned_data
 
 
+class MailBodyInline(admin.StackedInline):
+    model = MailBody
+    can_delete = False
+
+
 class MailAdmin(admin.ModelAdmin):
     form = MailForm
+    inlines = [MailBodyInline]
 
 
 admin.site.register(MailTemplate, MailTemplateAdmin)
@@ -1,20 +1,98 @@
-from injector import Module, singleton
+from injector import InstanceProvider, Module, singleton
 
 from api.security.abstract_access_token_service import AbstractAccessTokenService
 from api.security.access_token_service import AccessTokenService
+from api.services.attachment_fetcher import AttachmentFetcher
+from api.services.attachment_store import AttachmentStore
 from api.services.email_service import EmailService
-from api.services.sendgrid_email_service import SendGridEmailService
+from api.services.filesystem_attachment_store import FileSystemAttachmentStore
+from api.services.mail_archive import MailArchive
+from api.services.mail_notifier import MailNotifier
+from api.services.mail_retention import MailRetention
+from api.services.ndjson_mail_archive import NdjsonMailArchive
+from api.services.rate_limiter import RateLimiter
+from api.services.redis_mail_notifier import RedisMailNotifier
+from api.services.redis_rate_limiter import RedisRateLimiter
+from api.services.redis_worker_registry import RedisWorkerRegistry
+from api.services.delivery_provider import DeliveryProvider
+from api.services.mail_dispatcher import MailDispatcher
+from api.services.sendgrid_provider import SendGridProvider
+from api.services.smtp_provider import SmtpProvider
+from api.services.spool_provider import SpoolProvider
+from api.services.storage_attachment_store import StorageAttachmentStore
+from api.services.table_mail_archive import TableMailArchive
 from api.services.vcs_service import VCSService
 from api.services.github_service import GithubService
+from api.services.http_attachment_fetcher import HttpAttachmentFetcher
+from api.services.worker_registry import WorkerRegistry
+from api.utils import config
+
+# EMAIL_DELIVERY_PROVIDER values
+DELIVERY_PROVIDERS = {
+    'sendgrid': SendGridProvider,
+    'spool': SpoolProvider,
+    'smtp': SmtpProvider,
+}
+
+# ATTACHMENT_STORE values
+ATTACHMENT_STORES = {
+    'filesystem': FileSystemAttachmentStore,
+    'storage': StorageAttachmentStore,
+}
+
+# SEND_EMAILS_ARCHIVE_BACKEND values
+MAIL_ARCHIVES = {
+    'ndjson': NdjsonMailArchive,
+    'table': TableMailArchive,
+}
+
+
+def delivery_routes(providers: str) -> list:
+    """
+    Parses EMAIL_DELIVERY_PROVIDERS ( ie sendgrid:3,smtp:1 ) into routes, in failover order.
+    """
+    routes = []
+    for entry in providers.split(','):
+        if not entry.strip():
+            continue
+        name, _, weight = entry.strip().partition(':')
+        routes.append(MailDispatcher.Route(DELIVERY_PROVIDERS[name.strip()](), float(weight) if weight else 1))
+    return routes
 
 
 # define here all root ioc bindings
 class ApiAppModule(Module):
     def configure(self, binder):
         # services
-        email_service = SendGridEmailService()
+        rate_limiter = RedisRateLimiter()
+        binder.bind(RateLimiter, to=rate_limiter, scope=singleton)
+
+        routes = delivery_routes(config('EMAIL_DELIVERY_PROVIDERS', '') or config('EMAIL_DELIVERY_PROVIDER', 'sendgrid'))
+        # primary provider
+        binder.bind(DeliveryProvider, to=routes[0].provider, scope=singleton)
+
+        # opt in, without a store the attachments are kept inline on the payload
+        store = config('ATTACHMENT_STORE', '')
+        attachment_store = ATTACHMENT_STORES[store]() if store else None
+        binder.bind(AttachmentStore, to=InstanceProvider(attachment_store), scope=singleton)
+
+        attachment_fetcher = HttpAttachmentFetcher()
+        binder.bind(AttachmentFetcher, to=attachment_fetcher, scope=singleton)
+
+        email_service = MailDispatcher(routes, rate_limiter, attachment_store=attachment_store,
+                                       attachment_fetcher=attachment_fetcher)
         binder.bind(EmailService, to=email_service, scope=singleton)
 
+        mail_archive = MAIL_ARCHIVES[config('SEND_EMAILS_ARCHIVE_BACKEND', 'ndjson')]()
+        binder.bind(MailArchive, to=mail_archive, scope=singleton)
+        binder.bind(MailRetention, to=MailRetention(mail_archive, attachment_store), scope=singleton)
+
+        mail_notifier = RedisMailNotifier()
+        binder.bind(MailNotifier, to=mail_notifier, scope=singleton)
+
+        worker_registry = RedisWorkerRegistry()
+        binder.bind(WorkerRegistry, to=worker_registry, scope=singleton)
+
         access_token_service = AccessTokenService()
         binder.bind(AbstractAccessTokenService, to=access_token_service, scope=singleton)
 
@@ -0,0 +1,22 @@
+import logging
+import traceback
+
+from django_extensions.management.jobs import DailyJob
+from django_injector import inject
+
+from api.services import MailRetention
+from api.utils import DistributedLock
+
+
+class Job(DailyJob):
+    help = "Mailing API Sent Emails Retention Job ( archives or purges the old sent / failed emails )"
+    code = 'api.jobs.archive_mails_job'  # an unique code
+
+    @inject
+    def execute(self, retention: MailRetention):
+        try:
+            logging.getLogger('jobs').debug('calling ArchiveMailsJob.execute')
+            with DistributedLock(self.__class__, False):
+                retention.run()
+        except:
+            logging.getLogger('jobs').error(traceback.format_exc())
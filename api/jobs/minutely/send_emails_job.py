@@ -5,7 +5,7 @@ from django_extensions.management.jobs import MinutelyJob
 from django_injector import inject
 
 from api.services import EmailService
-from api.utils import FileLock, config
+from api.utils import config
 
 
 class Job(MinutelyJob):
@@ -16,7 +16,7 @@ class Job(MinutelyJob):
     def execute(self, service: EmailService):
         try:
             logging.getLogger('jobs').debug('calling MailCronJob.execute')
-            with FileLock(self.__class__, False):
-                service.process_pending_emails(config('SEND_EMAILS_JOB_BATCH'))
+            # no global lock, claims are SKIP LOCKED so the runs on every host send disjoint batches
+            service.process_pending_emails(config('SEND_EMAILS_JOB_BATCH'))
         except:
             logging.getLogger('jobs').error(traceback.format_exc())
@@ -0,0 +1,34 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from api.utils import FakeSendGridServer
+
+
+class Command(BaseCommand):
+    help = "Local stand in for the SendGrid v3 mail send API ( load testing, point SEND_GRID_API_HOST to it )"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--min-latency', type=float, default=0, help='min seconds per request')
+        parser.add_argument('--max-latency', type=float, default=0, help='max seconds per request')
+        parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with a 5xx')
+        parser.add_argument('--throttle-rate', type=float, default=0, help='fraction of requests getting a 429')
+        parser.add_argument('--rate-limit', type=int, default=0,
+                            help='requests per second accepted before answering 429 ( 0 disables it )')
+
+    def handle(self, *args, **options):
+        server = FakeSendGridServer(host=options['host'], port=options['port'],
+                                    min_latency=options['min_latency'], max_latency=options['max_latency'],
+                                    error_rate=options['error_rate'], throttle_rate=options['throttle_rate'],
+                                    rate_limit=options['rate_limit'])
+        logging.getLogger('api').info('fake_sendgrid listening on {url}'.format(url=server.url))
+        self.stdout.write('listening on {url}'.format(url=server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write('{requests} requests, {accepted} mails accepted'.format(requests=server.requests,
+                                                                                      accepted=server.accepted))
@@ -0,0 +1,209 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django_injector import inject
+
+from api.services import EmailService, MailNotifier, WorkerRegistry
+from api.utils import config
+
+
+class Command(BaseCommand):
+    help = "Mailing API Email Send Worker ( resident process, replaces the minutely send_emails_job )"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=None,
+                            help='max emails claimed per poll ( default SEND_EMAILS_JOB_BATCH )')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='build/send workers ( default SEND_EMAILS_JOB_CONCURRENCY )')
+        parser.add_argument('--min-sleep', type=float, default=None,
+                            help='seconds to wait between polls when the last one found emails '
+                                 '( default SEND_WORKER_MIN_SLEEP )')
+        parser.add_argument('--max-sleep', type=float, default=None,
+                            help='max seconds to wait between polls when the queue is empty '
+                                 '( default SEND_WORKER_MAX_SLEEP )')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='forks N worker processes, each one claiming its own batches '
+                                 '( default SEND_WORKER_PROCESSES )')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.service = None
+        self.report = None
+        processes = int(options['processes'] if options['processes'] else config('SEND_WORKER_PROCESSES', 1))
+        if processes > 1:
+            self.supervise(options, processes)
+            return
+        self.run(options)
+
+    def on_signal(self, signum, frame):
+        logging.getLogger('jobs').info('send_worker got signal {signum}, draining'.format(signum=signum))
+        self.stopping.set()
+        if self.service is not None:
+            self.service.stop()
+
+    def supervise(self, options, processes: int):
+        """
+        Parent process: forks the workers, restarts the ones that die and aggregates their counts.
+        """
+        signal.signal(signal.SIGTERM, self.on_signal)
+        signal.signal(signal.SIGINT, self.on_signal)
+
+        context = multiprocessing.get_context('fork')
+        counts = context.Queue()
+        children = {}
+        # db connections can not be shared with the children
+        connections.close_all()
+
+        def spawn(n: int):
+            child = context.Process(target=self.child, args=(options, counts),
+                                    name='send-worker-{n}'.format(n=n), daemon=False)
+            child.start()
+            children[n] = child
+
+        for n in range(processes):
+            spawn(n)
+
+        logging.getLogger('jobs').info('send_worker supervising {processes} processes'.format(processes=processes))
+
+        total = 0
+        while not self.stopping.is_set():
+            total += self.collect(counts, 1)
+            for n, child in list(children.items()):
+                if not child.is_alive() and not self.stopping.is_set():
+                    logging.getLogger('jobs').warning('send_worker process {pid} died ( exit code {code} ), '
+                                                      'restarting it'.format(pid=child.pid, code=child.exitcode))
+                    spawn(n)
+
+        # children drain on SIGTERM
+        for child in children.values():
+            if child.is_alive():
+                child.terminate()
+        while any(child.is_alive() for child in children.values()):
+            total += self.collect(counts, 0.1)
+        total += self.collect(counts, 0)
+
+        logging.getLogger('jobs').info('send_worker processed {total} emails'.format(total=total))
+        self.stdout.write('processed {total} emails'.format(total=total))
+
+    @staticmethod
+    def collect(counts, timeout: float) -> int:
+        total = 0
+        try:
+            total += counts.get(timeout=timeout) if timeout > 0 else counts.get_nowait()
+            while True:
+                total += counts.get_nowait()
+        except queue.Empty:
+            pass
+        return total
+
+    def child(self, options, counts):
+        self.stopping = threading.Event()
+        self.report = counts.put
+        self.run(options)
+
+    def idle(self, timeout: float):
+        """
+        Waits for a new email notification ( or for the stop signal ) up to timeout seconds.
+        """
+        if not self.notifier.is_available():
+            self.stopping.wait(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        # short slices so a SIGTERM is honored quickly
+        while not self.stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.notifier.wait(min(remaining, 1)):
+                return
+
+    def current_shard(self):
+        if not self.sharding:
+            return None
+        try:
+            return self.registry.shard(self.worker_id)
+        except:
+            logging.getLogger('jobs').error(traceback.format_exc())
+            return None
+
+    def next_due(self, default: float) -> float:
+        try:
+            due = self.service.next_due()
+        except:
+            logging.getLogger('jobs').error(traceback.format_exc())
+            return default
+        return default if due is None else max(due, 0.1)
+
+    @inject
+    def run(self, options, service: EmailService, notifier: MailNotifier, registry: WorkerRegistry):
+        self.service = service
+        self.notifier = notifier
+        self.registry = registry
+        self.worker_id = '{host}:{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+        self.sharding = bool(config('SEND_WORKER_SHARDING', True))
+        batch = int(options['batch'] if options['batch'] else config('SEND_EMAILS_JOB_BATCH'))
+        concurrency = options['concurrency']
+        min_sleep = float(options['min_sleep'] if options['min_sleep'] is not None else
+                          config('SEND_WORKER_MIN_SLEEP', 0.5))
+        max_sleep = float(options['max_sleep'] if options['max_sleep'] is not None else
+                          config('SEND_WORKER_MAX_SLEEP', 5))
+        # with push notifications an idle worker only polls to cover missed signals
+        fallback_poll = float(config('SEND_WORKER_FALLBACK_POLL_INTERVAL', 30))
+
+        signal.signal(signal.SIGTERM, self.on_signal)
+        signal.signal(signal.SIGINT, self.on_signal)
+
+        logging.getLogger('jobs').info('send_worker started batch {batch} concurrency {concurrency}'.format(
+            batch=batch, concurrency=concurrency))
+
+        if self.sharding:
+            try:
+                self.registry.register(self.worker_id)
+            except:
+                # keeps working, just without a shard
+                logging.getLogger('jobs').error(traceback.format_exc())
+                self.sharding = False
+        try:
+            self.poll(batch, concurrency, min_sleep, max_sleep, fallback_poll)
+        finally:
+            if self.sharding:
+                self.registry.unregister(self.worker_id)
+
+        logging.getLogger('jobs').info('send_worker stopped')
+
+    def poll(self, batch: int, concurrency: int, min_sleep: float, max_sleep: float, fallback_poll: float):
+        sleep = min_sleep
+        while not self.stopping.is_set():
+            count = 0
+            try:
+                # shards are recomputed on each poll, so they get rebalanced as workers join or leave
+                count = self.service.process_pending_emails(batch, concurrency, self.current_shard())
+                if self.report is not None and count > 0:
+                    self.report(count)
+            except:
+                logging.getLogger('jobs').error(traceback.format_exc())
+                # db could be gone, force a new connection on next poll
+                connections.close_all()
+
+            # adaptive sleep: poll again right away while the batches come full,
+            # back off exponentially while the queue is empty
+            if count >= batch:
+                sleep = 0
+            elif count > 0:
+                sleep = min_sleep
+            else:
+                sleep = min(max_sleep, max(sleep * 2, min_sleep))
+                if self.notifier.is_available():
+                    sleep = fallback_poll
+                # scheduled mails are not notified, wake up when the next one is due
+                sleep = min(sleep, self.next_due(sleep))
+
+            if sleep > 0:
+                self.idle(sleep)
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_auto_20240313_1847'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mail',
+            name='lock_owner',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:44
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_mail_lock_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailtemplate',
+            name='retry_policy',
+            field=jsonfield.fields.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
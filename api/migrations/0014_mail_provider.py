@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_mailtemplate_retry_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mail',
+            name='provider',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_mail_provider'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mail',
+            name='priority',
+            field=models.IntegerField(choices=[(0, 'Bulk'), (1, 'Normal'), (2, 'Transactional')], default=1),
+        ),
+        migrations.AddField(
+            model_name='mailtemplate',
+            name='priority',
+            field=models.IntegerField(choices=[(0, 'Bulk'), (1, 'Normal'), (2, 'Transactional')], default=1),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['priority', 'sent_date', 'lock_date', 'id'], name='api_mail_lane_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_priority_lanes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailtemplate',
+            name='max_per_minute',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['priority', 'sent_date', 'lock_date', 'owner', 'id'], name='api_mail_lane_owner_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:55
+
+import api.models.mail
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+BACKFILL_CHUNK = 5000
+
+
+def backfill_due_at(apps, schema_editor):
+    Mail = apps.get_model('api', 'Mail')
+    # mails waiting for a retry are due on its retry date, the rest since they were created
+    last_id = 0
+    while True:
+        ids = list(Mail.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BACKFILL_CHUNK])
+        if len(ids) == 0:
+            break
+        Mail.objects.filter(id__gt=last_id, id__lte=ids[-1]).update(due_at=Coalesce('next_retry_date', 'created'))
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_fair_queuing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mail',
+            name='due_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='mail',
+            name='due_at',
+            field=models.DateTimeField(default=api.models.mail.utc_now),
+        ),
+        migrations.AddField(
+            model_name='mail',
+            name='send_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['due_at', 'id'], name='api_mail_due_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_mail_send_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mail',
+            name='expired_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mail',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailtemplate',
+            name='ttl',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['expires_at', 'id'], name='api_mail_expiry_idx'),
+        ),
+    ]
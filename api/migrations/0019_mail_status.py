@@ -0,0 +1,81 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:58
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Q, Subquery
+
+BACKFILL_CHUNK = 5000
+
+
+def backfill_status(apps, schema_editor):
+    Mail = apps.get_model('api', 'Mail')
+    MailTemplate = apps.get_model('api', 'MailTemplate')
+    max_retries = MailTemplate.objects.filter(pk=OuterRef('template_id')).values('max_retries')[:1]
+    last_id = 0
+    while True:
+        ids = list(Mail.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BACKFILL_CHUNK])
+        if len(ids) == 0:
+            break
+        chunk = Mail.objects.filter(id__gt=last_id, id__lte=ids[-1])
+        chunk.update(max_retries=Subquery(max_retries))
+        chunk.filter(sent_date__isnull=False).update(status='sent')
+        chunk.filter(sent_date__isnull=True, expired_date__isnull=False).update(status='expired')
+        unsent = chunk.filter(sent_date__isnull=True, expired_date__isnull=True)
+        # out of retries ( or its template is gone ), they were not claimed anymore. failed attempts never
+        # cleared lock_date, so a locked mail with an error is a failed one, not a lease to give back
+        unsent.filter(Q(max_retries__isnull=True) | Q(retries__gte=F('max_retries')) |
+                      (Q(lock_date__isnull=False) & ~Q(last_error=''))).update(status='failed')
+        unsent.filter(status='pending', lock_date__isnull=False).update(status='locked')
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_mail_ttl'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mail',
+            name='api_mail_lane_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mail',
+            name='api_mail_lane_owner_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mail',
+            name='api_mail_due_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mail',
+            name='api_mail_expiry_idx',
+        ),
+        migrations.AddField(
+            model_name='mail',
+            name='max_retries',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mail',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('locked', 'Locked'), ('sent', 'Sent'), ('failed', 'Failed'), ('expired', 'Expired')], default='pending', max_length=16),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['status', 'due_at', 'id'], name='api_mail_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['status', 'priority', 'due_at', 'id'], name='api_mail_lane_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['status', 'priority', 'owner', 'due_at', 'id'], name='api_mail_lane_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['status', 'expires_at', 'id'], name='api_mail_expiry_idx'),
+        ),
+    ]
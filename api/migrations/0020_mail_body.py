@@ -0,0 +1,65 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+BODY_FIELDS = ['payload', 'plain_content', 'html_content']
+COPY_CHUNK = 1000
+
+
+def copy_bodies(apps, schema_editor):
+    Mail = apps.get_model('api', 'Mail')
+    MailBody = apps.get_model('api', 'MailBody')
+    last_id = 0
+    while True:
+        rows = list(Mail.objects.filter(id__gt=last_id).order_by('id').values_list('id', *BODY_FIELDS)[:COPY_CHUNK])
+        if len(rows) == 0:
+            break
+        MailBody.objects.bulk_create([MailBody(mail_id=row[0], **dict(zip(BODY_FIELDS, row[1:]))) for row in rows])
+        last_id = rows[-1][0]
+
+
+def restore_bodies(apps, schema_editor):
+    Mail = apps.get_model('api', 'Mail')
+    MailBody = apps.get_model('api', 'MailBody')
+    last_id = 0
+    while True:
+        bodies = list(MailBody.objects.filter(mail_id__gt=last_id).order_by('mail_id')[:COPY_CHUNK])
+        if len(bodies) == 0:
+            break
+        Mail.objects.bulk_update([Mail(id=body.mail_id, **{f: getattr(body, f) for f in BODY_FIELDS})
+                                  for body in bodies], BODY_FIELDS)
+        last_id = bodies[-1].mail_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_mail_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailBody',
+            fields=[
+                ('mail', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='api.Mail')),
+                ('payload', jsonfield.fields.JSONField(blank=True, default='')),
+                ('plain_content', models.TextField(blank=True, default='')),
+                ('html_content', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.RunPython(copy_bodies, restore_bodies),
+        migrations.RemoveField(
+            model_name='mail',
+            name='html_content',
+        ),
+        migrations.RemoveField(
+            model_name='mail',
+            name='payload',
+        ),
+        migrations.RemoveField(
+            model_name='mail',
+            name='plain_content',
+        ),
+    ]
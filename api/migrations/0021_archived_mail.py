@@ -0,0 +1,42 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:01
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_mail_body'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMail',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('owner_id', models.IntegerField(db_index=True)),
+                ('template_id', models.IntegerField(null=True)),
+                ('from_email', models.CharField(max_length=254)),
+                ('to_email', models.CharField(max_length=1024)),
+                ('cc_email', models.CharField(blank=True, max_length=1024)),
+                ('bcc_email', models.CharField(blank=True, max_length=1024)),
+                ('subject', models.CharField(max_length=256)),
+                ('status', models.CharField(max_length=16)),
+                ('retries', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('provider', models.CharField(blank=True, default='', max_length=32)),
+                ('priority', models.IntegerField()),
+                ('created', models.DateTimeField()),
+                ('modified', models.DateTimeField()),
+                ('sent_date', models.DateTimeField(null=True)),
+                ('expired_date', models.DateTimeField(null=True)),
+                ('send_at', models.DateTimeField(null=True)),
+                ('due_at', models.DateTimeField()),
+                ('payload', jsonfield.fields.JSONField(blank=True, default=None, null=True)),
+                ('plain_content', models.TextField(blank=True, null=True)),
+                ('html_content', models.TextField(blank=True, null=True)),
+                ('archived_date', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:18
+
+import api.models.mail
+from collections import Counter
+
+from django.db import migrations, models
+
+COUNT_CHUNK = 1000
+
+
+def blob_keys(payload) -> list:
+    if not isinstance(payload, dict) or not isinstance(payload.get('attachments'), list):
+        return []
+    return [str(file['blob']) for file in payload['attachments'] if isinstance(file, dict) and file.get('blob')]
+
+
+def count_references(apps, schema_editor):
+    # blobs already referenced by the stored mail bodies
+    MailBody = apps.get_model('api', 'MailBody')
+    AttachmentBlob = apps.get_model('api', 'AttachmentBlob')
+    references = Counter()
+    last_id = 0
+    while True:
+        rows = list(MailBody.objects.filter(mail_id__gt=last_id).order_by('mail_id')
+                    .values_list('mail_id', 'payload')[:COUNT_CHUNK])
+        if len(rows) == 0:
+            break
+        for _mail_id, payload in rows:
+            references.update(blob_keys(payload))
+        last_id = rows[-1][0]
+    keys = list(references)
+    for i in range(0, len(keys), COUNT_CHUNK):
+        AttachmentBlob.objects.bulk_create([AttachmentBlob(key=key, references=references[key])
+                                            for key in keys[i:i + COUNT_CHUNK]])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_archived_mail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('references', models.IntegerField(default=0)),
+                ('last_referenced', models.DateTimeField(default=api.models.mail.utc_now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='attachmentblob',
+            index=models.Index(fields=['references', 'last_referenced'], name='api_blob_unreferenced_idx'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
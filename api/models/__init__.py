@@ -1,3 +1,6 @@
+from .archived_mail import ArchivedMail
+from .attachment_blob import AttachmentBlob
 from .client import Client
 from .mail import Mail
+from .mail_body import MailBody
 from .mail_template import MailTemplate
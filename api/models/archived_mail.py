@@ -0,0 +1,34 @@
+from django.db import models
+from jsonfield import JSONField
+
+
+class ArchivedMail(models.Model):
+    """
+    Sent / failed mails moved out of api_mail by the retention job ( see MailRetention ).
+    No foreign keys, so clients and templates could be deleted afterwards.
+    """
+    # same id as on api_mail
+    id = models.IntegerField(primary_key=True)
+    owner_id = models.IntegerField(db_index=True)
+    template_id = models.IntegerField(null=True)
+    from_email = models.CharField(max_length=254)
+    to_email = models.CharField(max_length=1024)
+    cc_email = models.CharField(max_length=1024, blank=True)
+    bcc_email = models.CharField(max_length=1024, blank=True)
+    subject = models.CharField(max_length=256)
+    status = models.CharField(max_length=16)
+    retries = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    provider = models.CharField(max_length=32, blank=True, default='')
+    priority = models.IntegerField()
+    created = models.DateTimeField()
+    modified = models.DateTimeField()
+    sent_date = models.DateTimeField(null=True)
+    expired_date = models.DateTimeField(null=True)
+    send_at = models.DateTimeField(null=True)
+    due_at = models.DateTimeField()
+    # body, null once purged
+    payload = JSONField(null=True, blank=True, default=None)
+    plain_content = models.TextField(null=True, blank=True)
+    html_content = models.TextField(null=True, blank=True)
+    archived_date = models.DateTimeField()
@@ -0,0 +1,59 @@
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import F
+
+from .mail import utc_now
+
+
+class AttachmentBlob(models.Model):
+    """
+    Bookkeeping of the blobs on the AttachmentStore: how many mail bodies reference each one and when it was
+    last referenced, so the retention job could delete the ones no mail uses anymore ( see MailRetention ).
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    references = models.IntegerField(default=0)
+    last_referenced = models.DateTimeField(default=utc_now)
+
+    class Meta:
+        indexes = [
+            # unreferenced blobs, oldest first
+            models.Index(fields=['references', 'last_referenced'], name='api_blob_unreferenced_idx'),
+        ]
+
+    @staticmethod
+    def keys(payload) -> list:
+        """
+        :return: keys of the blobs referenced by a mail payload, once per attachment
+        """
+        if not isinstance(payload, dict) or not isinstance(payload.get('attachments'), list):
+            return []
+        return [str(file['blob']) for file in payload['attachments'] if isinstance(file, dict) and file.get('blob')]
+
+    @staticmethod
+    def reference(keys: list, count: bool = True):
+        """
+        Adds a reference per key ( or only marks them as referenced now if count is False ), creating
+        the missing ones. Should be called before storing the blobs, so they are not collected meanwhile.
+        """
+        counts = Counter(keys)
+        if len(counts) == 0:
+            return
+        now = utc_now()
+        with transaction.atomic():
+            # waits for a collection in progress of any of them
+            existing = set(AttachmentBlob.objects.select_for_update().filter(key__in=list(counts))
+                           .values_list('key', flat=True))
+            AttachmentBlob.objects.bulk_create([AttachmentBlob(key=key, references=0, last_referenced=now)
+                                                for key in counts if key not in existing], ignore_conflicts=True)
+            for key, n in counts.items():
+                AttachmentBlob.objects.filter(key=key).update(references=F('references') + (n if count else 0),
+                                                              last_referenced=now)
+
+    @staticmethod
+    def release(keys: list):
+        """
+        Drops a reference per key, once the body that referenced them is deleted.
+        """
+        for key, n in Counter(keys).items():
+            AttachmentBlob.objects.filter(key=key).update(references=F('references') - n)
@@ -5,39 +5,170 @@ from django.db import models
 from model_utils.models import TimeStampedModel
 
 from .client import Client
+from .mail_body import MailBody
 from .mail_template import MailTemplate
-from jsonfield import JSONField
+
+
+def utc_now() -> datetime:
+    return datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+
+def body_field(name: str) -> property:
+    # reads / writes the field on the mail body, see Mail.get_body
+    def getter(self):
+        return getattr(self.get_body(), name)
+
+    def setter(self, value):
+        setattr(self.get_body(), name, value)
+        self._body_changed = True
+
+    return property(getter, setter)
 
 
 class Mail(TimeStampedModel):
+
+    # delivery state
+    STATUS_PENDING = 'pending'
+    STATUS_LOCKED = 'locked'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_LOCKED, 'Locked'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_EXPIRED, 'Expired'),
+    ]
+
     from_email = models.CharField(max_length=254,blank=False, null=False)
     to_email = models.CharField(max_length=1024, blank=False)
     cc_email = models.CharField(max_length=1024, blank=True)
     bcc_email = models.CharField(max_length=1024, blank=True)
     subject = models.CharField(max_length=256, blank=False)
-    payload = JSONField(blank=True, default='')
-    plain_content = models.TextField(blank=True, default='')
-    html_content = models.TextField(blank=True, default='')
+    # stored on MailBody, loaded on first access
+    payload = body_field('payload')
+    plain_content = body_field('plain_content')
+    html_content = body_field('html_content')
     sent_date = models.DateTimeField(null=True, )
     lock_date = models.DateTimeField(null=True, )
+    # worker that holds the lease started at lock_date
+    lock_owner = models.CharField(max_length=255, blank=True, default='')
     last_error = models.TextField(blank=True, default='')
     retries = models.IntegerField(default=0)
+    # copied from the template on save, so the claim does not join it
+    max_retries = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
     next_retry_date = models.DateTimeField(null=True)
+    # scheduled send, as requested on create
+    send_at = models.DateTimeField(null=True, blank=True)
+    # when it could be claimed: send_at ( or creation ) and then the next retry
+    due_at = models.DateTimeField(default=utc_now)
+    # not sent after it ( template / mail ttl ), see MailQueue.drop_expired
+    expires_at = models.DateTimeField(null=True, blank=True)
+    expired_date = models.DateTimeField(null=True, blank=True)
+    # delivery provider that sent it
+    provider = models.CharField(max_length=32, blank=True, default='')
+    # send lane, copied from the template unless it is set when the mail is created
+    priority = models.IntegerField(choices=MailTemplate.PRIORITY_CHOICES, default=MailTemplate.PRIORITY_NORMAL)
 
     # relations
 
     owner = models.ForeignKey(Client, on_delete=models.DO_NOTHING, null=False, blank=False)
     template = models.ForeignKey(MailTemplate, on_delete=models.SET_NULL, null=True, blank=False)
 
-    def mark_retry(self, last_error:str):
-        if self.retries < self.template.max_retries:
+    class Meta:
+        indexes = [
+            # due pending mails in claim order, the claim cost does not grow with the sent ones
+            models.Index(fields=['status', 'due_at', 'id'], name='api_mail_status_due_idx'),
+            # pending mails of a lane ( see MailQueue.claim )
+            models.Index(fields=['status', 'priority', 'due_at', 'id'], name='api_mail_lane_idx'),
+            # pending mails of a client within a lane, for the fair claim
+            models.Index(fields=['status', 'priority', 'owner', 'due_at', 'id'], name='api_mail_lane_owner_idx'),
+            models.Index(fields=['status', 'expires_at', 'id'], name='api_mail_expiry_idx'),
+        ]
+
+    _body = None
+    _body_changed = False
+
+    def get_body(self) -> MailBody:
+        if self._body is None and self.pk is not None:
+            try:
+                # reverse one to one, honors select_related('body')
+                self._body = self.body
+            except MailBody.DoesNotExist:
+                pass
+        if self._body is None:
+            self._body = MailBody()
+        return self._body
+
+    def save(self, *args, **kwargs):
+        if self.max_retries is None and self.template_id is not None:
+            self.max_retries = self.template.max_retries
+        super().save(*args, **kwargs)
+        if self._body_changed:
+            self._body.mail = self
+            self._body.save()
+            self._body_changed = False
+
+    def get_max_retries(self) -> int:
+        return self.max_retries if self.max_retries is not None else self.template.max_retries
+
+    def release_lock(self):
+        self.lock_date = None
+        self.lock_owner = ''
+        self.status = Mail.STATUS_PENDING
+
+    def mark_retry(self, last_error:str, max_retries:int = None, delay:float = None):
+        if max_retries is None:
+            max_retries = self.get_max_retries()
+        self.release_lock()
+        if self.retries < max_retries:
             self.last_error = last_error
             self.retries += 1
-            self.next_retry_date = datetime.utcnow().replace(tzinfo=pytz.UTC) + timedelta(hours=(1*self.retries))
+            # see RetryPolicy.delay
+            delay = timedelta(hours=(1*self.retries)) if delay is None else timedelta(seconds=delay)
+            self.next_retry_date = utc_now() + delay
+            self.due_at = self.next_retry_date
+        if self.retries >= max_retries:
+            # out of retries
+            self.status = Mail.STATUS_FAILED
+
+    def mark_failed(self, last_error:str, max_retries:int = None):
+        # permanent error, no more retries
+        if max_retries is None:
+            max_retries = self.get_max_retries()
+        self.release_lock()
+        self.last_error = last_error
+        self.retries = max(self.retries, max_retries)
+        self.next_retry_date = None
+        self.status = Mail.STATUS_FAILED
+
+    def mark_throttled(self, last_error:str, delay:float):
+        # rate limited by the provider, retried shortly without consuming a retry
+        self.release_lock()
+        if last_error:
+            self.last_error = last_error
+        self.next_retry_date = utc_now() + timedelta(seconds=delay)
+        self.due_at = self.next_retry_date
+
+    def mark_expired(self):
+        # past its ttl, never sent
+        self.release_lock()
+        self.last_error = 'expired'
+        self.next_retry_date = None
+        self.expired_date = utc_now()
+        self.status = Mail.STATUS_EXPIRED
+
+    @property
+    def is_expired(self) -> bool:
+        return self.expired_date is not None
 
     @property
     def is_sent(self)-> bool:
         return self.sent_date is not None
 
     def mark_as_sent(self):
-        self.sent_date = datetime.utcnow().replace(tzinfo=pytz.UTC)
\ No newline at end of file
+        self.release_lock()
+        self.sent_date = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        self.status = Mail.STATUS_SENT
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.db import models
+from jsonfield import JSONField
+
+
+class MailBody(models.Model):
+    """
+    Heavy columns of a mail ( rendered contents and payload, that could carry base64 attachments ),
+    kept out of the api_mail rows that the queue and the list endpoints read.
+    """
+    mail = models.OneToOneField('api.Mail', on_delete=models.CASCADE, primary_key=True, related_name='body')
+    payload = JSONField(blank=True, default='')
+    plain_content = models.TextField(blank=True, default='')
+    html_content = models.TextField(blank=True, default='')
@@ -3,10 +3,21 @@ from django.utils.translation import ugettext_lazy as _
 from model_utils.models import TimeStampedModel
 import re
 from .client import Client
+from jsonfield import JSONField
 
 
 class MailTemplate(TimeStampedModel):
 
+    # send lanes, higher ones are claimed first ( see MailQueue.claim )
+    PRIORITY_BULK = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_TRANSACTIONAL = 2
+    PRIORITY_CHOICES = [
+        (PRIORITY_BULK, 'Bulk'),
+        (PRIORITY_NORMAL, 'Normal'),
+        (PRIORITY_TRANSACTIONAL, 'Transactional'),
+    ]
+
     from_email = models.CharField(max_length=254,blank=False, null=False)
     identifier = models.SlugField(blank=False, max_length=255, unique=True)
     # @see https://stackoverflow.com/questions/46554484/use-emoticon-in-subject-line-for-sendgrid-email
@@ -17,6 +28,13 @@ class MailTemplate(TimeStampedModel):
     # @see https://mjml.io/
     mjml_content = models.TextField(blank=True, default='')
     max_retries = models.IntegerField(default=1)
+    # overrides SEND_EMAILS_RETRY_POLICY per error class, see RetryPolicy
+    retry_policy = JSONField(blank=True, null=True, default=None)
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL)
+    # optional send rate cap ( mails per minute ), enforced by the dispatcher
+    max_per_minute = models.PositiveIntegerField(null=True, blank=True, default=None)
+    # seconds a mail is worth sending once it is due ( ie OTPs ), after that it is dropped unsent
+    ttl = models.PositiveIntegerField(null=True, blank=True, default=None)
     is_active = models.BooleanField(default=False)
     is_system = models.BooleanField(default=False)
 
@@ -2,3 +2,4 @@ from .timestamp_field import TimestampField
 from .client import ClientReadSerializer, ClientWriteSerializer
 from .mail_template import MailTemplateReadSerializer, MailTemplateWriteSerializer
 from .mail import MailReadSerializer, MailWriteSerializer
+from .attachment import AttachmentWriteSerializer
@@ -0,0 +1,39 @@
+from django.utils.translation import ugettext_lazy as _
+from django_injector import inject
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.serializers import ValidationError
+
+from ..models import AttachmentBlob
+from ..services import AttachmentStore
+from ..utils import config
+
+
+class AttachmentWriteSerializer(serializers.Serializer):
+    """
+    Uploads an attachment to the AttachmentStore, so it could be sent by reference ( blob ) on any
+    number of mails instead of inline.
+    """
+    file = serializers.FileField(write_only=True, allow_empty_file=False)
+    blob = serializers.CharField(read_only=True)
+    size = serializers.IntegerField(read_only=True)
+
+    @inject
+    def __init__(self, instance=None, data=empty, attachment_store:AttachmentStore = None, **kwargs):
+        super().__init__(instance, data, **kwargs)
+        self.attachment_store = attachment_store
+
+    def validate_file(self, file):
+        if self.attachment_store is None:
+            raise ValidationError(_("there is no attachment store configured."))
+        max_size = int(config('ATTACHMENT_MAX_SIZE', 20 * 1024 * 1024))
+        if file.size > max_size:
+            raise ValidationError(_("attachment is over {max_size} bytes.".format(max_size=max_size)))
+        return file
+
+    def create(self, validated_data):
+        content = b''.join(validated_data['file'].chunks())
+        key = self.attachment_store.key(content)
+        # not referenced by any mail yet, kept for the retention window
+        AttachmentBlob.reference([key], count=False)
+        return {'blob': self.attachment_store.put(content), 'size': len(content)}
@@ -1,17 +1,31 @@
+import base64
+import binascii
 import logging
+from datetime import timedelta
 
 from django.core.validators import EmailValidator
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
-from rest_framework.fields import SerializerMethodField
+from django_injector import inject
+from rest_framework.fields import SerializerMethodField, empty
 from rest_framework.serializers import ValidationError
 
 from . import MailTemplateReadSerializer
 from . import TimestampField
-from ..models import MailTemplate, Client, Mail
+from ..models import AttachmentBlob, MailTemplate, Client, Mail, MailBody
+from ..models.mail import utc_now
+from ..services import AttachmentFetcher, AttachmentStore, MailNotifier
 from ..utils import is_empty, JinjaRender
 
 
+class MailBodySerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = MailBody
+        fields = ['payload', 'plain_content', 'html_content']
+
+
 class MailReadSerializer(serializers.ModelSerializer):
     created = TimestampField()
     modified = TimestampField()
@@ -33,6 +47,13 @@ class MailReadSerializer(serializers.ModelSerializer):
         str_expand = request.GET.get('expand', '') if request else None
         return str_expand.split(',') if str_expand else []
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # heavy columns only when asked for
+        if 'body' in self.get_expand():
+            data.update(MailBodySerializer(instance.get_body()).data)
+        return data
+
     class Meta:
         model = Mail
         fields = '__all__'
@@ -47,9 +68,23 @@ class MailWriteSerializer(serializers.ModelSerializer):
                                             allow_null=False)
     payload = serializers.JSONField()
     subject = serializers.CharField(required=False)
+    # overrides the template priority
+    priority = serializers.ChoiceField(choices=MailTemplate.PRIORITY_CHOICES, required=False)
+    # epoch, the mail is not sent before it
+    send_at = TimestampField(required=False)
+    # seconds it is worth sending once due, overrides the template ttl
+    ttl = serializers.IntegerField(required=False, min_value=1, write_only=True)
     created = TimestampField(read_only=True)
     modified = TimestampField(read_only=True)
 
+    @inject
+    def __init__(self, instance=None, data=empty, mail_notifier:MailNotifier = None,
+                 attachment_store:AttachmentStore = None, attachment_fetcher:AttachmentFetcher = None, **kwargs):
+        super().__init__(instance, data, **kwargs)
+        self.mail_notifier = mail_notifier
+        self.attachment_store = attachment_store
+        self.attachment_fetcher = attachment_fetcher
+
     def get_current_client_id(self):
         request = self.context.get('request')
         token_info = request.auth
@@ -119,8 +154,67 @@ class MailWriteSerializer(serializers.ModelSerializer):
         if is_empty(subject):
             data['subject'] = template.subject
 
+        if data.get('priority') is None:
+            data['priority'] = template.priority
+
+        data['due_at'] = data['send_at'] if data.get('send_at') is not None else utc_now()
+
+        ttl = data.pop('ttl', None) or template.ttl
+        if ttl:
+            data['expires_at'] = data['due_at'] + timedelta(seconds=ttl)
+
         return data
 
+    def extract_attachments(self, payload):
+        """
+        Moves the attachments content to the AttachmentStore, the payload only keeps its key ( blob ).
+        Attachments could also be sent by reference, as a previously uploaded blob or as an url fetched
+        when the mail is sent.
+        """
+        if not isinstance(payload, dict) or not isinstance(payload.get('attachments'), list):
+            return payload
+        files = []
+        contents = {}
+        for file in payload['attachments']:
+            if not isinstance(file, dict):
+                files.append(file)
+                continue
+            if not is_empty(file.get('content')):
+                if self.attachment_store is None:
+                    files.append(file)
+                    continue
+                try:
+                    content = base64.b64decode(file['content'], validate=True)
+                except (binascii.Error, ValueError, TypeError):
+                    raise ValidationError(_("attachment {name} content is not valid base64.".format(
+                        name=file.get('name'))))
+                file = dict(file)
+                del file['content']
+                file['blob'] = AttachmentStore.key(content)
+                file['size'] = len(content)
+                contents[file['blob']] = content
+            elif not is_empty(file.get('blob')):
+                if self.attachment_store is None or not self.attachment_store.exists(str(file['blob'])):
+                    raise ValidationError(_("attachment {blob} not found.".format(blob=file['blob'])))
+            elif not is_empty(file.get('url')):
+                if self.attachment_fetcher is None or not self.attachment_fetcher.is_allowed(str(file['url'])):
+                    raise ValidationError(_("attachment url {url} is not allowed.".format(url=file['url'])))
+            files.append(file)
+        payload = dict(payload)
+        payload['attachments'] = files
+
+        keys = AttachmentBlob.keys(payload)
+        if len(keys) > 0:
+            # referenced before they are stored, so the retention job does not collect them meanwhile
+            AttachmentBlob.reference(keys)
+            for content in contents.values():
+                self.attachment_store.put(content)
+            for key in set(keys) - set(contents):
+                # could have been collected since it was checked
+                if not self.attachment_store.exists(key):
+                    raise ValidationError(_("attachment {blob} not found.".format(blob=key)))
+        return payload
+
     def create(self, validated_data):
         payload = validated_data['payload'] if 'payload' in validated_data else []
         render = JinjaRender()
@@ -143,7 +237,14 @@ class MailWriteSerializer(serializers.ModelSerializer):
 
         # inject variables to subject
         instance.subject = render.render_subject(instance.subject, payload)
-        instance.save()
+        with transaction.atomic():
+            # blob references are only counted if the mail is stored
+            instance.payload = self.extract_attachments(payload)
+            instance.save()
+
+        if self.mail_notifier is not None:
+            # wake up the idle send workers once the mail is visible to them
+            transaction.on_commit(self.mail_notifier.notify)
 
         logging.getLogger('serializers').debug('MailWriteSerializer.create plain_content {plain_content} html_content '
                                                '{html_content}'.format(plain_content=plain, html_content=html))
@@ -151,5 +252,6 @@ class MailWriteSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Mail
-        fields = ['created', 'modified', 'to_email','cc_email','bcc_email', 'template', 'payload', 'subject']
+        fields = ['created', 'modified', 'to_email','cc_email','bcc_email', 'template', 'payload', 'subject', 'priority',
+                  'send_at', 'ttl']
         read_only_fields = ['html_content', 'plain_content']
@@ -6,7 +6,7 @@ from rest_framework.fields import SerializerMethodField
 from rest_framework.serializers import ValidationError
 from . import TimestampField, ClientReadSerializer
 from ..models import MailTemplate, Client
-from ..utils import is_empty, JinjaRender
+from ..utils import is_empty, JinjaRender, RetryPolicy
 from ..services import VCSService
 from django_injector import inject
 from rest_framework.fields import empty
@@ -21,6 +21,7 @@ class MailTemplateReadSerializer(serializers.ModelSerializer):
     parent = SerializerMethodField("get_parent_serializer")
     allowed_clients = SerializerMethodField("get_allowed_clients_serializer")
     versions = SerializerMethodField("get_versions_serializer")
+    retry_policy = serializers.JSONField(required=False, allow_null=True)
 
     @inject
     def __init__(self, instance=None, data=empty, vcs_service:VCSService = None, **kwargs):
@@ -87,6 +88,7 @@ class MailTemplateWriteSerializer(serializers.ModelSerializer):
     parent = serializers.PrimaryKeyRelatedField(many=False, queryset=MailTemplate.objects.all(), required=False, allow_null=True)
     allowed_clients = serializers.PrimaryKeyRelatedField(many=True, queryset=Client.objects.all(), required=False)
     versions = SerializerMethodField("get_versions_serializer")
+    retry_policy = serializers.JSONField(required=False, allow_null=True)
 
     def get_current_user_name(self):
         request = self.context.get('request')
@@ -178,6 +180,13 @@ class MailTemplateWriteSerializer(serializers.ModelSerializer):
         parent = data['parent'] if 'parent' in data else None
         html_content = data['html_content'] if 'html_content' in data else None
         plain_content = data['plain_content'] if 'plain_content' in data else None
+        retry_policy = data['retry_policy'] if 'retry_policy' in data else None
+
+        if retry_policy:
+            try:
+                RetryPolicy.validate(retry_policy)
+            except ValueError as e:
+                raise ValidationError(_("Invalid retry policy: {error}.".format(error=e)))
 
         # content validation
         render = JinjaRender()
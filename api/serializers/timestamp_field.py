@@ -1,10 +1,18 @@
+import calendar
+from datetime import datetime
+
+import pytz
 from rest_framework import serializers
-import time
 
 
 class TimestampField(serializers.Field):
     def to_internal_value(self, data):
-        pass
+        # epoch ( seconds, UTC )
+        try:
+            return datetime.utcfromtimestamp(int(data)).replace(tzinfo=pytz.UTC)
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise serializers.ValidationError('invalid timestamp.')
 
     def to_representation(self, value):
-        return int(time.mktime(value.timetuple()))
\ No newline at end of file
+        # UTC as well, whatever the host timezone is
+        return calendar.timegm(value.utctimetuple())
\ No newline at end of file
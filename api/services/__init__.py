@@ -1,2 +1,10 @@
 from .email_service import EmailService
-from .vcs_service import VCSService
\ No newline at end of file
+from .vcs_service import VCSService
+from .mail_notifier import MailNotifier
+from .worker_registry import WorkerRegistry
+from .rate_limiter import RateLimiter
+from .delivery_provider import DeliveryProvider, DeliveryResponse
+from .mail_archive import MailArchive
+from .mail_retention import MailRetention
+from .attachment_store import AttachmentStore
+from .attachment_fetcher import AttachmentFetcher
@@ -0,0 +1,86 @@
+import ipaddress
+import socket
+from abc import abstractmethod
+from urllib.parse import urlparse
+
+from api.utils import config
+
+
+class AttachmentFetcher:
+    """
+    Fetches the attachments sent by reference ( url ) instead of inline, when the mails are built.
+    Urls are only fetched from the hosts on ATTACHMENT_FETCH_ALLOWED_HOSTS ( none by default ), `*` allows
+    any host resolving to public addresses only, so a client could not make the workers read ( and mail )
+    internal resources.
+    """
+
+    ANY_HOST = '*'
+
+    class RejectedException(Exception):
+        """
+        The attachment would be rejected on every retry ( url not allowed, over the size limit ).
+        """
+        pass
+
+    def __init__(self, allowed_hosts: list = None):
+        if allowed_hosts is None:
+            allowed_hosts = [host.strip().lower() for host in
+                             config('ATTACHMENT_FETCH_ALLOWED_HOSTS', '').split(',') if host.strip()]
+        self.allowed_hosts = allowed_hosts
+
+    def is_allowed(self, url: str) -> bool:
+        """
+        Only http(s) urls on the allowed hosts, does not resolve the host ( see check ).
+        """
+        try:
+            parsed = urlparse(url)
+            host = parsed.hostname
+        except (TypeError, ValueError, AttributeError):
+            return False
+        if parsed.scheme not in ('http', 'https') or not host:
+            return False
+        return host.lower() in self.allowed_hosts or AttachmentFetcher.ANY_HOST in self.allowed_hosts
+
+    def resolve(self, host: str) -> list:
+        """
+        :return: the addresses the host resolves to
+        """
+        try:
+            return [info[4][0].split('%')[0] for info in socket.getaddrinfo(host, None)]
+        except (socket.gaierror, UnicodeError):
+            return []
+
+    @staticmethod
+    def is_public(address: str) -> bool:
+        """
+        :return: True if the address is a public one ( not loopback, private, link local, ... )
+        """
+        ip = ipaddress.ip_address(address)
+        if getattr(ip, 'ipv4_mapped', None) is not None:
+            ip = ip.ipv4_mapped
+        return ip.is_global and not ip.is_multicast
+
+    def check(self, url: str) -> str:
+        """
+        :return: the checked address the url must be requested on, so the host is not resolved again
+        ( dns rebinding ), None for the hosts listed one by one
+        :raises AttachmentFetcher.RejectedException: if the url should not be fetched
+        """
+        if not self.is_allowed(url):
+            raise AttachmentFetcher.RejectedException('attachment url {url} is not allowed'.format(url=url))
+        host = urlparse(url).hostname.lower()
+        # hosts listed one by one are trusted, the wildcard only reaches public addresses
+        if host in self.allowed_hosts:
+            return None
+        addresses = self.resolve(host)
+        if len(addresses) == 0 or not all(self.is_public(address) for address in addresses):
+            raise AttachmentFetcher.RejectedException('attachment url {url} is not public'.format(url=url))
+        return addresses[0]
+
+    @abstractmethod
+    def fetch(self, url: str) -> bytes:
+        """
+        :raises AttachmentFetcher.RejectedException: if the url is not allowed or its content is over the size limit
+        :raises Exception: if the url could not be fetched
+        """
+        pass
@@ -0,0 +1,39 @@
+import hashlib
+from abc import abstractmethod
+
+
+class AttachmentStore:
+    """
+    Content addressed blob store for the mails attachments: each blob is keyed by the sha256 of its
+    content, so the same file sent to thousands of recipients is stored once.
+    """
+
+    @staticmethod
+    def key(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    @abstractmethod
+    def put(self, content: bytes) -> str:
+        """
+        Stores the content ( once ).
+        :return: its key
+        """
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """
+        :raises KeyError: if there is no blob with the given key
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        """
+        Deletes the blob, if it is still there.
+        """
+        pass
@@ -0,0 +1,76 @@
+from abc import abstractmethod
+from typing import NamedTuple
+
+from api.utils import is_empty, config
+
+
+class DeliveryResponse(NamedTuple):
+    status_code: int
+    body: str
+    headers: dict
+
+
+class DeliveryProvider:
+    """
+    Delivers the mails handed by the dispatcher ( see MailDispatcher ).
+    A request could carry several mails that share from, subject and content ( one
+    personalization each ), up to max_batch mails and max_recipients recipients.
+    Rate limit and circuit breaker settings of each provider are read using its settings_prefix
+    ( ie {settings_prefix}_RATE_LIMIT ), rate_limit is the default sends per second ( 0 = unlimited ).
+    """
+
+    name = None
+    settings_prefix = None
+    rate_limit = 0
+    max_batch = 1
+    max_recipients = 1000
+
+    @abstractmethod
+    def build(self, snapshots: list):
+        """
+        Builds the provider request for the given MailSnapshot list.
+        :raises Exception: if the mails could not be built ( it will not be retried )
+        """
+        pass
+
+    @abstractmethod
+    def send(self, message) -> DeliveryResponse:
+        """
+        Sends a request built by build.
+        Provider errors are returned as a response with its status code, only
+        transport errors ( timeouts, connection errors ) are raised.
+        """
+        pass
+
+    def quota(self, response: DeliveryResponse) -> tuple:
+        """
+        :return: ( remaining requests, epoch when the quota window resets ) if the provider reports it
+        """
+        return None
+
+    def rejected(self, response: DeliveryResponse, count: int) -> list:
+        """
+        :param count: mails on the rejected request
+        :return: indexes of the mails a permanent error points at, None if it applies to the whole request
+        or the provider does not tell
+        """
+        return None
+
+    def describe(self, message) -> str:
+        return str(message)
+
+    @staticmethod
+    def recipients(m) -> tuple:
+        """
+        :return: ( to, cc, bcc ) lists, on DEBUG mode all the mails are redirected to DEV_EMAIL
+        """
+        if config('DEBUG', False):
+            return [config('DEV_EMAIL')], [], []
+        return tuple(emails.split(',') if not is_empty(emails) else [] for emails in [m.to_email, m.cc_email,
+                                                                                       m.bcc_email])
+
+    @staticmethod
+    def attachments(m) -> list:
+        if not m.payload or not isinstance(m.payload, dict) or 'attachments' not in m.payload:
+            return []
+        return [file for file in m.payload['attachments'] if 'content' in file and 'type' in file and 'name' in file]
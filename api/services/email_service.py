@@ -4,5 +4,17 @@ from abc import abstractmethod
 class EmailService:
 
     @abstractmethod
-    def process_pending_emails(self, batch:int) -> int:
+    def process_pending_emails(self, batch:int, concurrency:int = None, shard:tuple = None) -> int:
+        pass
+
+    def next_due(self) -> float:
+        """
+        :return: seconds until the next scheduled email is due, None if unknown or there is none
+        """
+        return None
+
+    def stop(self):
+        """
+        Asks the service to drain: in flight emails are finished and no new ones are started.
+        """
         pass
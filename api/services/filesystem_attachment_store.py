@@ -0,0 +1,50 @@
+import os
+import uuid
+
+from api.services.attachment_store import AttachmentStore
+from api.utils import config
+
+
+class FileSystemAttachmentStore(AttachmentStore):
+    """
+    Blobs stored as files on ATTACHMENT_STORE_DIR, fanned out by the first bytes of the key
+    ( ab/cd/abcd... ) so no directory gets too big. Could be a shared volume between the api and the workers.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root if root else config('ATTACHMENT_STORE_DIR')
+        if not self.root:
+            # a host local directory would not be found by the workers on other hosts
+            raise Exception('FileSystemAttachmentStore ATTACHMENT_STORE_DIR is missing')
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[0:2], key[2:4], key)
+
+    def put(self, content: bytes) -> str:
+        key = self.key(content)
+        path = self.path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # readers never see a partial blob
+        tmp = '{path}.{id}.tmp'.format(path=path, id=uuid.uuid4().hex)
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+        return key
+
+    def get(self, key: str) -> bytes:
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from api.services.attachment_fetcher import AttachmentFetcher
+from api.utils import config
+
+
+class PinnedHostAdapter(HTTPAdapter):
+    """
+    https requests sent to a pinned address, the certificate is checked ( and SNI sent ) for the host name.
+    """
+
+    def __init__(self, host: str, **kwargs):
+        self.host = host
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['server_hostname'] = self.host
+        kwargs['assert_hostname'] = self.host
+        super().init_poolmanager(*args, **kwargs)
+
+
+class HttpAttachmentFetcher(AttachmentFetcher):
+    """
+    Fetches the attachments over http(s) thru a LRU disk cache on ATTACHMENT_CACHE_DIR ( up to
+    ATTACHMENT_CACHE_SIZE bytes ). Cached entries are served as is for ATTACHMENT_CACHE_MAX_AGE seconds, then
+    revalidated with their ETag / Last-Modified, so an unchanged file is not downloaded again.
+    Contents over ATTACHMENT_MAX_SIZE bytes are rejected without reading them whole.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    MAX_REDIRECTS = 5
+
+    def __init__(self, cache_dir: str = None, cache_size: int = None, max_size: int = None, max_age: float = None,
+                 timeout: float = None, allowed_hosts: list = None):
+        super().__init__(allowed_hosts)
+        self.cache_dir = cache_dir if cache_dir else config('ATTACHMENT_CACHE_DIR') or \
+            os.path.join(config('BASE_DIR'), 'attachments_cache')
+        self.cache_size = int(cache_size if cache_size is not None else
+                              config('ATTACHMENT_CACHE_SIZE', 512 * 1024 * 1024))
+        self.max_size = int(max_size if max_size is not None else config('ATTACHMENT_MAX_SIZE', 20 * 1024 * 1024))
+        self.max_age = float(max_age if max_age is not None else config('ATTACHMENT_CACHE_MAX_AGE', 300))
+        self.timeout = float(timeout if timeout is not None else config('ATTACHMENT_FETCH_TIMEOUT', 30))
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def fetch(self, url: str) -> bytes:
+        # resolved and checked when requested, see _get
+        if not self.is_allowed(url):
+            raise AttachmentFetcher.RejectedException('attachment url {url} is not allowed'.format(url=url))
+
+        path = self.path(url)
+        meta = self._read_meta(path)
+        if meta is not None and time.time() - meta.get('fetched', 0) < self.max_age:
+            content = self._read(path)
+            if content is not None:
+                return content
+
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self._get(url, headers)
+        try:
+            if response.status_code == 304 and headers:
+                content = self._read(path)
+                if content is not None:
+                    logging.getLogger('jobs').debug('HttpAttachmentFetcher.fetch {url} not modified'.format(url=url))
+                    meta['fetched'] = time.time()
+                    self._write(path + '.json', json.dumps(meta).encode('utf-8'))
+                    return content
+                # evicted in the meantime, download it again
+                response.close()
+                response = self._get(url, {})
+            content = self._download(url, response)
+        finally:
+            response.close()
+
+        if 'no-store' not in response.headers.get('Cache-Control', ''):
+            self._store(path, content, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched': time.time(),
+            })
+        return content
+
+    def _get(self, url: str, headers: dict):
+        """
+        Follows the redirects one by one, each target is checked before requesting it.
+        """
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = self._request(url, self.check(url), headers)
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers['Location'])
+        raise AttachmentFetcher.RejectedException('attachment url {url} has too many redirects'.format(url=url))
+
+    def _request(self, url: str, address: str, headers: dict):
+        """
+        Requests the url on the address it was checked with ( if any ), keeping its host name.
+        """
+        if address is None:
+            return self.session.get(url, headers=headers, stream=True, timeout=self.timeout, allow_redirects=False)
+        parsed = urlparse(url)
+        host = '[{host}]'.format(host=parsed.hostname) if ':' in parsed.hostname else parsed.hostname
+        port = ':{port}'.format(port=parsed.port) if parsed.port else ''
+        netloc = '[{address}]'.format(address=address) if ':' in address else address
+        headers = dict(headers, Host=host + port)
+        session = self.session
+        if parsed.scheme == 'https':
+            session = requests.Session()
+            session.mount('https://', PinnedHostAdapter(parsed.hostname))
+        return session.get(parsed._replace(netloc=netloc + port).geturl(), headers=headers, stream=True,
+                           timeout=self.timeout, allow_redirects=False)
+
+    def _download(self, url: str, response) -> bytes:
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        if length is not None and length.isdigit() and int(length) > self.max_size:
+            raise AttachmentFetcher.RejectedException('attachment {url} is over {max_size} bytes'.format(
+                url=url, max_size=self.max_size))
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(self.CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_size:
+                raise AttachmentFetcher.RejectedException('attachment {url} is over {max_size} bytes'.format(
+                    url=url, max_size=self.max_size))
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _read_meta(self, path: str):
+        try:
+            with open(path + '.json', 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _read(path: str):
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        # recently used, last to be evicted
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return content
+
+    @staticmethod
+    def _write(path: str, content: bytes):
+        # readers never see a partial entry
+        tmp = '{path}.{id}.tmp'.format(path=path, id=uuid.uuid4().hex)
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def _store(self, path: str, content: bytes, meta: dict):
+        if len(content) > self.cache_size:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._write(path, content)
+            self._write(path + '.json', json.dumps(meta).encode('utf-8'))
+            self._evict()
+        except OSError as e:
+            # the cache is just an optimization
+            logging.getLogger('jobs').warning('HttpAttachmentFetcher could not cache {url}: {error}'.format(
+                url=meta['url'], error=e))
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache fits on cache_size.
+        """
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.json') or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            if total <= self.cache_size:
+                return
+            for _, size, path in sorted(entries):
+                for name in (path, path + '.json'):
+                    try:
+                        os.remove(name)
+                    except OSError:
+                        pass
+                total -= size
+                if total <= self.cache_size:
+                    return
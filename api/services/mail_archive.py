@@ -0,0 +1,18 @@
+from abc import abstractmethod
+
+
+class MailArchive:
+    """
+    Cold storage for the mails removed from api_mail by the retention job ( see MailRetention ).
+    """
+
+    @abstractmethod
+    def write(self, rows: list):
+        """
+        Stores a chunk of mails, it should be durable once it returns since the rows are deleted afterwards.
+        :param rows: dicts with the header ( see MailRetention.FIELDS ) and body fields of each mail
+        """
+        pass
+
+    def close(self):
+        pass
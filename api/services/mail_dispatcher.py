@@ -0,0 +1,687 @@
+import base64
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.utils.translation import ugettext_lazy as _
+
+from api.models import Mail
+from api.services import EmailService, RateLimiter
+from api.services.attachment_fetcher import AttachmentFetcher
+from api.services.attachment_store import AttachmentStore
+from api.services.delivery_provider import DeliveryProvider
+from api.services.mail_queue import MailQueue, MailSnapshot
+from api.utils import is_empty, config, Pipeline, CircuitBreaker, RetryPolicy
+
+
+class MailDispatcher(EmailService):
+    """
+    Claims pending mails from the queue and runs them through the build -> send -> ack stages
+    against one or more DeliveryProvider ( routes ), each one guarded by a shared rate limiter and
+    its own circuit breaker, and retries the failed ones following a retry policy.
+    With several routes each chunk of mails goes to a healthy route with quota left ( the first one on
+    failover strategy, a weighted pick on weighted strategy ), and the mails that fail with a retryable
+    error fail over to the next route right away.
+    """
+
+    FAILOVER = 'failover'
+    WEIGHTED = 'weighted'
+
+    class Route:
+        """
+        A provider with its own circuit breaker, rate limit and last quota reported.
+        Settings are read using the provider settings_prefix, ie SEND_GRID_RATE_LIMIT, SEND_GRID_CIRCUIT_WINDOW.
+        """
+
+        def __init__(self, provider: DeliveryProvider, weight: float = 1):
+            self.provider = provider
+            self.weight = max(0.0, float(weight))
+            prefix = provider.settings_prefix
+            self.rate = float(config('{prefix}_RATE_LIMIT'.format(prefix=prefix), provider.rate_limit))
+            self.burst = int(config('{prefix}_RATE_LIMIT_BURST'.format(prefix=prefix), max(self.rate, 1)))
+            self.breaker = CircuitBreaker(provider.name,
+                                          error_rate=float(config('{prefix}_CIRCUIT_ERROR_RATE'.format(prefix=prefix),
+                                                                  0.5)),
+                                          window=int(config('{prefix}_CIRCUIT_WINDOW'.format(prefix=prefix), 20)),
+                                          min_calls=int(config('{prefix}_CIRCUIT_MIN_CALLS'.format(prefix=prefix), 10)),
+                                          open_timeout=float(config('{prefix}_CIRCUIT_OPEN_TIMEOUT'.format(
+                                              prefix=prefix), 30)),
+                                          ramp_period=float(config('{prefix}_CIRCUIT_RAMP_PERIOD'.format(
+                                              prefix=prefix), 120)))
+            # ( remaining, reset ) as reported by the provider on the last response
+            self.quota = None
+            # a half open route gets a single probe per poll
+            self.probing = False
+
+        @property
+        def name(self) -> str:
+            return self.provider.name
+
+        def exhausted(self) -> bool:
+            return self.quota is not None and self.quota[0] <= 0 and self.quota[1] > time.time()
+
+        def available(self) -> bool:
+            return self.weight > 0 and not self.exhausted() and self.breaker.allow()
+
+        def half_open(self) -> bool:
+            return self.breaker.state == CircuitBreaker.HALF_OPEN
+
+    class Envelope(NamedTuple):
+        # mails sent on a single request, one personalization each
+        snapshots: list
+        # provider request, see DeliveryProvider.build
+        mail: object
+        error: str
+        route: object = None
+        # seconds to wait before sending them ( template send rate cap )
+        throttle: float = None
+        # see RetryPolicy.classify, for the errors found building the request
+        error_class: str = None
+        # single request let through a half open route
+        probe: bool = False
+        # a rejected group is split to find the rejected mails, see MailDispatcher._split
+        split: bool = True
+
+    class Outcome(NamedTuple):
+        mail_id: int
+        retries: int
+        max_retries: int
+        sent: bool
+        error: str
+        # see RetryPolicy.classify
+        error_class: str = None
+        # seconds to requeue the mail after, without consuming a retry ( rate limited )
+        throttle: float = None
+        retry_policy: dict = None
+        # route that sent it
+        provider: str = None
+        # past its ttl before it was sent
+        expired: bool = False
+
+        @staticmethod
+        def of(snapshot: MailSnapshot, sent: bool, error: str = None, error_class: str = None,
+               throttle: float = None, provider: str = None, expired: bool = False):
+            return MailDispatcher.Outcome(mail_id=snapshot.id, retries=snapshot.retries,
+                                          max_retries=snapshot.max_retries, sent=sent, error=error,
+                                          error_class=error_class, throttle=throttle,
+                                          retry_policy=snapshot.retry_policy, provider=provider, expired=expired)
+
+    def __init__(self, routes, rate_limiter: RateLimiter = None, strategy: str = None,
+                 attachment_store: AttachmentStore = None, attachment_fetcher: AttachmentFetcher = None):
+        """
+        :param routes: a DeliveryProvider, or a list of DeliveryProvider / MailDispatcher.Route in failover order
+        :param attachment_store: where the attachments extracted on create are read from
+        :param attachment_fetcher: fetches the attachments sent by reference ( url )
+        """
+        super().__init__()
+        if not isinstance(routes, (list, tuple)):
+            routes = [routes]
+        self.routes = [r if isinstance(r, MailDispatcher.Route) else MailDispatcher.Route(r) for r in routes]
+        self.strategy = strategy if strategy else config('EMAIL_DELIVERY_STRATEGY', MailDispatcher.FAILOVER)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = RetryPolicy()
+        self.queue = MailQueue()
+        # mails dropped unsent past their ttl since the worker started
+        self.expired = 0
+        self.ack_batch = int(config('SEND_EMAILS_JOB_ACK_BATCH', 100))
+        self.load_batch = int(config('SEND_EMAILS_JOB_LOAD_BATCH', 500))
+        self.stopping = threading.Event()
+        self.attachment_store = attachment_store
+        self.attachment_fetcher = attachment_fetcher
+        # base64 content of the blobs / urls read on the current poll, shared by all the mails that carry them
+        self.blobs = {}
+        self.blobs_size = 0
+        self.blobs_max_size = int(config('SEND_EMAILS_BLOB_CACHE_SIZE', 64 * 1024 * 1024))
+        self.blobs_lock = threading.Lock()
+        # concurrent builds of mails carrying the same blob wait for a single read
+        self.blob_locks = {}
+
+    @property
+    def provider(self) -> DeliveryProvider:
+        # primary route
+        return self.routes[0].provider
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self.routes[0].breaker
+
+    def stop(self):
+        self.stopping.set()
+
+    def next_due(self) -> float:
+        return self.queue.next_due()
+
+    def _route(self, exclude: list = None):
+        """
+        :return: the route for the next mails, None if all of them are down or out of quota
+        """
+        # recovering ( half open ) routes only get a probe, see _probe_route
+        candidates = [r for r in self.routes if (exclude is None or r not in exclude) and r.available() and
+                      not r.half_open()]
+        if len(candidates) == 0:
+            return None
+        if self.strategy == MailDispatcher.WEIGHTED and len(candidates) > 1:
+            # routes ramping up after an outage get a smaller share
+            weights = [r.weight * max(r.breaker.capacity(), 0.01) for r in candidates]
+            return random.choices(candidates, weights=weights)[0]
+        return candidates[0]
+
+    def _probe_route(self):
+        """
+        :return: a half open route that did not get its probe on this poll yet ( it is taken ), None otherwise
+        """
+        for r in self.routes:
+            if not r.probing and r.weight > 0 and not r.exhausted() and r.half_open():
+                r.probing = True
+                return r
+        return None
+
+    def _feed(self, mail_ids: list):
+        for i in range(0, len(mail_ids), self.load_batch):
+            # on drain, claimed mails not started yet are given back to the queue
+            if self.stopping.is_set():
+                return
+            # all routes down, the envelopes are requeued by the send stage
+            route = self._route() or self.routes[0]
+            snapshots, capped = self._cap(self.queue.snapshots(mail_ids[i:i + self.load_batch]))
+            for delay, group in capped:
+                yield MailDispatcher.Envelope(snapshots=group, mail=None, error=None, route=route, throttle=delay)
+            # a single mail probes each recovering route
+            while len(snapshots) > 0:
+                probe = self._probe_route()
+                if probe is None:
+                    break
+                for envelope in self._group(snapshots[:1], probe):
+                    yield envelope._replace(probe=True)
+                snapshots = snapshots[1:]
+            for envelope in self._group(snapshots, route):
+                if self.stopping.is_set():
+                    return
+                yield envelope
+
+    def process_pending_emails(self, batch: int, concurrency: int = None, shard: tuple = None) -> int:
+
+        logging.getLogger('jobs').debug('MailDispatcher.process_pending_emails batch {batch}'.format(batch=batch))
+
+        if self.stopping.is_set():
+            return 0
+
+        # providers are down, nothing is claimed until a circuit lets a probe through
+        routes = [r for r in self.routes if r.breaker.allow()]
+        if len(routes) == 0:
+            logging.getLogger('jobs').info('MailDispatcher.process_pending_emails circuits open, '
+                                           'retrying in {seconds} seconds'.format(
+                                               seconds=min(r.breaker.retry_in() for r in self.routes)))
+            return 0
+
+        for r in self.routes:
+            r.probing = False
+        concurrency = int(concurrency if concurrency else config('SEND_EMAILS_JOB_CONCURRENCY', 1))
+        if all(r.breaker.state == CircuitBreaker.HALF_OPEN for r in routes):
+            # a single mail probes the provider
+            batch, concurrency = 1, 1
+        else:
+            # slow start after an outage
+            capacity = max(r.breaker.capacity() for r in routes)
+            batch = max(1, int(int(batch) * capacity))
+            concurrency = max(1, int(concurrency * capacity))
+
+        # give back to the queue the leases of dead workers
+        if self.queue.should_sweep():
+            self.queue.reclaim_expired()
+
+        # mails past their ttl are not worth sending anymore
+        expired = self.queue.drop_expired()
+        if expired > 0:
+            self.expired += expired
+            logging.getLogger('jobs').info('MailDispatcher.process_pending_emails dropped {count} expired mails '
+                                           '( {total} total )'.format(count=expired, total=self.expired))
+
+        # get all not sent emails
+        # which retries are not greather than template max_retries
+        # and retry_date <= utc now
+        mail_ids = self.queue.claim(batch, shard)
+
+        # then run them through the build -> send -> ack stages
+        self.processed = 0
+        self._clear_blobs()
+        acks = []
+        with self.queue.lease(mail_ids) as lease:
+            pipeline = Pipeline(queue_size=config('SEND_EMAILS_JOB_QUEUE_SIZE', 100))
+            pipeline.add_stage('build', self._build_email, workers=concurrency)
+            pipeline.add_stage('send', self._deliver_email, workers=concurrency)
+            pipeline.add_stage('ack', lambda outcomes: self._ack_email(outcomes, acks, lease), workers=1)
+            pipeline.run(self._feed(mail_ids))
+            self._flush_acks(acks, lease)
+            # not acked ones ( not started or dropped ) are released right away instead of waiting the lease ttl
+            not_acked = lease.pending()
+            if len(not_acked) > 0:
+                self.queue.release(not_acked)
+        self._clear_blobs()
+        count = self.processed
+
+        logging.getLogger('jobs').debug(
+            "MailDispatcher.process_pending_emails processed {count}".format(count=count))
+
+        return count
+
+    def _cap(self, snapshots: list) -> tuple:
+        """
+        Enforces the templates send rate cap ( max_per_minute ) on a shared bucket per template.
+        :return: ( snapshots that could be sent now, [ ( wait, snapshots over the cap ) ] )
+        """
+        if self.rate_limiter is None:
+            return snapshots, []
+        allowed = []
+        capped = OrderedDict()
+        for m in snapshots:
+            if not m.max_per_minute or m.template_id is None:
+                allowed.append(m)
+                continue
+            if m.template_id in capped:
+                # the rest of the template mails wait for the bucket too
+                capped[m.template_id][1].append(m)
+                continue
+            rate = m.max_per_minute / 60.0
+            wait = self.rate_limiter.acquire('template:{id}'.format(id=m.template_id), rate,
+                                             max(1, int(math.ceil(rate))))
+            if wait > 0:
+                capped[m.template_id] = (wait, [m])
+                continue
+            allowed.append(m)
+        return allowed, list(capped.values())
+
+    @staticmethod
+    def _validate(m: MailSnapshot) -> str:
+        if is_empty(m.subject):
+            return str(_('subject is empty for email {id}'.format(id=m.id)))
+        if is_empty(m.from_email):
+            return str(_('from_email is empty for email {id}'.format(id=m.id)))
+        if is_empty(m.to_email):
+            return str(_('to_email is empty for email {id}'.format(id=m.id)))
+        if is_empty(m.html_content) and is_empty(m.plain_content):
+            return str(_('content is empty for email {id}'.format(id=m.id)))
+        return None
+
+    @staticmethod
+    def _has_attachments(m: MailSnapshot) -> bool:
+        return bool(m.payload) and isinstance(m.payload, dict) and bool(m.payload.get('attachments'))
+
+    @staticmethod
+    def _count_recipients(provider: DeliveryProvider, m: MailSnapshot) -> int:
+        return sum(len(emails) for emails in provider.recipients(m))
+
+    def _group(self, snapshots: list, route: Route):
+        """
+        Mails with byte identical from, subject and bodies ( and no attachments ) are grouped on a single
+        request with one personalization per mail, up to the route provider limits.
+        """
+        provider = route.provider
+        groups = OrderedDict()
+        for m in snapshots:
+            error = self._validate(m)
+            if error is not None:
+                logging.getLogger('jobs').warning('email {id} failed'.format(id=m.id))
+                logging.getLogger('jobs').error(error)
+                yield MailDispatcher.Envelope(snapshots=[m], mail=None, error=error, route=route)
+                continue
+            if provider.max_batch <= 1 or self._has_attachments(m):
+                yield MailDispatcher.Envelope(snapshots=[m], mail=None, error=None, route=route)
+                continue
+
+            key = (m.from_email, m.subject, m.html_content, m.plain_content)
+            recipients = self._count_recipients(provider, m)
+            group, group_recipients = groups.get(key, ([], 0))
+            if len(group) >= provider.max_batch or group_recipients + recipients > provider.max_recipients:
+                yield MailDispatcher.Envelope(snapshots=group, mail=None, error=None, route=route)
+                group, group_recipients = [], 0
+            group.append(m)
+            groups[key] = (group, group_recipients + recipients)
+
+        for group, _recipients in groups.values():
+            if len(group) > 0:
+                yield MailDispatcher.Envelope(snapshots=group, mail=None, error=None, route=route)
+
+    def _build_email(self, envelope):
+        # validation already failed ( or over the template cap ), nothing to build
+        if envelope.error is not None or envelope.throttle is not None:
+            return envelope
+
+        ids = [m.id for m in envelope.snapshots]
+        logging.getLogger('jobs').debug(
+            "MailDispatcher._build_email processing mails {ids}".format(ids=ids))
+        try:
+            snapshots = [self._load_attachments(m) for m in envelope.snapshots]
+        except Exception as e:
+            # the attachments origin ( or store ) could be down for a while, retried as any network error
+            logging.getLogger('jobs').warning(
+                'emails {ids} failed loading their attachments'.format(ids=ids))
+            logging.getLogger('jobs').error(e)
+            return envelope._replace(error=e.__str__(), error_class=self._classify_load_error(e))
+        try:
+            return envelope._replace(mail=envelope.route.provider.build(snapshots))
+        except Exception as e:
+            logging.getLogger('jobs').warning(
+                'emails {ids} failed'.format(ids=ids))
+            logging.getLogger('jobs').error(e)
+            return envelope._replace(error=e.__str__())
+
+    @staticmethod
+    def _classify_load_error(e: Exception) -> str:
+        # urls not allowed, too big or missing blobs would fail the same way on every retry
+        if isinstance(e, (AttachmentFetcher.RejectedException, LookupError)):
+            return RetryPolicy.PERMANENT
+        response = getattr(e, 'response', None)
+        if response is not None and getattr(response, 'status_code', None) is not None:
+            return RetryPolicy.classify(response.status_code)
+        return RetryPolicy.classify(error=e)
+
+    def _load_attachments(self, m: MailSnapshot) -> MailSnapshot:
+        """
+        Replaces the attachments stored on the AttachmentStore ( blob ) or sent by reference ( url )
+        by their base64 content.
+        """
+        if not self._has_attachments(m) or \
+                not any('content' not in file and ('blob' in file or 'url' in file) for file in m.payload['attachments']):
+            return m
+        files = []
+        for file in m.payload['attachments']:
+            if 'content' not in file and 'blob' in file:
+                file = dict(file)
+                file['content'] = self._blob('blob:' + file.pop('blob'), self._read_blob)
+            elif 'content' not in file and 'url' in file:
+                file = dict(file)
+                file['content'] = self._blob('url:' + file.pop('url'), self._fetch_url)
+            files.append(file)
+        payload = dict(m.payload)
+        payload['attachments'] = files
+        return m._replace(payload=payload)
+
+    def _read_blob(self, key: str) -> bytes:
+        if self.attachment_store is None:
+            raise Exception('there is no attachment store to read {key} from'.format(key=key))
+        try:
+            return self.attachment_store.get(key)
+        except KeyError:
+            raise LookupError('attachment {key} not found'.format(key=key))
+
+    def _fetch_url(self, url: str) -> bytes:
+        if self.attachment_fetcher is None:
+            raise Exception('there is no attachment fetcher to get {url}'.format(url=url))
+        return self.attachment_fetcher.fetch(url)
+
+    def _blob(self, key: str, read) -> str:
+        # each blob is read and encoded once per poll
+        with self.blobs_lock:
+            content = self.blobs.get(key)
+            lock = self.blob_locks.setdefault(key, threading.Lock())
+        if content is not None:
+            return content
+        with lock:
+            with self.blobs_lock:
+                content = self.blobs.get(key)
+            if content is not None:
+                return content
+            content = base64.b64encode(read(key.partition(':')[2])).decode('ascii')
+            with self.blobs_lock:
+                if self.blobs_size + len(content) <= self.blobs_max_size:
+                    self.blobs[key] = content
+                    self.blobs_size += len(content)
+        return content
+
+    def _clear_blobs(self):
+        with self.blobs_lock:
+            self.blobs = {}
+            self.blob_locks = {}
+            self.blobs_size = 0
+
+    def _throttle(self, route: Route) -> bool:
+        """
+        Waits for a token of the shared provider bucket.
+        :return: False if the worker started to drain while waiting
+        """
+        if self.rate_limiter is None or route.rate <= 0:
+            return True
+        while not self.stopping.is_set():
+            wait = self.rate_limiter.acquire(route.name, route.rate, route.burst)
+            if wait <= 0:
+                return True
+            self.stopping.wait(min(wait, 1))
+        return False
+
+    def _adapt(self, route: Route, quota: tuple):
+        # refill rate follows the quota reported by the provider
+        if quota is None:
+            return
+        route.quota = quota
+        if self.rate_limiter is None:
+            return
+        remaining, reset = quota
+        self.rate_limiter.update(route.name, remaining, reset)
+
+    def _throttle_delay(self, quota: tuple) -> float:
+        # jittered backoff, but not before the provider quota window resets
+        delay = self.retry_policy.delay(RetryPolicy.RATE_LIMITED)
+        if delay is None:
+            delay = 0
+        if quota is not None:
+            delay = max(delay, quota[1] - time.time())
+        return min(max(delay, 1), max(self.retry_policy.cap(RetryPolicy.RATE_LIMITED), 1))
+
+    def _retry_policy(self, overrides: dict) -> RetryPolicy:
+        if not overrides:
+            return self.retry_policy
+        try:
+            return RetryPolicy(overrides)
+        except ValueError as e:
+            logging.getLogger('jobs').warning('invalid template retry policy {error}'.format(error=e))
+            return self.retry_policy
+
+    def _deliver_email(self, envelope) -> list:
+        if envelope.throttle is not None:
+            # over the template cap, requeued spread at the cap rate without burning a retry
+            return [MailDispatcher.Outcome.of(m, sent=False, error='',
+                                              throttle=envelope.throttle + i * 60.0 / m.max_per_minute)
+                    for i, m in enumerate(envelope.snapshots)]
+
+        outcomes = self._send(envelope)
+        if envelope.mail is None:
+            # not built, another route would not do better
+            return outcomes
+        tried = [envelope.route]
+        # mails that failed with a retryable error fail over to the next available route, expired ones are done
+        while not self.stopping.is_set():
+            retryable = set(o.mail_id for o in outcomes
+                            if not o.sent and o.error_class != RetryPolicy.PERMANENT and not o.expired)
+            if len(retryable) == 0:
+                break
+            route = self._route(exclude=tried)
+            if route is None:
+                break
+            tried.append(route)
+            logging.getLogger('jobs').warning('emails {ids} failing over to {provider}'.format(
+                ids=sorted(retryable), provider=route.name))
+            outcomes = [o for o in outcomes if o.mail_id not in retryable]
+            for retry in self._group([m for m in envelope.snapshots if m.id in retryable], route):
+                outcomes += self._send(self._build_email(retry))
+        return outcomes
+
+    def _send(self, envelope) -> list:
+        route = envelope.route
+        # build already failed, nothing to send
+        if envelope.mail is None:
+            # invalid mail, it would fail the same way on every retry, unless its attachments could not be loaded
+            return [MailDispatcher.Outcome.of(m, sent=False, error=envelope.error,
+                                              error_class=envelope.error_class or RetryPolicy.PERMANENT)
+                    for m in envelope.snapshots]
+
+        if not self._throttle(route):
+            # draining, give them back to the queue as they are
+            return [MailDispatcher.Outcome.of(m, sent=False, error='', throttle=0) for m in envelope.snapshots]
+
+        if not route.breaker.allow() or (not envelope.probe and route.half_open()):
+            # the circuit opened ( or is waiting for its probe ) in the middle of the batch,
+            # requeue them without burning a retry
+            delay = max(route.breaker.retry_in(), 1)
+            return [MailDispatcher.Outcome.of(m, sent=False, error='', throttle=delay)
+                    for m in envelope.snapshots]
+
+        # the ttl could pass after the claim ( waiting on the batch, the rate limiter or a retry )
+        now = MailQueue.now()
+        expired = [m for m in envelope.snapshots if m.expires_at is not None and m.expires_at <= now]
+        if len(expired) > 0:
+            logging.getLogger('jobs').info('emails {ids} expired before being sent'.format(
+                ids=[m.id for m in expired]))
+            outcomes = [MailDispatcher.Outcome.of(m, sent=False, error='expired', expired=True) for m in expired]
+            snapshots = [m for m in envelope.snapshots if m.expires_at is None or m.expires_at > now]
+            if len(snapshots) == 0:
+                return outcomes
+            envelope = self._build_email(envelope._replace(snapshots=snapshots, mail=None))
+            if envelope.mail is None:
+                return outcomes + self._send(envelope)
+            return outcomes + self._provider_send(envelope)
+
+        return self._provider_send(envelope)
+
+    def _provider_send(self, envelope) -> list:
+        route = envelope.route
+        # network I/O only, no db transaction or row lock is held here
+        # the result of the request is recorded on each one of the mails
+        ids = [m.id for m in envelope.snapshots]
+        try:
+            logging.getLogger('jobs').debug('sending emails {ids} thru {provider} request {request}'.format(
+                ids=ids, provider=route.name, request=route.provider.describe(envelope.mail)))
+            response = route.provider.send(envelope.mail)
+        except Exception as e:
+            # timeouts, connection errors
+            route.breaker.record(False)
+            logging.getLogger('jobs').warning(
+                'emails {ids} failed'.format(ids=ids))
+            logging.getLogger('jobs').error(e)
+            return [MailDispatcher.Outcome.of(m, sent=False, error=e.__str__(),
+                                              error_class=RetryPolicy.classify(error=e))
+                    for m in envelope.snapshots]
+
+        logging.getLogger('jobs').debug(
+            'response.status_code {status_code}'.format(status_code=response.status_code))
+        logging.getLogger('jobs').debug('response.body {body}'.format(body=response.body))
+        logging.getLogger('jobs').debug('response.headers {headers}'.format(headers=response.headers))
+        quota = route.provider.quota(response)
+        self._adapt(route, quota)
+
+        if response.status_code in [200, 202]:
+            route.breaker.record(True)
+            logging.getLogger('jobs').debug('emails {ids} successfully sent thru {provider}'.format(
+                ids=ids, provider=route.name))
+            return [MailDispatcher.Outcome.of(m, sent=True, provider=route.name) for m in envelope.snapshots]
+
+        # only provider side errors count, a rejected mail says nothing about the provider health
+        route.breaker.record(response.status_code < 500 and response.status_code != 408)
+        error_class = RetryPolicy.classify(response.status_code)
+        if error_class == RetryPolicy.RATE_LIMITED:
+            # rate limited, every worker holds off and the mails are retried shortly
+            delay = self._throttle_delay(quota)
+            logging.getLogger('jobs').warning(
+                'emails {ids} rate limited, requeued in {delay} seconds'.format(ids=ids, delay=delay))
+            if self.rate_limiter is not None:
+                self.rate_limiter.backoff(route.name, delay)
+            return [MailDispatcher.Outcome.of(m, sent=False, error=response.body, error_class=error_class,
+                                              throttle=delay) for m in envelope.snapshots]
+
+        if error_class == RetryPolicy.PERMANENT and len(envelope.snapshots) > 1:
+            # a single rejected mail ( ie an invalid address ) fails the whole request
+            indexes = route.provider.rejected(response, len(envelope.snapshots))
+            if indexes is not None:
+                # only the mails the error points at are failed, the rest is resent as a group
+                rejected = [m for i, m in enumerate(envelope.snapshots) if i in indexes]
+                rest = [m for i, m in enumerate(envelope.snapshots) if i not in indexes]
+                logging.getLogger('jobs').warning('emails {rejected} rejected, resending {rest}'.format(
+                    rejected=[m.id for m in rejected], rest=[m.id for m in rest]))
+                outcomes = [MailDispatcher.Outcome.of(m, sent=False, error=response.body, error_class=error_class)
+                            for m in rejected]
+                if len(rest) > 0:
+                    outcomes += self._send(self._build_email(envelope._replace(snapshots=rest, mail=None)))
+                return outcomes
+            if envelope.split:
+                logging.getLogger('jobs').warning(
+                    'emails {ids} rejected as a group, resending them split'.format(ids=ids))
+                return self._split(envelope)
+
+        logging.getLogger('jobs').warning(
+            'emails {ids} failed'.format(ids=ids))
+        return [MailDispatcher.Outcome.of(m, sent=False, error=response.body, error_class=error_class)
+                for m in envelope.snapshots]
+
+    def _split(self, envelope) -> list:
+        """
+        Bisects a rejected group to find the rejected mails, when the provider does not tell which ones.
+        If both halves are rejected as well the error is taken as one on the whole request ( from, content,
+        api key ... ) and the split stops there, so it does not cost a request per mail.
+        """
+        half = len(envelope.snapshots) // 2
+        halves = [envelope.snapshots[:half], envelope.snapshots[half:]]
+        results = [self._send(self._build_email(envelope._replace(snapshots=snapshots, mail=None, split=False)))
+                   for snapshots in halves]
+        rejected = [all(not o.sent and o.error_class == RetryPolicy.PERMANENT for o in outcomes)
+                    for outcomes in results]
+        if all(rejected):
+            return results[0] + results[1]
+        outcomes = []
+        for snapshots, result, is_rejected in zip(halves, results, rejected):
+            if is_rejected and len(snapshots) > 1:
+                # the other half went thru, the rejected mails are on this one
+                outcomes += self._split(envelope._replace(snapshots=snapshots))
+            else:
+                outcomes += result
+        return outcomes
+
+    def _ack_email(self, outcomes: list, acks: list, lease):
+        acks.extend(outcomes)
+        if len(acks) >= self.ack_batch:
+            self._flush_acks(acks, lease)
+
+    def _flush_acks(self, acks: list, lease):
+        if len(acks) == 0:
+            return
+        # results are applied per batch with set based updates
+        sent_ids = []
+        providers = {}
+        failed = []
+        throttled = []
+        expired = 0
+        for outcome in acks:
+            if outcome.sent:
+                sent_ids.append(outcome.mail_id)
+                providers[outcome.mail_id] = outcome.provider
+                continue
+            m = Mail(id=outcome.mail_id, retries=outcome.retries, last_error=outcome.error)
+            if outcome.expired:
+                m.mark_expired()
+                failed.append(m)
+                expired += 1
+                continue
+            if outcome.throttle is not None:
+                m.mark_throttled(outcome.error, outcome.throttle)
+                # without an error ( draining, open circuit ) the mail keeps its last one
+                (failed if outcome.error else throttled).append(m)
+                continue
+            delay = self._retry_policy(outcome.retry_policy).delay(outcome.error_class, outcome.retries)
+            if delay is None:
+                m.mark_failed(outcome.error, outcome.max_retries)
+            else:
+                m.mark_retry(outcome.error, outcome.max_retries, delay)
+            failed.append(m)
+
+        self.queue.ack(sent_ids, failed, providers, throttled)
+        if expired > 0:
+            self.expired += expired
+            logging.getLogger('jobs').info('MailDispatcher._flush_acks dropped {count} expired mails '
+                                           '( {total} total )'.format(count=expired, total=self.expired))
+        for outcome in acks:
+            lease.done(outcome.mail_id)
+        self.processed += len(acks)
+        acks.clear()
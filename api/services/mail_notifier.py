@@ -0,0 +1,22 @@
+from abc import abstractmethod
+
+
+class MailNotifier:
+
+    @abstractmethod
+    def notify(self):
+        """
+        Signals the send workers that there are new emails on the queue.
+        """
+        pass
+
+    @abstractmethod
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until a notification arrives or timeout ( seconds ) expires.
+        :return: True if it was woken up by a notification
+        """
+        pass
+
+    def is_available(self) -> bool:
+        return False
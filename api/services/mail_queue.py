@@ -0,0 +1,353 @@
+import logging
+import math
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+import pytz
+from django.db import connection, connections, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Mod
+
+from api.models import Mail, MailTemplate
+from api.utils import config
+
+
+class MailSnapshot(NamedTuple):
+    """
+    Immutable copy of the mail fields needed to send it, so nothing is locked
+    nor kept open on the db while the provider is called.
+    """
+    id: int
+    from_email: str
+    to_email: str
+    cc_email: str
+    bcc_email: str
+    subject: str
+    plain_content: str
+    html_content: str
+    payload: dict
+    retries: int
+    max_retries: int
+    retry_policy: dict
+    template_id: int = None
+    max_per_minute: int = None
+    expires_at: datetime = None
+
+    # fields read from the mail template
+    TEMPLATE_FIELDS = ['retry_policy', 'max_per_minute']
+    # fields read from the mail body
+    BODY_FIELDS = ['plain_content', 'html_content', 'payload']
+
+    @staticmethod
+    def fields() -> list:
+        fields = []
+        for f in MailSnapshot._fields:
+            if f in MailSnapshot.TEMPLATE_FIELDS:
+                f = 'template__{f}'.format(f=f)
+            elif f in MailSnapshot.BODY_FIELDS:
+                f = 'body__{f}'.format(f=f)
+            fields.append(f)
+        return fields
+
+
+class MailQueue:
+    """
+    Pending mails stored on api_mail table.
+    Claiming a batch is a SELECT ... FOR UPDATE SKIP LOCKED plus an UPDATE of status and lock_date,
+    so several workers could claim disjoint batches at the same time. Pending mails are read by
+    ( status, due_at ) index ranges, so the claim cost does not grow with the sent ones.
+    A claim is a lease: lock_date is the last time the owner renewed it, and once it is older
+    than SEND_EMAILS_LEASE_TTL seconds the mail is given back to the queue.
+    Each priority lane gets its weighted share of the batch ( SEND_EMAILS_PRIORITY_WEIGHTS ), so a bulk
+    backlog does not delay the transactional mails, nor do they starve it.
+    Within a lane the share is split between the clients ( owner_id ) with pending mails by deficit
+    round robin, so a client that enqueues a huge backlog does not delay the mails of the rest.
+    """
+
+    # priority: weight
+    DEFAULT_LANE_WEIGHTS = {MailTemplate.PRIORITY_TRANSACTIONAL: 6, MailTemplate.PRIORITY_NORMAL: 3,
+                            MailTemplate.PRIORITY_BULK: 1}
+
+    class Lease:
+        """
+        Keeps alive ( heartbeat ) the lease of the claimed mails that are not yet acked.
+        """
+
+        def __init__(self, queue, ids: list, interval: float):
+            self.queue = queue
+            self.ids = set(ids)
+            self.interval = interval
+            self.lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.thread = None
+
+        def done(self, mail_id: int):
+            with self.lock:
+                self.ids.discard(mail_id)
+
+        def pending(self) -> list:
+            with self.lock:
+                return list(self.ids)
+
+        def _run(self):
+            try:
+                while not self.stopped.wait(self.interval):
+                    with self.lock:
+                        ids = list(self.ids)
+                    if len(ids) > 0:
+                        self.queue.heartbeat(ids)
+            finally:
+                connections.close_all()
+
+        def __enter__(self):
+            if self.interval > 0 and len(self.ids) > 0:
+                self.thread = threading.Thread(target=self._run, name='mail-queue-lease', daemon=True)
+                self.thread.start()
+            return self
+
+        def __exit__(self, type, value, traceback):
+            self.stopped.set()
+            if self.thread is not None:
+                self.thread.join()
+
+    RETRY_FIELDS = ['status', 'retries', 'next_retry_date', 'due_at', 'last_error', 'lock_date', 'lock_owner',
+                    'expired_date']
+    # requeued without an error, the last one is kept ( see Mail.mark_throttled )
+    THROTTLE_FIELDS = ['status', 'next_retry_date', 'due_at', 'lock_date', 'lock_owner']
+
+    def __init__(self, owner: str = None):
+        self._owner = owner
+        self._owner_pid = None
+        self.lease_ttl = int(config('SEND_EMAILS_LEASE_TTL', 600))
+        self.heartbeat_interval = float(config('SEND_EMAILS_LEASE_HEARTBEAT_INTERVAL', 120))
+        weights = config('SEND_EMAILS_PRIORITY_WEIGHTS', None) or MailQueue.DEFAULT_LANE_WEIGHTS
+        # higher lanes first
+        self.lanes = sorted(((int(priority), float(weight)) for priority, weight in weights.items()
+                             if float(weight) > 0), reverse=True)
+        self.fair_queuing = bool(config('SEND_EMAILS_FAIR_QUEUING', True))
+        # mails per client per round, 0 = the lane share split evenly between its clients
+        self.fair_quantum = int(config('SEND_EMAILS_FAIR_QUANTUM', 0))
+        # deficit round robin state, carried over between claims
+        self.deficits = {}
+        self.last_owner = None
+        self.last_sweep = None
+        self.expire_chunk = int(config('SEND_EMAILS_EXPIRE_CHUNK', 1000))
+
+    @property
+    def owner(self) -> str:
+        # each forked worker process gets its own lease owner
+        if self._owner is None or (self._owner_pid is not None and self._owner_pid != os.getpid()):
+            self._owner_pid = os.getpid()
+            self._owner = '{host}:{pid}:{id}'.format(host=socket.gethostname(), pid=self._owner_pid,
+                                                    id=uuid.uuid4().hex[:8])
+        return self._owner
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+    def pending(self, now: datetime):
+        # max_retries is denormalised on the mail, so there is no join with the template
+        return Mail.objects.filter(status=Mail.STATUS_PENDING, due_at__lte=now, retries__lt=F('max_retries'))
+
+    def claim(self, batch: int, shard: tuple = None) -> list:
+        """
+        :param batch: max number of mails to claim
+        :param shard: optional ( index, count ), claims first the mails where id % count == index
+        """
+        batch = int(batch)
+        now = self.now()
+        with transaction.atomic():
+            query = self.pending(now)
+            ids = []
+            total = sum(weight for _priority, weight in self.lanes)
+            for priority, weight in self.lanes:
+                share = min(batch - len(ids), int(math.ceil(batch * weight / total)))
+                if share > 0:
+                    # in index order ( api_mail_lane_idx / api_mail_lane_owner_idx ), so the LIMIT stops the
+                    # range read instead of sorting ( and locking ) every due mail of the lane
+                    ids += self._claim_lane(query.filter(priority=priority).order_by('due_at', 'id'), share, shard)
+            # shares left by the empty lanes go to the rest of the queue, one lane at a time higher lanes first,
+            # so the claim still follows the lane index ( a descending priority order would sort every due mail )
+            for priority in sorted((p for p, _name in MailTemplate.PRIORITY_CHOICES), reverse=True):
+                if len(ids) >= batch:
+                    break
+                ids += self._claim_lane(query.filter(priority=priority).exclude(id__in=ids).order_by('due_at', 'id'),
+                                        batch - len(ids), shard)
+            if len(ids) > 0:
+                Mail.objects.filter(id__in=ids, status=Mail.STATUS_PENDING) \
+                    .update(status=Mail.STATUS_LOCKED, lock_date=now, lock_owner=self.owner)
+
+        logging.getLogger('jobs').debug('MailQueue.claim {owner} claimed {count} mails'.format(owner=self.owner,
+                                                                                              count=len(ids)))
+        return ids
+
+    def _claim_lane(self, query, limit: int, shard: tuple = None) -> list:
+        if not self.fair_queuing:
+            return self._claim_shard(query, limit, shard)
+        # plain read, only the clients with pending mails take part on the round
+        owners = sorted(set(query.order_by().values_list('owner_id', flat=True).distinct()))
+        if len(owners) <= 1:
+            return self._claim_shard(query, limit, shard)
+
+        # next round starts after the last client served, so the same one is not always first
+        start = next((i for i, owner in enumerate(owners) if self.last_owner is not None and owner > self.last_owner),
+                     0)
+        active = owners[start:] + owners[:start]
+        quantum = self.fair_quantum if self.fair_quantum > 0 else int(math.ceil(limit / len(active)))
+        ids = []
+        while len(active) > 0 and len(ids) < limit:
+            for owner in list(active):
+                if len(ids) >= limit:
+                    break
+                self.deficits[owner] = self.deficits.get(owner, 0) + quantum
+                take = min(self.deficits[owner], limit - len(ids))
+                claimed = self._claim_shard(query.filter(owner_id=owner).exclude(id__in=ids), take, shard)
+                ids += claimed
+                self.last_owner = owner
+                self.deficits[owner] -= len(claimed)
+                if len(claimed) < take:
+                    # client sub queue drained, it does not keep credit for later
+                    active.remove(owner)
+                    self.deficits.pop(owner, None)
+        return ids
+
+    def _claim_shard(self, query, limit: int, shard: tuple = None) -> list:
+        ids = []
+        if shard is not None:
+            index, count = shard
+            ids = self._claimable_ids(query.annotate(shard=Mod('id', count)).filter(shard=index), limit)
+        if len(ids) < limit:
+            # own shard is drained ( or no sharding at all ), help with the rest of the queue
+            ids += self._claimable_ids(query.exclude(id__in=ids), limit - len(ids))
+        return ids
+
+    def _claimable_ids(self, query, limit: int) -> list:
+        return list(self._lock(query).values_list('id', flat=True)[:limit])
+
+    def snapshot(self, mail_id: int) -> MailSnapshot:
+        # plain read on autocommit, no transaction nor row lock is taken
+        return MailSnapshot(*Mail.objects.filter(pk=mail_id).values_list(*MailSnapshot.fields()).get())
+
+    def snapshots(self, ids: list) -> list:
+        # in the given ( claim ) order, so the higher lanes are sent first
+        rows = {row[0]: MailSnapshot(*row) for row in
+                Mail.objects.filter(id__in=ids).values_list(*MailSnapshot.fields())}
+        return [rows[mail_id] for mail_id in ids if mail_id in rows]
+
+    def ack(self, sent_ids: list, failed: list, providers: dict = None, throttled: list = None):
+        """
+        Records a batch of send results, only touching the delivery state columns.
+        Results are only recorded while this worker still holds the lease, once it expired
+        the mail could be already claimed by another worker.
+        :param sent_ids: ids of the mails successfully sent
+        :param failed: Mail instances with the retry state already set ( see Mail.mark_retry )
+        :param providers: optional name of the delivery provider that sent each mail, by mail id
+        :param throttled: Mail instances requeued without an error ( see Mail.mark_throttled ), their
+        last_error is not touched
+        """
+        with transaction.atomic():
+            if len(sent_ids) > 0:
+                # one update per provider ( a handful of them ), instead of one per mail
+                by_provider = {}
+                for mail_id in sent_ids:
+                    provider = providers.get(mail_id) if providers else None
+                    by_provider.setdefault(provider or '', []).append(mail_id)
+                now = self.now()
+                count = 0
+                for provider, ids in by_provider.items():
+                    # a delivered mail is recorded as sent if its expired lease was not claimed again,
+                    # otherwise it would be sent twice
+                    count += Mail.objects.filter(id__in=ids).filter(Q(lock_owner=self.owner) | Q(lock_owner='')) \
+                        .update(status=Mail.STATUS_SENT, sent_date=now, lock_date=None, lock_owner='',
+                                provider=provider)
+                if count < len(sent_ids):
+                    logging.getLogger('jobs').warning(
+                        'MailQueue.ack {owner} lost the lease of {lost} sent mails'.format(owner=self.owner,
+                                                                                          lost=len(sent_ids) - count))
+            self._update_owned(failed, self.RETRY_FIELDS, 'failed')
+            self._update_owned(throttled or [], self.THROTTLE_FIELDS, 'throttled')
+
+    def _update_owned(self, mails: list, fields: list, kind: str):
+        if len(mails) == 0:
+            return
+        owned = set(self._lock(Mail.objects.filter(id__in=[m.id for m in mails], lock_owner=self.owner))
+                    .values_list('id', flat=True))
+        if len(owned) < len(mails):
+            logging.getLogger('jobs').warning(
+                'MailQueue.ack {owner} lost the lease of {lost} {kind} mails'.format(
+                    owner=self.owner, lost=len(mails) - len(owned), kind=kind))
+        mails = [m for m in mails if m.id in owned]
+        if len(mails) > 0:
+            Mail.objects.bulk_update(mails, fields)
+
+    def lease(self, ids: list):
+        return MailQueue.Lease(self, ids, self.heartbeat_interval)
+
+    def heartbeat(self, ids: list) -> int:
+        return Mail.objects.filter(id__in=ids, lock_owner=self.owner, status=Mail.STATUS_LOCKED) \
+            .update(lock_date=self.now())
+
+    def release(self, ids: list) -> int:
+        return Mail.objects.filter(id__in=ids, lock_owner=self.owner, status=Mail.STATUS_LOCKED) \
+            .update(status=Mail.STATUS_PENDING, lock_date=None, lock_owner='')
+
+    def reclaim_expired(self) -> int:
+        """
+        Sweeps expired leases ( workers that died or got killed in the middle of a batch )
+        back to the queue.
+        """
+        now = self.now()
+        self.last_sweep = now
+        count = Mail.objects.filter(status=Mail.STATUS_LOCKED, lock_date__lte=now - timedelta(seconds=self.lease_ttl)) \
+            .update(status=Mail.STATUS_PENDING, lock_date=None, lock_owner='')
+        if count > 0:
+            logging.getLogger('jobs').warning('MailQueue.reclaim_expired reclaimed {count} mails'.format(count=count))
+        return count
+
+    def next_due(self, now: datetime = None) -> float:
+        """
+        :return: seconds until the next scheduled ( or retried ) mail is due, None if there is none
+        """
+        now = now if now is not None else self.now()
+        due_at = Mail.objects.filter(status=Mail.STATUS_PENDING, due_at__gt=now).order_by('due_at').values_list('due_at', flat=True).first()
+        return (due_at - now).total_seconds() if due_at is not None else None
+
+    def drop_expired(self) -> int:
+        """
+        Marks as expired ( in chunks ) the pending mails past their expires_at, so they are never claimed.
+        """
+        now = self.now()
+        count = 0
+        while True:
+            ids = list(Mail.objects.filter(status=Mail.STATUS_PENDING, expires_at__lte=now)
+                       .values_list('id', flat=True)[:self.expire_chunk])
+            if len(ids) == 0:
+                break
+            # the ones claimed meanwhile are left to its worker
+            count += Mail.objects.filter(id__in=ids, status=Mail.STATUS_PENDING) \
+                .update(status=Mail.STATUS_EXPIRED, expired_date=now, last_error='expired', next_retry_date=None)
+            if len(ids) < self.expire_chunk:
+                break
+        if count > 0:
+            logging.getLogger('jobs').info('MailQueue.drop_expired dropped {count} mails'.format(count=count))
+        return count
+
+    def should_sweep(self) -> bool:
+        # no need to sweep more often than half the lease ttl
+        return self.last_sweep is None or self.now() - self.last_sweep >= timedelta(seconds=self.lease_ttl / 2)
+
+    @staticmethod
+    def _lock(query):
+        features = connection.features
+        # SQLite ( tests ) has no row locks, writers are serialized on the database file
+        if not features.has_select_for_update:
+            return query
+        # MySQL 8 / PostgreSQL
+        if features.has_select_for_update_skip_locked:
+            return query.select_for_update(skip_locked=True)
+        return query.select_for_update()
@@ -0,0 +1,125 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+
+from api.models import AttachmentBlob, Mail, MailBody
+from api.models.mail import utc_now
+from api.services.attachment_store import AttachmentStore
+from api.services.mail_archive import MailArchive
+from api.services.mail_queue import MailQueue
+from api.utils import config
+
+
+class MailRetention:
+    """
+    Keeps api_mail at a steady size: sent and terminally failed ( or expired ) mails due more than
+    SEND_EMAILS_RETENTION_DAYS ago are moved to a MailArchive ( archive mode ), or only get their
+    bodies deleted ( purge_bodies mode ).
+    Works in chunks of SEND_EMAILS_RETENTION_CHUNK mails, sleeping SEND_EMAILS_RETENTION_SLEEP seconds
+    between them so the send workers are not starved, up to SEND_EMAILS_RETENTION_MAX_CHUNKS per run.
+    Then the attachment blobs no mail references anymore ( for longer than the retention window ) are
+    deleted from the AttachmentStore.
+    """
+
+    ARCHIVE = 'archive'
+    PURGE_BODIES = 'purge_bodies'
+
+    TERMINAL_STATUSES = [Mail.STATUS_SENT, Mail.STATUS_FAILED, Mail.STATUS_EXPIRED]
+
+    FIELDS = ['id', 'owner_id', 'template_id', 'from_email', 'to_email', 'cc_email', 'bcc_email', 'subject',
+              'status', 'retries', 'last_error', 'provider', 'priority', 'created', 'modified', 'sent_date',
+              'expired_date', 'send_at', 'due_at']
+    BODY_FIELDS = ['payload', 'plain_content', 'html_content']
+
+    def __init__(self, archive: MailArchive, attachment_store: AttachmentStore = None):
+        self.archive = archive
+        self.attachment_store = attachment_store
+        self.days = int(config('SEND_EMAILS_RETENTION_DAYS', 30))
+        self.mode = config('SEND_EMAILS_RETENTION_MODE', MailRetention.ARCHIVE)
+        self.chunk = int(config('SEND_EMAILS_RETENTION_CHUNK', 1000))
+        self.sleep = float(config('SEND_EMAILS_RETENTION_SLEEP', 0.5))
+        self.max_chunks = int(config('SEND_EMAILS_RETENTION_MAX_CHUNKS', 0))
+
+    def run(self, now=None) -> int:
+        """
+        :return: number of mails archived ( or bodies purged )
+        """
+        now = now if now is not None else utc_now()
+        cutoff = now - timedelta(days=self.days)
+        step = self._purge_chunk if self.mode == MailRetention.PURGE_BODIES else self._archive_chunk
+        try:
+            total = self._chunks(step, cutoff, now)
+        finally:
+            self.archive.close()
+
+        logging.getLogger('jobs').info('MailRetention.run {mode} {total} mails due before {cutoff}'.format(
+            mode=self.mode, total=total, cutoff=cutoff))
+
+        if self.attachment_store is not None:
+            blobs = self._chunks(self._collect_blobs_chunk, cutoff, now)
+            logging.getLogger('jobs').info('MailRetention.run deleted {blobs} unreferenced blobs'.format(blobs=blobs))
+        return total
+
+    def _chunks(self, step, cutoff, now) -> int:
+        total = 0
+        chunks = 0
+        while True:
+            count = step(cutoff, now)
+            total += count
+            chunks += 1
+            if count < self.chunk or (self.max_chunks > 0 and chunks >= self.max_chunks):
+                break
+            if self.sleep > 0:
+                time.sleep(self.sleep)
+        return total
+
+    def _expired(self, cutoff):
+        # ( status, due_at ) index range
+        return Mail.objects.filter(status__in=self.TERMINAL_STATUSES, due_at__lt=cutoff)
+
+    def _archive_chunk(self, cutoff, now) -> int:
+        with transaction.atomic():
+            ids = list(self._expired(cutoff).order_by('id').values_list('id', flat=True)[:self.chunk])
+            if len(ids) == 0:
+                return 0
+            rows = []
+            for row in Mail.objects.filter(id__in=ids).order_by('id').values(
+                    *self.FIELDS, *['body__{f}'.format(f=f) for f in self.BODY_FIELDS]):
+                for f in self.BODY_FIELDS:
+                    row[f] = row.pop('body__{f}'.format(f=f))
+                row['archived_date'] = now
+                rows.append(row)
+            # stored before the rows are deleted, an interrupted chunk is archived again on the next run
+            self.archive.write(rows)
+            AttachmentBlob.release([key for row in rows for key in AttachmentBlob.keys(row['payload'])])
+            MailBody.objects.filter(mail_id__in=ids).delete()
+            Mail.objects.filter(id__in=ids).delete()
+        return len(ids)
+
+    def _purge_chunk(self, cutoff, now) -> int:
+        with transaction.atomic():
+            rows = list(MailBody.objects.filter(mail__status__in=self.TERMINAL_STATUSES, mail__due_at__lt=cutoff)
+                        .order_by('mail_id').values_list('mail_id', 'payload')[:self.chunk])
+            if len(rows) == 0:
+                return 0
+            AttachmentBlob.release([key for _mail_id, payload in rows for key in AttachmentBlob.keys(payload)])
+            MailBody.objects.filter(mail_id__in=[mail_id for mail_id, _payload in rows]).delete()
+        return len(rows)
+
+    def _collect_blobs_chunk(self, cutoff, now) -> int:
+        """
+        Deletes the blobs without references that were not referenced since before the cutoff, the rows are
+        locked meanwhile so a new mail referencing any of them waits ( and then stores it again ).
+        """
+        with transaction.atomic():
+            # SKIP LOCKED where the backend has it ( MySQL 8 / PostgreSQL ), plain row locks otherwise
+            keys = list(MailQueue._lock(AttachmentBlob.objects.filter(references__lte=0, last_referenced__lt=cutoff))
+                        .order_by('references', 'last_referenced').values_list('key', flat=True)[:self.chunk])
+            if len(keys) == 0:
+                return 0
+            for key in keys:
+                self.attachment_store.delete(key)
+            AttachmentBlob.objects.filter(key__in=keys).delete()
+        return len(keys)
@@ -0,0 +1,33 @@
+import gzip
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.services.mail_archive import MailArchive
+from api.utils import config
+
+
+class NdjsonMailArchive(MailArchive):
+    """
+    Appends the archived mails as gzipped newline delimited json, one file per day
+    ( mails-YYYYMMDD.ndjson.gz ) on SEND_EMAILS_ARCHIVE_DIR. Each chunk is written as its own
+    gzip member, so a file could be read ( zcat ) even if a run was interrupted.
+    """
+
+    def __init__(self, archive_dir: str = None):
+        self.archive_dir = archive_dir if archive_dir else config('SEND_EMAILS_ARCHIVE_DIR') or \
+            os.path.join(config('BASE_DIR'), 'archive')
+
+    def path(self, day) -> str:
+        return os.path.join(self.archive_dir, 'mails-{day}.ndjson.gz'.format(day=day.strftime('%Y%m%d')))
+
+    def write(self, rows: list):
+        if len(rows) == 0:
+            return
+        os.makedirs(self.archive_dir, exist_ok=True)
+        lines = ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+        with open(self.path(rows[0]['archived_date']), 'ab') as f:
+            f.write(gzip.compress(lines.encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
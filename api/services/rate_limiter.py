@@ -0,0 +1,34 @@
+from abc import abstractmethod
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all the send workers, one bucket per provider ( or per rate capped template ).
+    """
+
+    @abstractmethod
+    def acquire(self, provider: str, rate: float, burst: int, tokens: int = 1) -> float:
+        """
+        Tries to take tokens from the provider bucket.
+        :param rate: tokens refilled per second ( unless adapted by update )
+        :param burst: bucket capacity
+        :return: 0 if the tokens were taken, otherwise the seconds to wait before trying again
+        """
+        pass
+
+    @abstractmethod
+    def update(self, provider: str, remaining: int, reset: float):
+        """
+        Adapts the refill rate to the quota reported by the provider, so the remaining
+        requests are spread until the quota window resets.
+        :param remaining: requests left on the current window
+        :param reset: epoch ( seconds ) when the window resets
+        """
+        pass
+
+    @abstractmethod
+    def backoff(self, provider: str, seconds: float):
+        """
+        Empties the provider bucket and stops handing out tokens for the given seconds.
+        """
+        pass
@@ -0,0 +1,51 @@
+import logging
+import time
+
+from django_redis import get_redis_connection
+
+from api.services import MailNotifier
+from api.utils import config
+
+
+class RedisMailNotifier(MailNotifier):
+    """
+    Notifications over a pub/sub channel of the redis instance configured on CACHES.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.channel = config('SEND_WORKER_NOTIFY_CHANNEL', 'mailing_api:mails')
+        self.pubsub = None
+
+    def notify(self):
+        try:
+            get_redis_connection('default').publish(self.channel, 'new')
+        except Exception as e:
+            # workers will still find it on the next poll
+            logging.getLogger('api').warning('RedisMailNotifier.notify error {error}'.format(error=e))
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        try:
+            if self.pubsub is None:
+                self.pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                self.pubsub.subscribe(self.channel)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if self.pubsub.get_message(timeout=remaining) is not None:
+                    # collapse all the pending notifications on a single wake up
+                    while self.pubsub.get_message() is not None:
+                        pass
+                    return True
+        except Exception as e:
+            logging.getLogger('jobs').warning('RedisMailNotifier.wait error {error}'.format(error=e))
+            self.pubsub = None
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            return False
+
+    def is_available(self) -> bool:
+        return True
@@ -0,0 +1,99 @@
+import logging
+import time
+
+from django_redis import get_redis_connection
+
+from api.services import RateLimiter
+from api.utils import config
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Token buckets stored on hashes of the redis instance configured on CACHES, updated
+    atomically by lua scripts so all the workers ( on all the hosts ) share the same budget.
+    Any redis error lets the request through, the limiter must not stop the sending.
+    """
+
+    # KEYS[1] bucket, ARGV now, rate, burst, tokens
+    ACQUIRE = """
+local now = tonumber(ARGV[1])
+local burst = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'rate_until', 'blocked_until')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+local rate = tonumber(ARGV[2])
+if bucket[3] and now < (tonumber(bucket[4]) or 0) then
+    rate = tonumber(bucket[3])
+end
+local blocked_until = tonumber(bucket[5]) or 0
+if now < blocked_until then
+    return tostring(blocked_until - now)
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+elseif rate > 0 then
+    wait = (requested - tokens) / rate
+else
+    wait = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+    # KEYS[1] bucket, ARGV now, remaining, reset
+    UPDATE = """
+local now = tonumber(ARGV[1])
+local remaining = math.max(0, tonumber(ARGV[2]))
+local reset = math.max(tonumber(ARGV[3]), now + 1)
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens')) or remaining
+redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tokens, remaining)), 'ts', tostring(now),
+           'rate', tostring(remaining / (reset - now)), 'rate_until', tostring(reset))
+redis.call('EXPIRE', KEYS[1], 3600)
+return 1
+"""
+
+    # KEYS[1] bucket, ARGV now, seconds
+    BACKOFF = """
+local now = tonumber(ARGV[1])
+local blocked_until = math.max(tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0, now + tonumber(ARGV[2]))
+redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', tostring(now), 'blocked_until', tostring(blocked_until))
+redis.call('EXPIRE', KEYS[1], 3600)
+return 1
+"""
+
+    def __init__(self):
+        super().__init__()
+        self.prefix = config('RATE_LIMITER_KEY_PREFIX', 'mailing_api:rate_limit')
+        self.scripts = {}
+
+    def _key(self, provider: str) -> str:
+        return '{prefix}:{provider}'.format(prefix=self.prefix, provider=provider)
+
+    def _run(self, script: str, provider: str, *args):
+        if script not in self.scripts:
+            self.scripts[script] = get_redis_connection('default').register_script(script)
+        return self.scripts[script](keys=[self._key(provider)], args=[time.time()] + list(args))
+
+    def acquire(self, provider: str, rate: float, burst: int, tokens: int = 1) -> float:
+        try:
+            wait = self._run(self.ACQUIRE, provider, rate, burst, tokens)
+            return float(wait.decode('utf-8') if isinstance(wait, bytes) else wait)
+        except Exception as e:
+            logging.getLogger('jobs').warning('RedisRateLimiter.acquire error {error}'.format(error=e))
+            return 0
+
+    def update(self, provider: str, remaining: int, reset: float):
+        try:
+            self._run(self.UPDATE, provider, remaining, reset)
+        except Exception as e:
+            logging.getLogger('jobs').warning('RedisRateLimiter.update error {error}'.format(error=e))
+
+    def backoff(self, provider: str, seconds: float):
+        try:
+            self._run(self.BACKOFF, provider, seconds)
+        except Exception as e:
+            logging.getLogger('jobs').warning('RedisRateLimiter.backoff error {error}'.format(error=e))
@@ -0,0 +1,53 @@
+import logging
+import threading
+import time
+
+from django_redis import get_redis_connection
+
+from api.services import WorkerRegistry
+from api.utils import config
+
+
+class RedisWorkerRegistry(WorkerRegistry):
+    """
+    Live workers are kept on a redis sorted set scored by their last heartbeat.
+    A worker that stops heartbeating for SEND_WORKER_REGISTRY_TTL seconds is dropped,
+    and the shards are rebalanced among the remaining ones on their next poll.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.key = config('SEND_WORKER_REGISTRY_KEY', 'mailing_api:workers')
+        self.ttl = int(config('SEND_WORKER_REGISTRY_TTL', 60))
+        self.heartbeats = {}
+
+    def _redis(self):
+        return get_redis_connection('default')
+
+    def _heartbeat(self, worker_id: str, stopped: threading.Event):
+        while not stopped.wait(self.ttl / 3):
+            try:
+                self._redis().zadd(self.key, {worker_id: time.time()})
+            except Exception as e:
+                logging.getLogger('jobs').warning('RedisWorkerRegistry heartbeat error {error}'.format(error=e))
+
+    def register(self, worker_id: str):
+        self._redis().zadd(self.key, {worker_id: time.time()})
+        stopped = threading.Event()
+        thread = threading.Thread(target=self._heartbeat, args=(worker_id, stopped),
+                                  name='worker-registry-heartbeat', daemon=True)
+        thread.start()
+        self.heartbeats[worker_id] = stopped
+        logging.getLogger('jobs').info('RedisWorkerRegistry registered {worker_id}'.format(worker_id=worker_id))
+
+    def unregister(self, worker_id: str):
+        stopped = self.heartbeats.pop(worker_id, None)
+        if stopped is not None:
+            stopped.set()
+        self._redis().zrem(self.key, worker_id)
+        logging.getLogger('jobs').info('RedisWorkerRegistry unregistered {worker_id}'.format(worker_id=worker_id))
+
+    def members(self) -> list:
+        redis = self._redis()
+        redis.zremrangebyscore(self.key, '-inf', time.time() - self.ttl)
+        return sorted(m.decode('utf-8') if isinstance(m, bytes) else m for m in redis.zrange(self.key, 0, -1))
@@ -0,0 +1,139 @@
+import json
+import logging
+import random
+import re
+import string
+
+from python_http_client.exceptions import HTTPError
+from sendgrid import sendgrid
+from sendgrid.helpers.mail import (
+    Attachment, FileContent, FileName,
+    FileType, Disposition, ContentId)
+from sendgrid.helpers.mail import Mail as SendGridMail, Content, To, Cc, Bcc, Email, Personalization
+
+from api.services.delivery_provider import DeliveryProvider, DeliveryResponse
+from api.utils import is_empty, config
+
+
+class SendGridProvider(DeliveryProvider):
+    """
+    SendGrid v3 mail send API.
+    SEND_GRID_API_HOST could point to a local stand in ( see fake_sendgrid command ) for load testing.
+    """
+
+    name = 'sendgrid'
+    settings_prefix = 'SEND_GRID'
+    rate_limit = 100
+
+    def __init__(self):
+        super().__init__()
+        self.sg = sendgrid.SendGridAPIClient(api_key=config('SEND_GRID_API_KEY'),
+                                             host=config('SEND_GRID_API_HOST', 'https://api.sendgrid.com'))
+        # https://docs.sendgrid.com/api-reference/mail-send/limitations
+        self.max_batch = min(int(config('SEND_GRID_MAX_PERSONALIZATIONS', 1000)), self.max_recipients)
+
+    @staticmethod
+    def _generate_content_id(file: dict):
+        letters = string.ascii_letters
+        return 'CID_'.join(random.choice(letters) for i in range(10))
+
+    def _build_personalization(self, m) -> Personalization:
+        mail_id = m.id
+        personalization = Personalization()
+        to_emails, cc_emails, bcc_emails = self.recipients(m)
+        for to_email in to_emails:
+            personalization.add_to(To(to_email))
+
+        # CC ( only on non debug mode)
+        if len(cc_emails) > 0:
+            logging.getLogger('jobs').debug(
+                "SendGridProvider._build_personalization mail_id {mail_id} cc_email {cc_email}".format(
+                    mail_id=mail_id, cc_email=m.cc_email))
+            for cc_email in cc_emails:
+                personalization.add_cc(Cc(cc_email))
+
+        # BCC ( only on non debug mode)
+        if len(bcc_emails) > 0:
+            logging.getLogger('jobs').debug(
+                "SendGridProvider._build_personalization mail_id {mail_id} bcc_email {bcc_email}".format(
+                    mail_id=mail_id, bcc_email=m.bcc_email))
+            for bcc_email in bcc_emails:
+                personalization.add_bcc(Bcc(bcc_email))
+
+        return personalization
+
+    def build(self, snapshots: list) -> SendGridMail:
+        # all the snapshots share from, subject and content
+        m = snapshots[0]
+        mail = SendGridMail(from_email=Email(m.from_email), subject=m.subject)
+        for idx, snapshot in enumerate(snapshots):
+            mail.add_personalization(self._build_personalization(snapshot), index=idx)
+
+        html_content = Content("text/html", m.html_content) if not is_empty(m.html_content) else None
+        plain_content = Content("text/plain", m.plain_content) if not is_empty(m.plain_content) else None
+
+        if html_content is not None:
+            mail.add_content(html_content)
+        if plain_content is not None:
+            mail.add_content(plain_content)
+        for file in self.attachments(m):
+            disposition = file['disposition'] if 'disposition' in file else 'attachment'
+            attachment = Attachment()
+            attachment.file_content = FileContent(file['content'])
+            attachment.file_type = FileType(file['type'])
+            attachment.file_name = FileName(file['name'])
+            attachment.disposition = Disposition(disposition)
+            content_id = file['content_id'] if 'content_id' in file else self._generate_content_id(file)
+            if disposition == 'inline':
+                # https://sendgrid.com/blog/embedding-images-emails-facts/
+                attachment.content_id = ContentId(content_id)
+            mail.add_attachment(attachment)
+        return mail
+
+    def send(self, message: SendGridMail) -> DeliveryResponse:
+        try:
+            # https://sendgrid.com/docs/API_Reference/Web_API_v3/Mail/errors.html
+            response = self.sg.send(message)
+            return DeliveryResponse(status_code=response.status_code, body=response.body, headers=response.headers)
+        except HTTPError as e:
+            try:
+                logging.getLogger('jobs').error(e.to_dict)
+            except ValueError:
+                logging.getLogger('jobs').error(e.body)
+            # errors payload kept, so the rejected personalizations could be told apart
+            body = e.body.decode('utf-8', 'replace') if isinstance(e.body, bytes) and e.body else e.__str__()
+            return DeliveryResponse(status_code=e.status_code, body=body, headers=e.headers)
+
+    def quota(self, response: DeliveryResponse) -> tuple:
+        # https://docs.sendgrid.com/api-reference/how-to-use-the-sendgrid-v3-api/rate-limits
+        if response.headers is None:
+            return None
+        try:
+            remaining = response.headers.get('X-RateLimit-Remaining')
+            reset = response.headers.get('X-RateLimit-Reset')
+            if remaining is None or reset is None:
+                return None
+            return int(remaining), float(reset)
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def rejected(self, response: DeliveryResponse, count: int) -> list:
+        # {"errors": [{"message": "...", "field": "personalizations.1.to.0.email"}]}
+        try:
+            body = response.body.decode('utf-8') if isinstance(response.body, bytes) else response.body
+            errors = json.loads(body)['errors']
+            fields = [error.get('field') or '' for error in errors]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        indexes = set()
+        for field in fields:
+            match = re.match(r'^personalizations(?:\.|\[)(\d+)', field)
+            if match is None:
+                # an error on the whole request
+                return None
+            indexes.add(int(match.group(1)))
+        indexes = sorted(i for i in indexes if i < count)
+        return indexes if len(indexes) > 0 else None
+
+    def describe(self, message: SendGridMail) -> str:
+        return str(message.get())
@@ -0,0 +1,191 @@
+import base64
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import make_msgid
+from typing import NamedTuple
+
+from api.services.delivery_provider import DeliveryProvider, DeliveryResponse
+from api.utils import is_empty, config
+
+
+class SmtpProvider(DeliveryProvider):
+    """
+    Delivers thru an SMTP relay.
+    Authenticated connections are kept open on a pool ( one per send worker ) and reused for
+    up to SEND_EMAILS_SMTP_MAX_MESSAGES messages, so the connect / TLS / AUTH round trips are
+    paid once per connection and not once per mail.
+    SMTP replies are mapped to http like status codes for the dispatcher: 250 -> 202,
+    4xx ( transient ) -> 503, 5xx ( permanent ) -> 400.
+    """
+
+    name = 'smtp'
+    settings_prefix = 'SEND_EMAILS_SMTP'
+
+    class Message(NamedTuple):
+        mail_id: int
+        from_email: str
+        recipients: list
+        mime: EmailMessage
+
+    class Connection:
+
+        def __init__(self, smtp: smtplib.SMTP):
+            self.smtp = smtp
+            self.messages = 0
+            self.last_used = time.monotonic()
+
+    def __init__(self):
+        super().__init__()
+        self.host = config('SEND_EMAILS_SMTP_HOST', 'localhost')
+        self.port = int(config('SEND_EMAILS_SMTP_PORT', 25))
+        self.user = config('SEND_EMAILS_SMTP_USER', None)
+        self.password = config('SEND_EMAILS_SMTP_PASSWORD', None)
+        self.use_tls = bool(config('SEND_EMAILS_SMTP_USE_TLS', False))
+        self.use_ssl = bool(config('SEND_EMAILS_SMTP_USE_SSL', False))
+        self.timeout = float(config('SEND_EMAILS_SMTP_TIMEOUT', 30))
+        self.max_messages = int(config('SEND_EMAILS_SMTP_MAX_MESSAGES', 100))
+        # idle connections are checked with a NOOP before being reused
+        self.max_idle = float(config('SEND_EMAILS_SMTP_MAX_IDLE', 30))
+        self.pool = queue.LifoQueue(maxsize=int(config('SEND_EMAILS_SMTP_POOL_SIZE', 8)))
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.use_tls and not self.use_ssl:
+                smtp.starttls()
+                smtp.ehlo()
+            if not is_empty(self.user):
+                smtp.login(self.user, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self.lock:
+            self.connections += 1
+        logging.getLogger('jobs').debug('SmtpProvider connected to {host}:{port}'.format(host=self.host,
+                                                                                       port=self.port))
+        return SmtpProvider.Connection(smtp)
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _acquire(self) -> Connection:
+        while True:
+            try:
+                connection = self.pool.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - connection.last_used < self.max_idle:
+                return connection
+            try:
+                if connection.smtp.noop()[0] == 250:
+                    return connection
+            except Exception:
+                pass
+            self._close(connection.smtp)
+
+    def _release(self, connection: Connection):
+        connection.messages += 1
+        connection.last_used = time.monotonic()
+        if connection.messages >= self.max_messages:
+            self._close(connection.smtp)
+            return
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            self._close(connection.smtp)
+
+    def close(self):
+        while True:
+            try:
+                self._close(self.pool.get_nowait().smtp)
+            except queue.Empty:
+                return
+
+    def build(self, snapshots: list) -> Message:
+        # no personalizations on SMTP, one message per mail ( max_batch = 1 )
+        m = snapshots[0]
+        to_emails, cc_emails, bcc_emails = self.recipients(m)
+        mime = EmailMessage()
+        mime['From'] = m.from_email
+        mime['To'] = ', '.join(to_emails)
+        if len(cc_emails) > 0:
+            mime['Cc'] = ', '.join(cc_emails)
+        mime['Subject'] = m.subject
+        mime['Message-ID'] = make_msgid(idstring=str(m.id))
+
+        if not is_empty(m.plain_content):
+            mime.set_content(m.plain_content)
+            if not is_empty(m.html_content):
+                mime.add_alternative(m.html_content, subtype='html')
+        else:
+            mime.set_content(m.html_content, subtype='html')
+
+        for file in self.attachments(m):
+            content = file['content']
+            content = base64.b64decode(content.encode('ascii') if isinstance(content, str) else content)
+            maintype, _, subtype = file['type'].partition('/')
+            disposition = file['disposition'] if 'disposition' in file else 'attachment'
+            if disposition == 'inline' and 'content_id' in file:
+                # referenced from the html as cid:content_id
+                html = mime.get_body(('html',))
+                target = html if html is not None else mime
+                target.add_related(content, maintype=maintype, subtype=subtype or 'octet-stream',
+                                   cid='<{cid}>'.format(cid=file['content_id']), filename=file['name'],
+                                   disposition='inline')
+                continue
+            mime.add_attachment(content, maintype=maintype, subtype=subtype or 'octet-stream',
+                                filename=file['name'], disposition=disposition)
+
+        return SmtpProvider.Message(mail_id=m.id, from_email=m.from_email,
+                                    recipients=to_emails + cc_emails + bcc_emails, mime=mime)
+
+    def send(self, message: Message) -> DeliveryResponse:
+        # a pooled connection could have been dropped by the server, retried once on a new one
+        for attempt in range(2):
+            connection = self._acquire()
+            try:
+                refused = connection.smtp.send_message(message.mime, from_addr=message.from_email,
+                                                       to_addrs=message.recipients)
+            except smtplib.SMTPServerDisconnected:
+                self._close(connection.smtp)
+                if attempt > 0:
+                    raise
+                continue
+            except smtplib.SMTPRecipientsRefused as e:
+                self._release(connection)
+                return self._response(min(code for code, _msg in e.recipients.values()), str(e.recipients))
+            except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                self._release(connection)
+                error = e.smtp_error.decode('utf-8', 'replace') if isinstance(e.smtp_error, bytes) else str(e.smtp_error)
+                return self._response(e.smtp_code, error)
+            except Exception:
+                self._close(connection.smtp)
+                raise
+            self._release(connection)
+            if len(refused) > 0:
+                logging.getLogger('jobs').warning('SmtpProvider mail {id} refused recipients {refused}'.format(
+                    id=message.mail_id, refused=refused))
+            return DeliveryResponse(status_code=202, body='', headers={'Message-ID': message.mime['Message-ID']})
+
+    @staticmethod
+    def _response(smtp_code: int, error: str) -> DeliveryResponse:
+        # 4xx transient, 5xx permanent
+        status_code = 503 if 400 <= smtp_code < 500 else 400
+        return DeliveryResponse(status_code=status_code, body='{code} {error}'.format(code=smtp_code, error=error),
+                                headers={})
+
+    def describe(self, message: Message) -> str:
+        return 'mail {id} from {from_email} to {recipients}'.format(id=message.mail_id, from_email=message.from_email,
+                                                                    recipients=message.recipients)
@@ -0,0 +1,52 @@
+import json
+import os
+import uuid
+
+from api.services.delivery_provider import DeliveryProvider, DeliveryResponse
+from api.utils import config
+
+
+class SpoolProvider(DeliveryProvider):
+    """
+    Writes every request as a json file on SEND_EMAILS_SPOOL_DIR instead of sending it.
+    Meant for dev environments and for load testing the dispatcher without any network.
+    """
+
+    name = 'spool'
+    settings_prefix = 'SEND_EMAILS_SPOOL'
+
+    def __init__(self, spool_dir: str = None):
+        super().__init__()
+        self.spool_dir = spool_dir if spool_dir else config('SEND_EMAILS_SPOOL_DIR',
+                                                            os.path.join(config('BASE_DIR'), 'spool'))
+        self.max_batch = int(config('SEND_EMAILS_SPOOL_MAX_BATCH', 1000))
+
+    def build(self, snapshots: list) -> dict:
+        m = snapshots[0]
+        personalizations = []
+        for snapshot in snapshots:
+            to_emails, cc_emails, bcc_emails = self.recipients(snapshot)
+            personalizations.append({'mail_id': snapshot.id, 'to': to_emails, 'cc': cc_emails, 'bcc': bcc_emails})
+        return {
+            'from': m.from_email,
+            'subject': m.subject,
+            'html': m.html_content,
+            'plain': m.plain_content,
+            'personalizations': personalizations,
+            'attachments': [{'name': file['name'], 'type': file['type'],
+                             'disposition': file['disposition'] if 'disposition' in file else 'attachment',
+                             'size': len(file['content'])} for file in self.attachments(m)],
+        }
+
+    def send(self, message: dict) -> DeliveryResponse:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        message_id = uuid.uuid4().hex
+        path = os.path.join(self.spool_dir, '{id}.json'.format(id=message_id))
+        # written aside and renamed, so readers never see a partial file
+        with open(path + '.tmp', 'w') as f:
+            json.dump(message, f)
+        os.replace(path + '.tmp', path)
+        return DeliveryResponse(status_code=202, body='', headers={'X-Message-Id': message_id})
+
+    def describe(self, message: dict) -> str:
+        return json.dumps(message)
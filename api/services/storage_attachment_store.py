@@ -0,0 +1,38 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from api.services.attachment_store import AttachmentStore
+from api.utils import config
+
+
+class StorageAttachmentStore(AttachmentStore):
+    """
+    Blobs stored thru a django storage backend ( DEFAULT_FILE_STORAGE ), so any object store with
+    a storage backend ( ie S3 or GCS thru django-storages ) could be plugged in without code changes.
+    """
+
+    def __init__(self, storage=None, prefix: str = None):
+        self.storage = storage if storage is not None else default_storage
+        self.prefix = prefix if prefix is not None else config('ATTACHMENT_STORE_PREFIX', 'attachments/')
+
+    def name(self, key: str) -> str:
+        return '{prefix}{key}'.format(prefix=self.prefix, key=key)
+
+    def put(self, content: bytes) -> str:
+        key = self.key(content)
+        if not self.storage.exists(self.name(key)):
+            self.storage.save(self.name(key), ContentFile(content))
+        return key
+
+    def get(self, key: str) -> bytes:
+        if not self.storage.exists(self.name(key)):
+            raise KeyError(key)
+        with self.storage.open(self.name(key), 'rb') as f:
+            return f.read()
+
+    def exists(self, key: str) -> bool:
+        return self.storage.exists(self.name(key))
+
+    def delete(self, key: str):
+        # no-op on most backends when it is not there
+        self.storage.delete(self.name(key))
@@ -0,0 +1,12 @@
+from api.models import ArchivedMail
+from api.services.mail_archive import MailArchive
+
+
+class TableMailArchive(MailArchive):
+    """
+    Moves the archived mails to api_archivedmail, on the same transaction that deletes them.
+    """
+
+    def write(self, rows: list):
+        # a chunk written again ( ie after an interrupted run ) is skipped
+        ArchivedMail.objects.bulk_create([ArchivedMail(**row) for row in rows], ignore_conflicts=True)
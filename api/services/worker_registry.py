@@ -0,0 +1,31 @@
+from abc import abstractmethod
+
+
+class WorkerRegistry:
+    """
+    Membership of the running send workers, used to split the queue into shards.
+    """
+
+    @abstractmethod
+    def register(self, worker_id: str):
+        pass
+
+    @abstractmethod
+    def unregister(self, worker_id: str):
+        pass
+
+    @abstractmethod
+    def members(self) -> list:
+        """
+        :return: sorted ids of the live workers
+        """
+        pass
+
+    def shard(self, worker_id: str) -> tuple:
+        """
+        :return: ( index, count ) shard of the queue assigned to the worker, None if it is not a member
+        """
+        members = self.members()
+        if worker_id not in members:
+            return None
+        return members.index(worker_id), len(members)
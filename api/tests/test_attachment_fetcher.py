@@ -0,0 +1,219 @@
+import hashlib
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import SimpleTestCase
+
+from api.services.attachment_fetcher import AttachmentFetcher
+from api.services.http_attachment_fetcher import HttpAttachmentFetcher, PinnedHostAdapter
+
+
+class FileServer:
+    """
+    Local http server for the attachments fetched by url, files carry an ETag and honor If-None-Match.
+    """
+
+    class Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            files = self.server.files
+            with files.lock:
+                files.requests += 1
+                files.hosts.append(self.headers.get('Host'))
+                content = files.files.get(self.path)
+                location = files.redirects.get(self.path)
+                status_code = files.statuses.get(self.path)
+            if status_code is not None:
+                self.send_response(status_code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if location is not None:
+                self.send_response(302)
+                self.send_header('Location', location)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if content is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            etag = '"{hash}"'.format(hash=hashlib.md5(content).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                with files.lock:
+                    files.not_modified += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    def __init__(self):
+        self.files = {}
+        self.redirects = {}
+        self.statuses = {}
+        self.hosts = []
+        self.requests = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+        self.server = FileServer.Server(('127.0.0.1', 0), FileServer.Handler)
+        self.server.files = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://{host}:{port}{path}'.format(host=host, port=port, path=path)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestHttpAttachmentFetcher(SimpleTestCase):
+
+    def setUp(self):
+        self.files = FileServer()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.files.stop()
+        self.dir.cleanup()
+
+    def fetcher(self, **kwargs) -> HttpAttachmentFetcher:
+        options = {'cache_dir': self.dir.name, 'cache_size': 1024, 'max_size': 100, 'max_age': 60,
+                   'allowed_hosts': ['127.0.0.1']}
+        options.update(kwargs)
+        return HttpAttachmentFetcher(**options)
+
+    def test_fresh_entries_are_served_from_cache(self):
+        self.files.files['/ticket.pdf'] = b'ticket'
+        fetcher = self.fetcher()
+
+        self.assertEqual(fetcher.fetch(self.files.url('/ticket.pdf')), b'ticket')
+        self.assertEqual(fetcher.fetch(self.files.url('/ticket.pdf')), b'ticket')
+        # shared between processes
+        self.assertEqual(self.fetcher().fetch(self.files.url('/ticket.pdf')), b'ticket')
+        self.assertEqual(self.files.requests, 1)
+
+    def test_stale_entries_are_revalidated(self):
+        self.files.files['/ticket.pdf'] = b'ticket'
+        fetcher = self.fetcher(max_age=0)
+
+        self.assertEqual(fetcher.fetch(self.files.url('/ticket.pdf')), b'ticket')
+        self.assertEqual(fetcher.fetch(self.files.url('/ticket.pdf')), b'ticket')
+        self.assertEqual(self.files.requests, 2)
+        self.assertEqual(self.files.not_modified, 1)
+
+        self.files.files['/ticket.pdf'] = b'new ticket'
+        self.assertEqual(fetcher.fetch(self.files.url('/ticket.pdf')), b'new ticket')
+        self.assertEqual(self.files.not_modified, 1)
+
+    def test_size_limit(self):
+        self.files.files['/big.pdf'] = b'x' * 101
+        fetcher = self.fetcher()
+
+        with self.assertRaises(Exception):
+            fetcher.fetch(self.files.url('/big.pdf'))
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_missing_and_not_allowed_urls(self):
+        fetcher = self.fetcher(allowed_hosts=['files.test.com'])
+
+        self.assertFalse(fetcher.is_allowed(self.files.url('/ticket.pdf')))
+        self.assertFalse(fetcher.is_allowed('file:///etc/passwd'))
+        self.assertTrue(fetcher.is_allowed('https://files.test.com/ticket.pdf'))
+        with self.assertRaises(Exception):
+            fetcher.fetch(self.files.url('/ticket.pdf'))
+        with self.assertRaises(Exception):
+            self.fetcher().fetch(self.files.url('/missing.pdf'))
+        self.assertEqual(self.files.requests, 1)
+
+    def test_internal_urls_are_not_fetched(self):
+        # nothing is allowed by default
+        self.assertFalse(self.fetcher(allowed_hosts=None).is_allowed('https://files.test.com/ticket.pdf'))
+
+        # any host, but only on public addresses
+        fetcher = self.fetcher(allowed_hosts=['*'])
+        self.assertTrue(fetcher.is_allowed('https://files.test.com/ticket.pdf'))
+        for url in [self.files.url('/ticket.pdf'), 'http://169.254.169.254/latest/meta-data/',
+                    'http://10.0.0.1/ticket.pdf', 'http://[::1]/ticket.pdf', 'http://localhost/ticket.pdf']:
+            with self.assertRaises(AttachmentFetcher.RejectedException):
+                fetcher.fetch(url)
+        self.assertEqual(self.files.requests, 0)
+
+    def test_redirects_are_checked(self):
+        self.files.files['/ticket.pdf'] = b'ticket'
+        self.files.redirects['/moved.pdf'] = '/ticket.pdf'
+        self.files.redirects['/internal.pdf'] = 'http://169.254.169.254/latest/meta-data/'
+        fetcher = self.fetcher()
+
+        self.assertEqual(fetcher.fetch(self.files.url('/moved.pdf')), b'ticket')
+        with self.assertRaises(AttachmentFetcher.RejectedException):
+            fetcher.fetch(self.files.url('/internal.pdf'))
+        self.assertEqual(self.files.requests, 3)
+
+    def test_checked_address_is_requested(self):
+        self.files.files['/ticket.pdf'] = b'ticket'
+        self.files.redirects['/moved.pdf'] = '/ticket.pdf'
+        fetcher = self.fetcher(allowed_hosts=['*'], max_age=0)
+        lookups = []
+
+        def resolve(host):
+            lookups.append(host)
+            # a rebinding host, public until it resolves to an internal address on the redirect hop
+            return ['10.0.0.1'] if len(lookups) == 3 else ['127.0.0.1']
+
+        fetcher.resolve = resolve
+        fetcher.is_public = lambda address: address == '127.0.0.1'
+        host = 'files.test:{port}'.format(port=self.files.server.server_address[1])
+
+        # files.test does not resolve at all, it is only reached thru the checked address
+        self.assertEqual(fetcher.fetch('http://{host}/ticket.pdf'.format(host=host)), b'ticket')
+        self.assertEqual(self.files.hosts, [host])
+        self.assertEqual(lookups, ['files.test'])
+        # every redirect hop is resolved and checked again
+        with self.assertRaises(AttachmentFetcher.RejectedException):
+            fetcher.fetch('http://{host}/moved.pdf'.format(host=host))
+        self.assertEqual(lookups, ['files.test'] * 3)
+        self.assertEqual(self.files.hosts, [host] * 2)
+
+    def test_pinned_https_keeps_the_host_name(self):
+        pool = PinnedHostAdapter('files.test.com').get_connection('https://93.184.216.34/')
+        self.assertEqual(pool.assert_hostname, 'files.test.com')
+        self.assertEqual(pool.conn_kw['server_hostname'], 'files.test.com')
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for name in ['a', 'b', 'c']:
+            self.files.files['/' + name] = name.encode('utf-8') * 4
+        fetcher = self.fetcher(cache_size=10)
+        now = time.time()
+
+        fetcher.fetch(self.files.url('/a'))
+        os.utime(fetcher.path(self.files.url('/a')), (now - 100, now - 100))
+        fetcher.fetch(self.files.url('/b'))
+        os.utime(fetcher.path(self.files.url('/b')), (now - 50, now - 50))
+        # a is used again, b is the least recently used one
+        fetcher.fetch(self.files.url('/a'))
+        fetcher.fetch(self.files.url('/c'))
+
+        self.assertTrue(os.path.exists(fetcher.path(self.files.url('/a'))))
+        self.assertFalse(os.path.exists(fetcher.path(self.files.url('/b'))))
+        self.assertTrue(os.path.exists(fetcher.path(self.files.url('/c'))))
+        self.assertEqual(self.files.requests, 3)
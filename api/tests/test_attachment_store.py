@@ -0,0 +1,46 @@
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, override_settings
+
+from api.services.filesystem_attachment_store import FileSystemAttachmentStore
+from api.services.storage_attachment_store import StorageAttachmentStore
+
+
+class TestAttachmentStore(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.stores = [
+            FileSystemAttachmentStore(self.dir.name),
+            StorageAttachmentStore(FileSystemStorage(location=self.dir.name), 'blobs/'),
+        ]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_same_content_is_stored_once(self):
+        for store in self.stores:
+            key = store.put(b'test')
+            self.assertEqual(store.put(b'test'), key)
+            self.assertNotEqual(store.put(b'other'), key)
+            self.assertEqual(key, store.key(b'test'))
+            self.assertTrue(store.exists(key))
+            self.assertEqual(store.get(key), b'test')
+            store.delete(key)
+            self.assertFalse(store.exists(key))
+            # already gone
+            store.delete(key)
+
+    def test_missing_blob(self):
+        for store in self.stores:
+            key = store.key(b'missing')
+            self.assertFalse(store.exists(key))
+            with self.assertRaises(KeyError):
+                store.get(key)
+
+    @override_settings(ATTACHMENT_STORE_DIR='')
+    def test_filesystem_store_needs_a_shared_dir(self):
+        # no host local default, the workers on other hosts would not find the blobs
+        with self.assertRaises(Exception):
+            FileSystemAttachmentStore()
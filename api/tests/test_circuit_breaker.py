@@ -0,0 +1,60 @@
+from django.test import SimpleTestCase
+
+from api.utils import CircuitBreaker
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('test', error_rate=0.5, window=4, min_calls=4, open_timeout=10,
+                                      ramp_period=100, min_capacity=0.1, clock=self.clock)
+
+    def test_opens_on_error_rate(self):
+        for success in [True, False, True]:
+            self.breaker.record(success)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.capacity(), 0)
+        self.assertEqual(self.breaker.retry_in(), 10)
+
+    def open(self):
+        for _ in range(4):
+            self.breaker.record(False)
+
+    def test_half_open_probe_failure_opens_again(self):
+        self.open()
+        self.clock.now = 10
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.retry_in(), 10)
+
+    def test_half_open_probe_success_closes_and_ramps_up(self):
+        self.open()
+        self.clock.now = 10
+        self.breaker.record(True)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.capacity(), 0.1)
+        self.clock.now = 60
+        self.assertEqual(self.breaker.capacity(), 0.5)
+        self.clock.now = 110
+        self.assertEqual(self.breaker.capacity(), 1)
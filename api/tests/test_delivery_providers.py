@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from api.services.mail_queue import MailSnapshot
+from api.services.sendgrid_provider import SendGridProvider
+from api.services.spool_provider import SpoolProvider
+from api.utils import FakeSendGridServer
+
+
+def snapshot(mail_id: int, to_email: str = 'to@test.com', **kwargs) -> MailSnapshot:
+    fields = dict(id=mail_id, from_email='test@test.com', to_email=to_email, cc_email='', bcc_email='',
+                  subject='test', plain_content='', html_content='<p>test</p>', payload='', retries=0,
+                  max_retries=1, retry_policy=None)
+    fields.update(kwargs)
+    return MailSnapshot(**fields)
+
+
+@override_settings(DEBUG=False)
+class TestSendGridProvider(SimpleTestCase):
+
+    def start(self, **kwargs) -> SendGridProvider:
+        server = FakeSendGridServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        self.server = server
+        with self.settings(SEND_GRID_API_HOST=server.url):
+            return SendGridProvider()
+
+    def test_accepted(self):
+        provider = self.start()
+        mail = provider.build([snapshot(1, 'a@test.com,b@test.com', cc_email='c@test.com'), snapshot(2)])
+
+        request = mail.get()
+        self.assertEqual([len(p['to']) for p in request['personalizations']], [2, 1])
+        self.assertEqual(request['personalizations'][0]['cc'], [{'email': 'c@test.com'}])
+
+        response = provider.send(mail)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.server.accepted, 2)
+
+    def test_errors_are_returned_as_responses(self):
+        provider = self.start(error_rate=1)
+        self.assertGreaterEqual(provider.send(provider.build([snapshot(1)])).status_code, 500)
+
+    def test_throttled(self):
+        provider = self.start(throttle_rate=1, rate_limit=10)
+        response = provider.send(provider.build([snapshot(1)]))
+
+        self.assertEqual(response.status_code, 429)
+        remaining, reset = provider.quota(response)
+        self.assertEqual(remaining, 0)
+        self.assertGreater(reset, 0)
+
+    def test_rate_limit_window(self):
+        provider = self.start(rate_limit=2)
+        statuses = [provider.send(provider.build([snapshot(i)])).status_code for i in range(4)]
+
+        self.assertIn(429, statuses)
+        self.assertEqual(statuses[0], 202)
+
+
+class TestSpoolProvider(SimpleTestCase):
+
+    def test_writes_a_file_per_request(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            provider = SpoolProvider(spool_dir)
+            with self.settings(DEBUG=True, DEV_EMAIL='dev@test.com'):
+                message = provider.build([snapshot(1), snapshot(2, 'other@test.com', bcc_email='bcc@test.com')])
+
+            response = provider.send(message)
+
+            self.assertEqual(response.status_code, 202)
+            files = os.listdir(spool_dir)
+            self.assertEqual(files, ['{id}.json'.format(id=response.headers['X-Message-Id'])])
+            with open(os.path.join(spool_dir, files[0])) as f:
+                spooled = json.load(f)
+            self.assertEqual(spooled['subject'], 'test')
+            # DEBUG redirects everything to DEV_EMAIL
+            self.assertEqual([p['to'] for p in spooled['personalizations']], [['dev@test.com'], ['dev@test.com']])
+            self.assertEqual(spooled['personalizations'][1]['bcc'], [])
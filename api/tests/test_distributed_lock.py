@@ -0,0 +1,28 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from redis.exceptions import ConnectionError
+
+from api.utils import DistributedLock
+
+
+class LockedJob:
+    code = 'api.tests.locked_job'
+
+
+class TestDistributedLock(SimpleTestCase):
+
+    def test_runs_without_lock_while_redis_is_down(self):
+        ran = []
+        with mock.patch('api.utils.distributed_lock.get_redis_connection', side_effect=ConnectionError('down')):
+            with DistributedLock(LockedJob, False):
+                ran.append(True)
+        self.assertEqual(ran, [True])
+
+    def test_lock_held_by_another_run(self):
+        redis = mock.Mock()
+        redis.lock.return_value.acquire.return_value = False
+        with mock.patch('api.utils.distributed_lock.get_redis_connection', return_value=redis):
+            with self.assertRaises(DistributedLock.LockFailedException):
+                with DistributedLock(LockedJob, False):
+                    pass
@@ -2,22 +2,33 @@ import json
 import os
 import random
 import string
+import tempfile
+import time
+from datetime import timedelta
 
 from django.apps import apps
 from django.urls import reverse
 from injector import Injector
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITransactionTestCase
 
 from api.models import MailTemplate, Client, Mail
-from .test_ioc import TestApiAppModule
-from ..services.sendgrid_email_service import SendGridEmailService
+from .test_attachment_fetcher import FileServer
+from .test_ioc import TestApiAppModule, MockRateLimiter, MockAttachmentStore
+from ..services.mail_queue import MailQueue
+from ..services.http_attachment_fetcher import HttpAttachmentFetcher
+from ..services.mail_dispatcher import MailDispatcher
+from ..services.sendgrid_provider import SendGridProvider
+from ..services.spool_provider import SpoolProvider
 import base64
+from unittest import mock
 
-from ..utils import config
+from python_http_client.exceptions import BadRequestsError, TooManyRequestsError
 
+from ..utils import config, CircuitBreaker, RetryPolicy, FakeSendGridServer
 
-class EmailSendingTests(APITestCase):
+
+class EmailSendingTests(APITransactionTestCase):
     fixtures = ["mailtemplates.json"]
 
     def randomString(self, str_len):
@@ -81,7 +92,7 @@ class EmailSendingTests(APITestCase):
         json_response = json.loads(response.content)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-        service = SendGridEmailService()
+        service = MailDispatcher(SendGridProvider())
 
         res = service.process_pending_emails(10)
 
@@ -89,3 +100,472 @@ class EmailSendingTests(APITestCase):
 
         m = Mail.objects.first()
         self.assertTrue(m.is_sent)
+
+    def create_mail(self, to_email: str, subject: str = 'test', **kwargs) -> Mail:
+        return Mail.objects.create(from_email='test@test.com', to_email=to_email, subject=subject,
+                                   html_content='<p>test</p>', owner=Client.objects.first(), template=self.child,
+                                   **kwargs)
+
+    def test_process_pending_emails_concurrently(self):
+        # different content, so each one is sent on its own request
+        for i in range(10):
+            self.create_mail('to+{i}@test.com'.format(i=i), 'test {i}'.format(i=i))
+        failing = self.create_mail('invalid@test.com')
+
+        def send(mail):
+            if mail.get()['personalizations'][0]['to'][0]['email'] == 'invalid@test.com':
+                raise BadRequestsError(mock.Mock(code=400, reason='Bad Request', hdrs={},
+                                                 read=lambda: b'{"errors": [{"message": "invalid"}]}'))
+            return mock.Mock(status_code=202, body='', headers={})
+
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.side_effect = send
+
+        with self.settings(DEBUG=False):
+            res = service.process_pending_emails(100, 4)
+
+        self.assertEqual(res, 11)
+        self.assertEqual(service.provider.sg.send.call_count, 11)
+        self.assertEqual(Mail.objects.filter(sent_date__isnull=False, lock_date__isnull=True).count(), 10)
+        # a 400 is a permanent error, it is not retried
+        failing = Mail.objects.get(pk=failing.id)
+        self.assertFalse(failing.is_sent)
+        self.assertEqual(failing.retries, self.child.max_retries)
+        self.assertIsNone(failing.lock_date)
+        self.assertIsNone(failing.next_retry_date)
+
+    def test_process_pending_emails_batches_identical_content(self):
+        for i in range(5):
+            self.create_mail('to+{i}@test.com'.format(i=i), cc_email='cc+{i}@test.com'.format(i=i))
+        other = self.create_mail('other@test.com', 'other subject')
+        attached = self.create_mail('attached@test.com', payload={
+            'attachments': [{'name': 'test.txt', 'content': 'dGVzdA==', 'type': 'text/plain'}]})
+
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+
+        with self.settings(DEBUG=False):
+            res = service.process_pending_emails(100, 2)
+
+        self.assertEqual(res, 7)
+        self.assertEqual(service.provider.sg.send.call_count, 3)
+        requests = sorted([call[0][0].get() for call in service.provider.sg.send.call_args_list],
+                          key=lambda r: len(r['personalizations']))
+        self.assertEqual([len(r['personalizations']) for r in requests], [1, 1, 5])
+        batched = requests[2]['personalizations']
+        self.assertEqual([p['to'][0]['email'] for p in batched], ['to+{i}@test.com'.format(i=i) for i in range(5)])
+        self.assertEqual([p['cc'][0]['email'] for p in batched], ['cc+{i}@test.com'.format(i=i) for i in range(5)])
+        self.assertEqual(Mail.objects.filter(sent_date__isnull=False, lock_date__isnull=True).count(), 7)
+        self.assertTrue(Mail.objects.get(pk=other.id).is_sent)
+        self.assertTrue(Mail.objects.get(pk=attached.id).is_sent)
+
+    def test_batched_request_failure_is_recorded_on_each_mail(self):
+        mails = [self.create_mail('to+{i}@test.com'.format(i=i)) for i in range(3)]
+
+        service = MailDispatcher(SendGridProvider())
+        service.provider.max_batch = 2
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=500, body='error', headers={})
+
+        with self.settings(DEBUG=False):
+            res = service.process_pending_emails(100)
+
+        self.assertEqual(res, 3)
+        self.assertEqual(service.provider.sg.send.call_count, 2)
+        for m in mails:
+            m = Mail.objects.get(pk=m.id)
+            self.assertFalse(m.is_sent)
+            self.assertEqual(m.retries, 1)
+            self.assertEqual(m.last_error, 'error')
+
+    def test_rejected_batched_request_is_split(self):
+        mails = [self.create_mail('to+{i}@test.com'.format(i=i)) for i in range(5)]
+        rejected = self.create_mail('invalid@test.com')
+
+        def send(mail):
+            emails = [p['to'][0]['email'] for p in mail.get()['personalizations']]
+            if 'invalid@test.com' in emails:
+                return mock.Mock(status_code=400, body='invalid', headers={})
+            return mock.Mock(status_code=202, body='', headers={})
+
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.side_effect = send
+
+        with self.settings(DEBUG=False):
+            self.assertEqual(service.process_pending_emails(100), 6)
+
+        # only the rejected mail is failed, the rest of the group is sent
+        self.assertTrue(all(Mail.objects.get(pk=m.id).is_sent for m in mails))
+        rejected = Mail.objects.get(pk=rejected.id)
+        self.assertFalse(rejected.is_sent)
+        self.assertEqual(rejected.status, Mail.STATUS_FAILED)
+        self.assertEqual(rejected.last_error, 'invalid')
+        # 1 group, 2 halves, then the half with the rejected mail split down to it
+        self.assertEqual(service.provider.sg.send.call_count, 7)
+
+    def test_group_wide_rejection_is_not_split_down(self):
+        mails = [self.create_mail('to+{i}@test.com'.format(i=i)) for i in range(8)]
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        # ie the from address is not verified, every request is rejected
+        service.provider.sg.send.return_value = mock.Mock(status_code=400, body='invalid from', headers={})
+
+        with self.settings(DEBUG=False):
+            self.assertEqual(service.process_pending_emails(100), 8)
+
+        self.assertTrue(all(Mail.objects.get(pk=m.id).status == Mail.STATUS_FAILED for m in mails))
+        # the group and its two halves, not a request per mail
+        self.assertEqual(service.provider.sg.send.call_count, 3)
+
+    def test_rejected_personalizations_are_failed(self):
+        mails = [self.create_mail('to+{i}@test.com'.format(i=i)) for i in range(5)]
+        rejected = self.create_mail('invalid@test.com')
+
+        def send(mail):
+            emails = [p['to'][0]['email'] for p in mail.get()['personalizations']]
+            if 'invalid@test.com' in emails:
+                raise BadRequestsError(mock.Mock(code=400, reason='Bad Request', hdrs={}, read=lambda: json.dumps(
+                    {'errors': [{'message': 'invalid email', 'field': 'personalizations.{i}.to.0.email'.format(
+                        i=emails.index('invalid@test.com'))}]}).encode()))
+            return mock.Mock(status_code=202, body='', headers={})
+
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.side_effect = send
+
+        with self.settings(DEBUG=False):
+            self.assertEqual(service.process_pending_emails(100), 6)
+
+        self.assertTrue(all(Mail.objects.get(pk=m.id).is_sent for m in mails))
+        rejected = Mail.objects.get(pk=rejected.id)
+        self.assertEqual(rejected.status, Mail.STATUS_FAILED)
+        self.assertIn('invalid email', rejected.last_error)
+        # the group, then the rest of it without the rejected personalization
+        self.assertEqual(service.provider.sg.send.call_count, 2)
+
+    def test_rate_limited_mails_are_requeued_without_consuming_retries(self):
+        mail = self.create_mail('to@test.com')
+        limiter = MockRateLimiter()
+        service = MailDispatcher(SendGridProvider(), limiter)
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.side_effect = TooManyRequestsError(mock.Mock(
+            code=429, reason='Too Many Requests', read=lambda: b'{"errors": [{"message": "too many requests"}]}',
+            hdrs={'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '{reset}'.format(reset=int(time.time()) + 5)}))
+
+        res = service.process_pending_emails(100)
+
+        self.assertEqual(res, 1)
+        mail = Mail.objects.get(pk=mail.id)
+        self.assertFalse(mail.is_sent)
+        self.assertEqual(mail.retries, 0)
+        self.assertIsNone(mail.lock_date)
+        self.assertLessEqual(mail.next_retry_date, MailQueue.now() + timedelta(
+            seconds=service.retry_policy.cap(RetryPolicy.RATE_LIMITED)))
+        self.assertEqual(limiter.updates[0][:2], ('sendgrid', 0))
+        self.assertEqual(len(limiter.backoffs), 1)
+
+    def test_rate_limit_headers_adapt_the_limiter(self):
+        self.create_mail('to@test.com')
+        limiter = MockRateLimiter()
+        service = MailDispatcher(SendGridProvider(), limiter)
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={
+            'X-RateLimit-Remaining': '599', 'X-RateLimit-Reset': '1600000000'})
+
+        self.assertEqual(service.process_pending_emails(100), 1)
+        self.assertEqual(limiter.updates, [('sendgrid', 599, 1600000000.0)])
+
+    def test_provider_outage_opens_the_circuit(self):
+        for i in range(4):
+            self.create_mail('to+{i}@test.com'.format(i=i), 'test {i}'.format(i=i))
+
+        service = MailDispatcher(SendGridProvider())
+        service.breaker.min_calls = 2
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=503, body='unavailable', headers={})
+
+        self.assertEqual(service.process_pending_emails(100, 1), 4)
+        self.assertEqual(service.breaker.state, CircuitBreaker.OPEN)
+        # once open the rest of the batch is requeued without burning retries
+        self.assertEqual(service.provider.sg.send.call_count, 2)
+        self.assertEqual(Mail.objects.filter(retries=1).count(), 2)
+        self.assertEqual(Mail.objects.filter(retries=0, lock_date__isnull=True).count(), 2)
+
+        # nothing is claimed while open
+        Mail.objects.update(next_retry_date=None, due_at=MailQueue.now())
+        self.assertEqual(service.process_pending_emails(100, 1), 0)
+        self.assertEqual(Mail.objects.filter(lock_date__isnull=False).count(), 0)
+
+    def test_half_open_provider_gets_a_single_probe(self):
+        mails = [self.create_mail('to+{i}@test.com'.format(i=i), 'test {i}'.format(i=i)) for i in range(5)]
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+
+        service = MailDispatcher([SendGridProvider(), SpoolProvider(spool.name)])
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+        # primary outage is over, its circuit waits for a probe
+        service.breaker._state = CircuitBreaker.OPEN
+        service.breaker.opened_at = service.breaker.clock() - service.breaker.open_timeout
+        self.assertEqual(service.breaker.state, CircuitBreaker.HALF_OPEN)
+
+        with self.settings(DEBUG=False):
+            self.assertEqual(service.process_pending_emails(100, 4), 5)
+
+        # the rest of the batch goes thru the healthy route
+        self.assertEqual(service.provider.sg.send.call_count, 1)
+        self.assertEqual(Mail.objects.get(pk=mails[0].id).provider, 'sendgrid')
+        self.assertEqual(Mail.objects.filter(provider='spool').count(), 4)
+        self.assertEqual(service.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_transient_errors_backoff_with_template_policy(self):
+        self.child.max_retries = 3
+        self.child.retry_policy = {'transient': {'base': 100, 'factor': 2, 'cap': 150}}
+        self.child.save()
+        mail = self.create_mail('to@test.com')
+        mail.retries = 2
+        mail.save()
+
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=503, body='unavailable', headers={})
+
+        start = MailQueue.now()
+        self.assertEqual(service.process_pending_emails(100), 1)
+
+        mail = Mail.objects.get(pk=mail.id)
+        self.assertEqual(mail.retries, 3)
+        # capped at 150 seconds, half of it jittered
+        self.assertGreaterEqual(mail.next_retry_date, start + timedelta(seconds=75))
+        self.assertLessEqual(mail.next_retry_date, MailQueue.now() + timedelta(seconds=150))
+
+    def test_dispatch_against_fake_sendgrid(self):
+        for i in range(20):
+            self.create_mail('to+{i}@test.com'.format(i=i), 'test {i}'.format(i=i))
+        server = FakeSendGridServer(min_latency=0.01, max_latency=0.05).start()
+        self.addCleanup(server.stop)
+
+        with self.settings(SEND_GRID_API_HOST=server.url, DEBUG=False):
+            service = MailDispatcher(SendGridProvider())
+            res = service.process_pending_emails(100, 4)
+
+        self.assertEqual(res, 20)
+        self.assertEqual(server.requests, 20)
+        self.assertEqual(Mail.objects.filter(sent_date__isnull=False).count(), 20)
+
+    def test_retryable_errors_fail_over_to_the_next_provider(self):
+        ok = self.create_mail('to@test.com')
+        rejected = self.create_mail('invalid@test.com', 'rejected')
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+
+        def send(mail):
+            if mail.get()['personalizations'][0]['to'][0]['email'] == 'invalid@test.com':
+                return mock.Mock(status_code=400, body='invalid', headers={})
+            return mock.Mock(status_code=503, body='unavailable', headers={})
+
+        with self.settings(DEBUG=False):
+            service = MailDispatcher([SendGridProvider(), SpoolProvider(spool.name)])
+            service.provider.sg = mock.Mock()
+            service.provider.sg.send.side_effect = send
+            self.assertEqual(service.process_pending_emails(100), 2)
+
+        ok = Mail.objects.get(pk=ok.id)
+        self.assertTrue(ok.is_sent)
+        self.assertEqual(ok.provider, 'spool')
+        self.assertEqual(ok.retries, 0)
+        # permanent errors do not fail over
+        rejected = Mail.objects.get(pk=rejected.id)
+        self.assertFalse(rejected.is_sent)
+        self.assertEqual(rejected.provider, '')
+        self.assertEqual(len(os.listdir(spool.name)), 1)
+
+    def test_exhausted_provider_is_skipped(self):
+        self.create_mail('to@test.com')
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+
+        service = MailDispatcher([SendGridProvider(), SpoolProvider(spool.name)])
+        service.provider.sg = mock.Mock()
+        service.routes[0].quota = (0, time.time() + 60)
+
+        self.assertEqual(service.process_pending_emails(100), 1)
+        self.assertEqual(service.provider.sg.send.call_count, 0)
+        self.assertEqual(Mail.objects.get().provider, 'spool')
+
+    def test_weighted_strategy_splits_between_providers(self):
+        for i in range(20):
+            self.create_mail('to+{i}@test.com'.format(i=i), 'test {i}'.format(i=i))
+        first = tempfile.TemporaryDirectory()
+        second = tempfile.TemporaryDirectory()
+        self.addCleanup(first.cleanup)
+        self.addCleanup(second.cleanup)
+
+        service = MailDispatcher([MailDispatcher.Route(SpoolProvider(first.name), 1),
+                                  MailDispatcher.Route(SpoolProvider(second.name), 1)],
+                                 strategy=MailDispatcher.WEIGHTED)
+        # a route per loaded chunk
+        service.load_batch = 1
+        random.seed(1)
+
+        self.assertEqual(service.process_pending_emails(100), 20)
+        self.assertEqual(len(os.listdir(first.name)) + len(os.listdir(second.name)), 20)
+        self.assertGreater(len(os.listdir(first.name)), 0)
+        self.assertGreater(len(os.listdir(second.name)), 0)
+
+    def test_template_send_rate_cap(self):
+        self.child.max_per_minute = 60
+        self.child.save()
+        mails = [self.create_mail('to+{i}@test.com'.format(i=i)) for i in range(3)]
+        limiter = MockRateLimiter({'template:{id}'.format(id=self.child.id): 1})
+        service = MailDispatcher(SendGridProvider(), limiter)
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+
+        start = MailQueue.now()
+        self.assertEqual(service.process_pending_emails(100), 3)
+
+        self.assertEqual(service.provider.sg.send.call_count, 1)
+        self.assertTrue(Mail.objects.get(pk=mails[0].id).is_sent)
+        throttled = Mail.objects.filter(id__in=[m.id for m in mails[1:]]).order_by('next_retry_date')
+        # requeued without burning a retry, spread at the cap rate
+        self.assertEqual([m.retries for m in throttled], [0, 0])
+        self.assertGreaterEqual(throttled[0].next_retry_date, start + timedelta(seconds=1))
+        self.assertGreaterEqual(throttled[1].next_retry_date, start + timedelta(seconds=2))
+
+    def test_expired_mails_are_not_sent(self):
+        self.create_mail('expired@test.com', expires_at=MailQueue.now() - timedelta(seconds=1))
+        self.create_mail('to@test.com')
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+
+        self.assertEqual(service.process_pending_emails(100), 1)
+        self.assertEqual(service.expired, 1)
+        self.assertEqual(service.provider.sg.send.call_count, 1)
+        self.assertEqual(Mail.objects.filter(expired_date__isnull=False, sent_date__isnull=True).count(), 1)
+
+    def test_mails_expired_after_the_claim_are_not_sent(self):
+        expired = self.create_mail('expired@test.com', expires_at=MailQueue.now() + timedelta(milliseconds=100))
+        sent = self.create_mail('to@test.com', expires_at=MailQueue.now() + timedelta(hours=1))
+        service = MailDispatcher(SendGridProvider())
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+        # claimed before its ttl, sent after it
+        claim = service.queue.claim
+
+        def late_claim(*args, **kwargs):
+            ids = claim(*args, **kwargs)
+            time.sleep(0.2)
+            return ids
+
+        service.queue.claim = late_claim
+
+        self.assertEqual(service.process_pending_emails(100), 2)
+        self.assertEqual(service.expired, 1)
+        self.assertEqual(service.provider.sg.send.call_count, 1)
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, Mail.STATUS_EXPIRED)
+        self.assertIsNotNone(expired.expired_date)
+        self.assertIsNone(expired.sent_date)
+        sent.refresh_from_db()
+        self.assertEqual(sent.status, Mail.STATUS_SENT)
+
+    def test_expired_mails_do_not_fail_over(self):
+        expired = self.create_mail('expired@test.com', expires_at=MailQueue.now() + timedelta(milliseconds=100))
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        service = MailDispatcher([SendGridProvider(), SpoolProvider(spool.name)])
+        service.provider.sg = mock.Mock()
+        claim = service.queue.claim
+
+        def late_claim(*args, **kwargs):
+            ids = claim(*args, **kwargs)
+            time.sleep(0.2)
+            return ids
+
+        service.queue.claim = late_claim
+
+        with mock.patch.object(service, '_send', wraps=service._send) as send:
+            self.assertEqual(service.process_pending_emails(100), 1)
+
+        # expiry stops the delivery, it is not tried on the next provider
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(service.provider.sg.send.call_count, 0)
+        self.assertEqual(os.listdir(spool.name), [])
+        self.assertEqual(Mail.objects.get(pk=expired.id).status, Mail.STATUS_EXPIRED)
+
+    def test_stored_attachments_are_read_once_per_poll(self):
+        store = MockAttachmentStore()
+        blob = store.put(b'test')
+        payload = {'attachments': [{'name': 'test.txt', 'blob': blob, 'size': 4, 'type': 'text/plain'}]}
+        for i in range(3):
+            self.create_mail('to+{i}@test.com'.format(i=i), payload=payload)
+        missing = self.create_mail('missing@test.com', payload={
+            'attachments': [{'name': 'gone.txt', 'blob': MockAttachmentStore.key(b'gone'), 'type': 'text/plain'}]})
+        service = MailDispatcher(SendGridProvider(), attachment_store=store)
+        service.provider.sg = mock.Mock()
+        service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+
+        with self.settings(DEBUG=False):
+            self.assertEqual(service.process_pending_emails(100, 2), 4)
+
+        # the 3 mails carrying the same file share a single read
+        self.assertEqual(store.reads, 2)
+        self.assertEqual(service.provider.sg.send.call_count, 3)
+        for call in service.provider.sg.send.call_args_list:
+            self.assertEqual(call[0][0].get()['attachments'][0]['content'], 'dGVzdA==')
+        self.assertEqual(Mail.objects.filter(sent_date__isnull=False).count(), 3)
+        self.assertIn('not found', Mail.objects.get(pk=missing.id).last_error)
+
+    def test_attachments_by_url_are_fetched_once(self):
+        files = FileServer()
+        files.files['/ticket.pdf'] = b'test'
+        payload = {'attachments': [{'name': 'ticket.pdf', 'url': files.url('/ticket.pdf'), 'type': 'application/pdf'}]}
+        for i in range(3):
+            self.create_mail('to+{i}@test.com'.format(i=i), payload=payload)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            service = MailDispatcher(SendGridProvider(), attachment_fetcher=HttpAttachmentFetcher(cache_dir,
+                                                                                                 allowed_hosts=['127.0.0.1']))
+            service.provider.sg = mock.Mock()
+            service.provider.sg.send.return_value = mock.Mock(status_code=202, body='', headers={})
+
+            with self.settings(DEBUG=False):
+                self.assertEqual(service.process_pending_emails(100, 2), 3)
+        files.stop()
+
+        self.assertEqual(files.requests, 1)
+        for call in service.provider.sg.send.call_args_list:
+            self.assertEqual(call[0][0].get()['attachments'][0]['content'], 'dGVzdA==')
+        self.assertEqual(Mail.objects.filter(sent_date__isnull=False).count(), 3)
+
+    def test_attachments_fetch_failures_are_retried(self):
+        self.child.max_retries = 3
+        self.child.save()
+        files = FileServer()
+        files.statuses['/down.pdf'] = 503
+        down = self.create_mail('down@test.com', payload={
+            'attachments': [{'name': 'ticket.pdf', 'url': files.url('/down.pdf'), 'type': 'application/pdf'}]})
+        missing = self.create_mail('missing@test.com', payload={
+            'attachments': [{'name': 'ticket.pdf', 'url': files.url('/missing.pdf'), 'type': 'application/pdf'}]})
+        with tempfile.TemporaryDirectory() as cache_dir:
+            service = MailDispatcher(SendGridProvider(), attachment_fetcher=HttpAttachmentFetcher(
+                cache_dir, allowed_hosts=['127.0.0.1']))
+            service.provider.sg = mock.Mock()
+
+            with self.settings(DEBUG=False):
+                self.assertEqual(service.process_pending_emails(100), 2)
+        files.stop()
+
+        self.assertEqual(service.provider.sg.send.call_count, 0)
+        # the origin is down, retried later
+        down = Mail.objects.get(pk=down.id)
+        self.assertEqual(down.status, Mail.STATUS_PENDING)
+        self.assertEqual(down.retries, 1)
+        self.assertIsNotNone(down.next_retry_date)
+        # not found would fail the same way on every retry
+        missing = Mail.objects.get(pk=missing.id)
+        self.assertEqual(missing.status, Mail.STATUS_FAILED)
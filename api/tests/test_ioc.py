@@ -3,18 +3,96 @@ from injector import Module, singleton
 
 from api.models import Client
 from api.security.abstract_access_token_service import AbstractAccessTokenService
+from api.services.attachment_fetcher import AttachmentFetcher
+from api.services.attachment_store import AttachmentStore
 from api.services.email_service import EmailService
+from api.services.mail_notifier import MailNotifier
+from api.services.rate_limiter import RateLimiter
 from api.services.github_service import GithubService
+from api.services.http_attachment_fetcher import HttpAttachmentFetcher
 from api.services.vcs_service import VCSService
+from api.services.worker_registry import WorkerRegistry
 from api.utils import config
 
 
-class MockSendGridEmailService(EmailService):
+class MockEmailService(EmailService):
 
-    def process_pending_emails(self, batch: int) -> int:
+    def process_pending_emails(self, batch: int, concurrency: int = None, shard: tuple = None) -> int:
         return 1
 
 
+class MockMailNotifier(MailNotifier):
+
+    def __init__(self):
+        self.notifications = 0
+
+    def notify(self):
+        self.notifications += 1
+
+    def wait(self, timeout: float) -> bool:
+        return False
+
+
+class MockRateLimiter(RateLimiter):
+
+    def __init__(self, limits: dict = None):
+        # tokens left by bucket, buckets not listed are unlimited
+        self.limits = limits if limits else {}
+        self.updates = []
+        self.backoffs = []
+
+    def acquire(self, provider: str, rate: float, burst: int, tokens: int = 1) -> float:
+        if provider not in self.limits:
+            return 0
+        if self.limits[provider] >= tokens:
+            self.limits[provider] -= tokens
+            return 0
+        return tokens / rate
+
+    def update(self, provider: str, remaining: int, reset: float):
+        self.updates.append((provider, remaining, reset))
+
+    def backoff(self, provider: str, seconds: float):
+        self.backoffs.append((provider, seconds))
+
+
+class MockWorkerRegistry(WorkerRegistry):
+
+    def __init__(self):
+        self.workers = set()
+
+    def register(self, worker_id: str):
+        self.workers.add(worker_id)
+
+    def unregister(self, worker_id: str):
+        self.workers.discard(worker_id)
+
+    def members(self) -> list:
+        return sorted(self.workers)
+
+
+class MockAttachmentStore(AttachmentStore):
+
+    def __init__(self):
+        self.blobs = {}
+        self.reads = 0
+
+    def put(self, content: bytes) -> str:
+        key = self.key(content)
+        self.blobs[key] = content
+        return key
+
+    def get(self, key: str) -> bytes:
+        self.reads += 1
+        return self.blobs[key]
+
+    def exists(self, key: str) -> bool:
+        return key in self.blobs
+
+    def delete(self, key: str):
+        self.blobs.pop(key, None)
+
+
 class MockAccessTokenService(AbstractAccessTokenService):
 
     def validate(self, access_token: str):
@@ -39,9 +117,24 @@ class MockAccessTokenService(AbstractAccessTokenService):
 class TestApiAppModule(Module):
     def configure(self, binder):
         # services
-        test_email_service = MockSendGridEmailService()
+        test_email_service = MockEmailService()
         binder.bind(EmailService, to=test_email_service, scope=singleton)
 
+        test_mail_notifier = MockMailNotifier()
+        binder.bind(MailNotifier, to=test_mail_notifier, scope=singleton)
+
+        test_rate_limiter = MockRateLimiter()
+        binder.bind(RateLimiter, to=test_rate_limiter, scope=singleton)
+
+        test_attachment_store = MockAttachmentStore()
+        binder.bind(AttachmentStore, to=test_attachment_store, scope=singleton)
+
+        test_attachment_fetcher = HttpAttachmentFetcher(allowed_hosts=['files.test.com'])
+        binder.bind(AttachmentFetcher, to=test_attachment_fetcher, scope=singleton)
+
+        test_worker_registry = MockWorkerRegistry()
+        binder.bind(WorkerRegistry, to=test_worker_registry, scope=singleton)
+
         test_access_token_service = MockAccessTokenService()
         binder.bind(AbstractAccessTokenService, to=test_access_token_service, scope=singleton)
 
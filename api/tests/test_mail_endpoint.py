@@ -1,16 +1,19 @@
 import json
 import random
 import string
+import time
 
 from django.apps import apps
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from injector import Injector
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from .test_ioc import TestApiAppModule
-from ..models import Client
+from ..models import Client, Mail, MailBody
 from ..models import MailTemplate
+from ..services import AttachmentStore
 
 
 class EmailEndpointsTests(APITestCase):
@@ -138,6 +141,124 @@ class EmailEndpointsTests(APITestCase):
         json_response = json.loads(response.content)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_send_scheduled(self):
+        url = reverse('mail-endpoints:list-send')
+        send_at = int(time.time()) + 3600
+
+        data = {
+            'payload': {
+                'title': 'this is the title',
+                'content': 'this is the content',
+            },
+            'to_email': 'smarcet@gmail.com',
+            'template': self.child.identifier,
+            'send_at': send_at,
+        }
+
+        response = self.client.post('{url}?access_token={access_token}'.format(url=url, access_token=self.access_token),
+                                    data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        mail = Mail.objects.get()
+        self.assertEqual(int(mail.due_at.timestamp()), send_at)
+        self.assertEqual(mail.send_at, mail.due_at)
+
+    def test_send_with_ttl(self):
+        url = reverse('mail-endpoints:list-send')
+        self.child.ttl = 600
+        self.child.save()
+
+        data = {
+            'payload': {
+                'title': 'this is the title',
+                'content': 'this is the content',
+            },
+            'to_email': 'smarcet@gmail.com',
+            'template': self.child.identifier,
+            'ttl': 60,
+        }
+
+        response = self.client.post('{url}?access_token={access_token}'.format(url=url, access_token=self.access_token),
+                                    data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # the mail ttl overrides the template one
+        mail = Mail.objects.get()
+        self.assertEqual((mail.expires_at - mail.due_at).total_seconds(), 60)
+
+    def test_send_stores_attachments_once(self):
+        url = reverse('mail-endpoints:list-send')
+        store = apps.app_configs['django_injector'].injector.get(AttachmentStore)
+
+        for to_email in ['smarcet@gmail.com', 'test@test.com']:
+            data = {
+                'payload': {
+                    'title': 'this is the title',
+                    'content': 'this is the content',
+                    'attachments': [{'name': 'test.txt', 'content': 'dGVzdA==', 'type': 'text/plain'}],
+                },
+                'to_email': to_email,
+                'template': self.child.identifier,
+            }
+            response = self.client.post('{url}?access_token={access_token}'.format(url=url,
+                                                                                   access_token=self.access_token),
+                                        data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # only the key of the content is kept on the payload
+        self.assertEqual(len(store.blobs), 1)
+        for mail in Mail.objects.all():
+            attachments = mail.payload['attachments']
+            self.assertEqual(attachments, [{'name': 'test.txt', 'type': 'text/plain', 'size': 4,
+                                            'blob': AttachmentStore.key(b'test')}])
+
+    def test_send_invalid_attachment(self):
+        url = reverse('mail-endpoints:list-send')
+        data = {
+            'payload': {
+                'attachments': [{'name': 'test.txt', 'content': 'not base64!', 'type': 'text/plain'}],
+            },
+            'to_email': 'smarcet@gmail.com',
+            'template': self.child.identifier,
+        }
+        response = self.client.post('{url}?access_token={access_token}'.format(url=url, access_token=self.access_token),
+                                    data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Mail.objects.count(), 0)
+
+    def test_send_attachments_by_reference(self):
+        upload_url = reverse('mail-endpoints:upload-attachment')
+        url = reverse('mail-endpoints:list-send')
+
+        response = self.client.post('{url}?access_token={access_token}'.format(url=upload_url,
+                                                                               access_token=self.access_token),
+                                    {'file': SimpleUploadedFile('test.txt', b'test')}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'blob': AttachmentStore.key(b'test'), 'size': 4})
+
+        attachments = [
+            {'name': 'test.txt', 'blob': response.data['blob'], 'type': 'text/plain'},
+            {'name': 'ticket.pdf', 'url': 'https://files.test.com/ticket.pdf', 'type': 'application/pdf'},
+        ]
+        data = {
+            'payload': {'title': 'this is the title', 'content': 'this is the content', 'attachments': attachments},
+            'to_email': 'smarcet@gmail.com',
+            'template': self.child.identifier,
+        }
+        response = self.client.post('{url}?access_token={access_token}'.format(url=url, access_token=self.access_token),
+                                    data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Mail.objects.get().payload['attachments'], attachments)
+
+        for attachment in [{'name': 'test.txt', 'blob': AttachmentStore.key(b'missing'), 'type': 'text/plain'},
+                           {'name': 'test.txt', 'url': 'file:///etc/passwd', 'type': 'text/plain'}]:
+            data['payload']['attachments'] = [attachment]
+            response = self.client.post('{url}?access_token={access_token}'.format(url=url,
+                                                                                   access_token=self.access_token),
+                                        data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Mail.objects.count(), 1)
+
     def test_list(self):
         url = reverse('mail-endpoints:list-send')
 
@@ -160,3 +281,32 @@ class EmailEndpointsTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+
+    def test_list_body_only_when_expanded(self):
+        url = reverse('mail-endpoints:list-send')
+
+        data = {
+            'payload': {
+                'title': 'this is the title',
+                'content': 'this is the content',
+            },
+            'to_email': 'smarcet@gmail.com',
+            'template': self.child.identifier,
+        }
+
+        response = self.client.post('{url}?access_token={access_token}'.format(url=url, access_token=self.access_token),
+                                    data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(MailBody.objects.get().payload['title'], 'this is the title')
+
+        response = self.client.get('{url}?access_token={access_token}'.format(url=url, access_token=self.access_token))
+        json_response = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('html_content', json_response['data'][0])
+
+        response = self.client.get('{url}?access_token={access_token}&expand=body'.format(url=url,
+                                                                                          access_token=self.access_token))
+        json_response = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('this is the title', json_response['data'][0]['html_content'])
+        self.assertIn('this is the content', json_response['data'][0]['payload'])
@@ -0,0 +1,242 @@
+from datetime import timedelta
+
+from django.test import TransactionTestCase
+
+from api.models import MailTemplate, Client, Mail
+from api.services.mail_queue import MailQueue
+
+
+class TestMailQueue(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = Client.objects.create(client_id="OAUTH2_CLIENT_ID", name="NAME_1")
+        self.template = MailTemplate.objects.create(identifier="queue_template", from_email='test@test.com',
+                                                    subject='test', html_content='<p>test</p>', is_active=True,
+                                                    max_retries=1)
+
+    def create_mail(self, **kwargs):
+        fields = {
+            'from_email': 'test@test.com',
+            'to_email': 'to@test.com',
+            'subject': 'test',
+            'html_content': '<p>test</p>',
+            'owner': self.owner,
+            'template': self.template,
+        }
+        fields.update(kwargs)
+        return Mail.objects.create(**fields)
+
+    def test_claim_returns_disjoint_batches(self):
+        for _ in range(5):
+            self.create_mail()
+        queue = MailQueue()
+
+        first = queue.claim(3)
+        second = queue.claim(3)
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertEqual(set(first) & set(second), set())
+        self.assertEqual(queue.claim(3), [])
+        self.assertEqual(Mail.objects.filter(lock_date__isnull=True).count(), 0)
+
+    def test_claim_skips_sent_and_exhausted_mails(self):
+        pending = self.create_mail()
+        self.create_mail(retries=1)
+        sent = self.create_mail()
+        sent.mark_as_sent()
+        sent.save()
+
+        self.assertEqual(MailQueue().claim(10), [pending.id])
+
+    def test_expired_leases_are_reclaimed(self):
+        stale = self.create_mail()
+        alive = self.create_mail()
+        queue = MailQueue(owner='worker_1')
+        queue.claim(10)
+        Mail.objects.filter(pk=stale.id).update(lock_date=MailQueue.now() - timedelta(seconds=queue.lease_ttl + 1))
+
+        self.assertEqual(queue.reclaim_expired(), 1)
+        self.assertEqual(MailQueue(owner='worker_2').claim(10), [stale.id])
+        self.assertEqual(Mail.objects.get(pk=alive.id).lock_owner, 'worker_1')
+
+    def test_heartbeat_and_release_only_touch_own_leases(self):
+        mail = self.create_mail()
+        queue = MailQueue(owner='worker_1')
+        queue.claim(10)
+        old_lock_date = MailQueue.now() - timedelta(seconds=60)
+        Mail.objects.filter(pk=mail.id).update(lock_date=old_lock_date)
+
+        self.assertEqual(MailQueue(owner='worker_2').heartbeat([mail.id]), 0)
+        self.assertEqual(MailQueue(owner='worker_2').release([mail.id]), 0)
+        self.assertEqual(queue.heartbeat([mail.id]), 1)
+        self.assertGreater(Mail.objects.get(pk=mail.id).lock_date, old_lock_date)
+
+        self.assertEqual(queue.release([mail.id]), 1)
+        self.assertEqual(queue.claim(10), [mail.id])
+
+    def test_ack_is_guarded_by_lease_owner(self):
+        sent = self.create_mail()
+        failed = self.create_mail()
+        queue = MailQueue(owner='worker_1')
+        queue.claim(10)
+        # lease expired and another worker took it
+        Mail.objects.filter(pk=failed.id).update(lock_owner='worker_2')
+
+        retry = Mail(id=failed.id, retries=0)
+        retry.mark_retry('error', 1)
+        queue.ack([sent.id], [retry])
+
+        self.assertTrue(Mail.objects.get(pk=sent.id).is_sent)
+        failed = Mail.objects.get(pk=failed.id)
+        self.assertEqual(failed.retries, 0)
+        self.assertEqual(failed.lock_owner, 'worker_2')
+
+    def test_throttled_ack_keeps_the_last_error(self):
+        mail = self.create_mail(last_error='timeout')
+        queue = MailQueue(owner='worker_1')
+        queue.claim(10)
+
+        # requeued while draining, without an error of its own
+        throttled = Mail(id=mail.id, retries=0, last_error='')
+        throttled.mark_throttled('', 5)
+        queue.ack([], [], throttled=[throttled])
+
+        mail = Mail.objects.get(pk=mail.id)
+        self.assertEqual(mail.status, Mail.STATUS_PENDING)
+        self.assertEqual(mail.last_error, 'timeout')
+        self.assertIsNotNone(mail.next_retry_date)
+
+    def test_snapshot(self):
+        mail = self.create_mail(cc_email='cc@test.com')
+        snapshot = MailQueue().snapshot(mail.id)
+
+        self.assertEqual(snapshot.id, mail.id)
+        self.assertEqual(snapshot.cc_email, 'cc@test.com')
+        self.assertEqual(snapshot.max_retries, self.template.max_retries)
+
+    def test_claim_own_shard_first(self):
+        mails = [self.create_mail() for _ in range(6)]
+        queue = MailQueue()
+        even = [m.id for m in mails if m.id % 2 == 0]
+        odd = [m.id for m in mails if m.id % 2 == 1]
+
+        self.assertEqual(queue.claim(3, (1, 2)), odd)
+        # shard drained, the rest of the queue is claimed
+        self.assertEqual(queue.claim(10, (1, 2)), even)
+
+    def test_claim_serves_higher_lanes_first(self):
+        bulk = [self.create_mail(priority=MailTemplate.PRIORITY_BULK) for _ in range(10)]
+        transactional = [self.create_mail(priority=MailTemplate.PRIORITY_TRANSACTIONAL) for _ in range(2)]
+
+        ids = MailQueue().claim(3)
+
+        # enqueued later but claimed ( and sent ) first
+        self.assertEqual(ids, [m.id for m in transactional] + [bulk[0].id])
+
+    def test_claim_lower_lanes_are_not_starved(self):
+        for _ in range(20):
+            self.create_mail(priority=MailTemplate.PRIORITY_TRANSACTIONAL)
+        bulk = [self.create_mail(priority=MailTemplate.PRIORITY_BULK) for _ in range(20)]
+        queue = MailQueue()
+        queue.lanes = [(MailTemplate.PRIORITY_TRANSACTIONAL, 6), (MailTemplate.PRIORITY_NORMAL, 3),
+                       (MailTemplate.PRIORITY_BULK, 1)]
+
+        ids = queue.claim(10)
+
+        # normal lane is empty, its share goes to the transactional one
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(len([i for i in ids if i in [m.id for m in bulk]]), 1)
+
+    def test_claim_is_fair_between_clients(self):
+        noisy = [self.create_mail() for _ in range(20)]
+        other = Client.objects.create(client_id="OAUTH2_CLIENT_ID_2", name="NAME_2")
+        quiet = [self.create_mail(owner=other) for _ in range(2)]
+        queue = MailQueue()
+
+        ids = queue.claim(4)
+
+        # enqueued after the backlog of the noisy client but not behind it
+        self.assertEqual(len(ids), 4)
+        self.assertTrue(set(m.id for m in quiet) <= set(ids))
+        self.assertEqual(len([i for i in ids if i in [m.id for m in noisy]]), 2)
+
+    def test_claim_fair_round_robin_carries_over(self):
+        first = [self.create_mail() for _ in range(5)]
+        other = Client.objects.create(client_id="OAUTH2_CLIENT_ID_2", name="NAME_2")
+        second = [self.create_mail(owner=other) for _ in range(5)]
+        queue = MailQueue()
+        queue.fair_quantum = 1
+
+        # one mail per client per round, next claim starts after the last client served
+        self.assertEqual(queue.claim(1), [first[0].id])
+        self.assertEqual(queue.claim(1), [second[0].id])
+        self.assertEqual(queue.claim(3), [first[1].id, second[1].id, first[2].id])
+
+    def test_scheduled_mails_are_claimed_once_due(self):
+        now = MailQueue.now()
+        due = self.create_mail(send_at=now - timedelta(seconds=1), due_at=now - timedelta(seconds=1))
+        scheduled = self.create_mail(send_at=now + timedelta(hours=1), due_at=now + timedelta(hours=1))
+        queue = MailQueue()
+
+        self.assertEqual(queue.claim(10), [due.id])
+        self.assertAlmostEqual(queue.next_due(now), 3600, delta=1)
+
+        Mail.objects.filter(pk=scheduled.id).update(due_at=now)
+        self.assertEqual(queue.claim(10), [scheduled.id])
+        self.assertIsNone(queue.next_due(now))
+
+    def test_claim_follows_the_due_date(self):
+        now = MailQueue.now()
+        later = self.create_mail(due_at=now - timedelta(seconds=10))
+        sooner = self.create_mail(due_at=now - timedelta(minutes=10))
+
+        # a mail requeued ( retry, throttle ) is claimed by due date, not by creation order
+        self.assertEqual(MailQueue().claim(1), [sooner.id])
+        self.assertEqual(MailQueue().claim(1), [later.id])
+
+    def test_claim_spill_over_goes_lane_by_lane(self):
+        now = MailQueue.now()
+        bulk = self.create_mail(priority=MailTemplate.PRIORITY_BULK, due_at=now - timedelta(hours=1))
+        later = self.create_mail(due_at=now - timedelta(seconds=10))
+        sooner = self.create_mail(due_at=now - timedelta(minutes=10))
+        transactional = self.create_mail(priority=MailTemplate.PRIORITY_TRANSACTIONAL)
+        queue = MailQueue()
+        # only the transactional lane has a share, the rest of the batch spills over the other lanes
+        queue.lanes = [(MailTemplate.PRIORITY_TRANSACTIONAL, 1)]
+
+        self.assertEqual(queue.claim(1), [transactional.id])
+        self.assertEqual(queue.claim(3), [sooner.id, later.id, bulk.id])
+
+    def test_expired_mails_are_dropped(self):
+        now = MailQueue.now()
+        expired = [self.create_mail(expires_at=now - timedelta(seconds=1)) for _ in range(3)]
+        alive = self.create_mail(expires_at=now + timedelta(minutes=5))
+        queue = MailQueue()
+        queue.expire_chunk = 2
+
+        self.assertEqual(queue.drop_expired(), 3)
+        self.assertEqual(queue.claim(10), [alive.id])
+        self.assertTrue(all(Mail.objects.get(pk=m.id).is_expired for m in expired))
+        self.assertEqual(queue.drop_expired(), 0)
+
+    def test_status_follows_the_delivery_state(self):
+        sent = self.create_mail()
+        failed = self.create_mail()
+        released = self.create_mail()
+        queue = MailQueue(owner='worker_1')
+        queue.claim(10)
+        self.assertEqual(Mail.objects.filter(status=Mail.STATUS_LOCKED).count(), 3)
+        # denormalised from the template
+        self.assertEqual(Mail.objects.get(pk=failed.id).max_retries, self.template.max_retries)
+
+        retry = Mail(id=failed.id, retries=0)
+        retry.mark_retry('error', 1)
+        queue.ack([sent.id], [retry])
+        queue.release([released.id])
+
+        self.assertEqual(Mail.objects.get(pk=sent.id).status, Mail.STATUS_SENT)
+        # out of retries
+        self.assertEqual(Mail.objects.get(pk=failed.id).status, Mail.STATUS_FAILED)
+        self.assertEqual(Mail.objects.get(pk=released.id).status, Mail.STATUS_PENDING)
+        self.assertEqual(queue.claim(10), [released.id])
@@ -0,0 +1,119 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.test import TransactionTestCase
+
+from api.models import ArchivedMail, AttachmentBlob, Client, Mail, MailBody, MailTemplate
+from api.models.mail import utc_now
+from api.services.mail_retention import MailRetention
+from api.services.ndjson_mail_archive import NdjsonMailArchive
+from api.services.table_mail_archive import TableMailArchive
+from api.tests.test_ioc import MockAttachmentStore
+
+
+class TestMailRetention(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = Client.objects.create(client_id="OAUTH2_CLIENT_ID", name="NAME_1")
+        self.template = MailTemplate.objects.create(identifier="retention_template", from_email='test@test.com',
+                                                    subject='test', html_content='<p>test</p>', is_active=True)
+        old = utc_now() - timedelta(days=60)
+        self.sent = [self.create_mail(status=Mail.STATUS_SENT, sent_date=old, due_at=old) for _ in range(3)]
+        self.failed = self.create_mail(status=Mail.STATUS_FAILED, due_at=old)
+        # still on the queue, or too recent
+        self.pending = self.create_mail(due_at=old)
+        self.recent = self.create_mail(status=Mail.STATUS_SENT, sent_date=utc_now())
+
+    def create_mail(self, **kwargs) -> Mail:
+        fields = {
+            'from_email': 'test@test.com',
+            'to_email': 'to@test.com',
+            'subject': 'test',
+            'html_content': '<p>test</p>',
+            'payload': {'name': 'test'},
+            'owner': self.owner,
+            'template': self.template,
+        }
+        fields.update(kwargs)
+        return Mail.objects.create(**fields)
+
+    def retention(self, archive, mode=MailRetention.ARCHIVE, attachment_store=None) -> MailRetention:
+        retention = MailRetention(archive, attachment_store)
+        retention.mode = mode
+        retention.chunk = 2
+        retention.sleep = 0
+        return retention
+
+    def test_archive_to_table(self):
+        self.assertEqual(self.retention(TableMailArchive()).run(), 4)
+
+        self.assertEqual(set(Mail.objects.values_list('id', flat=True)), {self.pending.id, self.recent.id})
+        self.assertEqual(MailBody.objects.count(), 2)
+        archived = ArchivedMail.objects.get(pk=self.failed.id)
+        self.assertEqual(archived.status, Mail.STATUS_FAILED)
+        self.assertEqual(archived.owner_id, self.owner.id)
+        self.assertEqual(archived.payload, {'name': 'test'})
+        self.assertEqual(archived.html_content, '<p>test</p>')
+
+    def test_archive_to_ndjson(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        now = utc_now()
+
+        self.assertEqual(self.retention(NdjsonMailArchive(archive_dir.name)).run(now), 4)
+
+        files = os.listdir(archive_dir.name)
+        self.assertEqual(files, ['mails-{day}.ndjson.gz'.format(day=now.strftime('%Y%m%d'))])
+        # one gzip member per chunk
+        with gzip.open(os.path.join(archive_dir.name, files[0]), 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row['id'] for row in rows), sorted([m.id for m in self.sent] + [self.failed.id]))
+        self.assertEqual(rows[0]['payload'], {'name': 'test'})
+        self.assertEqual(Mail.objects.count(), 2)
+
+    def test_purge_bodies_keeps_headers(self):
+        self.assertEqual(self.retention(TableMailArchive(), MailRetention.PURGE_BODIES).run(), 4)
+
+        self.assertEqual(Mail.objects.count(), 6)
+        self.assertEqual(ArchivedMail.objects.count(), 0)
+        self.assertEqual(set(MailBody.objects.values_list('mail_id', flat=True)), {self.pending.id, self.recent.id})
+
+    def store_blobs(self, store: MockAttachmentStore, mail: Mail, *contents) -> list:
+        keys = [store.put(content) for content in contents]
+        AttachmentBlob.reference(keys)
+        body = MailBody.objects.get(mail=mail)
+        body.payload = {'name': 'test', 'attachments': [{'name': 'test.txt', 'type': 'text/plain', 'blob': key}
+                                                        for key in keys]}
+        body.save()
+        return keys
+
+    def collect_blobs(self, mode):
+        store = MockAttachmentStore()
+        # only referenced by mails leaving the retention window
+        old, = self.store_blobs(store, self.sent[0], b'old')
+        self.store_blobs(store, self.sent[1], b'old')
+        shared, = self.store_blobs(store, self.failed, b'shared')
+        self.store_blobs(store, self.pending, b'shared')
+        recent, = self.store_blobs(store, self.recent, b'recent')
+        # an upload not sent yet, and one nobody used
+        uploaded = store.put(b'uploaded')
+        AttachmentBlob.reference([uploaded], count=False)
+        stale = store.put(b'stale')
+        AttachmentBlob.reference([stale], count=False)
+        AttachmentBlob.objects.filter(key__in=[old, shared, recent, stale]) \
+            .update(last_referenced=utc_now() - timedelta(days=60))
+
+        self.assertEqual(self.retention(TableMailArchive(), mode, store).run(), 4)
+
+        self.assertEqual(set(store.blobs), {shared, recent, uploaded})
+        self.assertEqual(set(AttachmentBlob.objects.values_list('key', 'references')),
+                         {(shared, 1), (recent, 1), (uploaded, 0)})
+
+    def test_archive_collects_unreferenced_blobs(self):
+        self.collect_blobs(MailRetention.ARCHIVE)
+
+    def test_purge_bodies_collects_unreferenced_blobs(self):
+        self.collect_blobs(MailRetention.PURGE_BODIES)
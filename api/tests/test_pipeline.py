@@ -0,0 +1,57 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from api.utils import Pipeline
+
+
+class TestPipeline(SimpleTestCase):
+
+    def test_items_flow_through_all_stages(self):
+        results = []
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add_stage('double', lambda x: x * 2, workers=3)
+        pipeline.add_stage('inc', lambda x: x + 1, workers=2)
+        pipeline.add_stage('collect', results.append, workers=1)
+        pipeline.run(range(50))
+
+        self.assertEqual(sorted(results), [x * 2 + 1 for x in range(50)])
+
+    def test_errors_are_isolated_per_item(self):
+        results = []
+
+        def fail_on_odd(x):
+            if x % 2:
+                raise Exception('odd item {x}'.format(x=x))
+            return x
+
+        pipeline = Pipeline()
+        pipeline.add_stage('check', fail_on_odd, workers=2)
+        pipeline.add_stage('collect', results.append)
+        pipeline.run(range(10))
+
+        self.assertEqual(sorted(results), [0, 2, 4, 6, 8])
+
+    def test_stage_workers_run_concurrently(self):
+        lock = threading.Lock()
+        state = {'current': 0, 'max': 0}
+
+        def slow(x):
+            with lock:
+                state['current'] += 1
+                state['max'] = max(state['max'], state['current'])
+            time.sleep(0.05)
+            with lock:
+                state['current'] -= 1
+            return x
+
+        pipeline = Pipeline(queue_size=10)
+        pipeline.add_stage('slow', slow, workers=5)
+        start = time.monotonic()
+        pipeline.run(range(20))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(state['max'], 5)
+        # 20 items * 50ms sequentially would take 1s
+        self.assertLess(elapsed, 0.6)
@@ -0,0 +1,39 @@
+import socket
+
+from django.test import SimpleTestCase
+
+from api.utils import RetryPolicy
+
+
+class TestRetryPolicy(SimpleTestCase):
+
+    def test_classify(self):
+        self.assertEqual(RetryPolicy.classify(400), RetryPolicy.PERMANENT)
+        self.assertEqual(RetryPolicy.classify(413), RetryPolicy.PERMANENT)
+        self.assertEqual(RetryPolicy.classify(401), RetryPolicy.TRANSIENT)
+        self.assertEqual(RetryPolicy.classify(408), RetryPolicy.TIMEOUT)
+        self.assertEqual(RetryPolicy.classify(429), RetryPolicy.RATE_LIMITED)
+        self.assertEqual(RetryPolicy.classify(503), RetryPolicy.TRANSIENT)
+        self.assertEqual(RetryPolicy.classify(error=socket.timeout()), RetryPolicy.TIMEOUT)
+        self.assertEqual(RetryPolicy.classify(error=Exception()), RetryPolicy.TRANSIENT)
+
+    def test_permanent_errors_are_not_retried(self):
+        self.assertIsNone(RetryPolicy().delay(RetryPolicy.PERMANENT, 0))
+
+    def test_exponential_backoff_with_jitter_and_cap(self):
+        policy = RetryPolicy({'transient': {'base': 10, 'factor': 2, 'cap': 100}})
+        for retries, expected in [(0, 10), (1, 20), (3, 80), (10, 100)]:
+            delays = [policy.delay(RetryPolicy.TRANSIENT, retries) for _ in range(50)]
+            self.assertTrue(all(expected / 2 <= d <= expected for d in delays))
+            self.assertGreater(len(set(delays)), 1)
+
+    def test_overrides(self):
+        policy = RetryPolicy({'permanent': {'base': 60}, 'timeout': None})
+        self.assertIsNone(policy.delay(RetryPolicy.TIMEOUT, 0))
+        self.assertLessEqual(policy.delay(RetryPolicy.PERMANENT, 0), 60)
+
+    def test_validate(self):
+        for policy in [[], {'unknown': None}, {'transient': {'base': -1}}, {'transient': {'other': 1}},
+                       {'transient': 10}]:
+            with self.assertRaises(ValueError):
+                RetryPolicy.validate(policy)
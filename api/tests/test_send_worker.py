@@ -0,0 +1,128 @@
+import os
+import signal
+import time
+from io import StringIO
+
+from django.apps import apps
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from injector import Injector, Module, singleton
+
+from api.services import EmailService, MailNotifier, WorkerRegistry
+from .test_ioc import MockMailNotifier, MockWorkerRegistry
+
+
+class StoppingEmailService(EmailService):
+
+    def __init__(self):
+        self.batches = []
+        self.stopped = False
+
+    def process_pending_emails(self, batch: int, concurrency: int = None, shard: tuple = None) -> int:
+        self.batches.append((batch, concurrency, shard))
+        if len(self.batches) == 3:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return batch if len(self.batches) == 1 else 0
+
+    def stop(self):
+        self.stopped = True
+
+
+class WakingMailNotifier(MailNotifier):
+
+    def __init__(self):
+        self.waits = []
+
+    def notify(self):
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        self.waits.append(timeout)
+        return True
+
+    def is_available(self) -> bool:
+        return True
+
+
+class TestSendWorker(SimpleTestCase):
+
+    def bind(self, notifier: MailNotifier):
+        service = self.service
+        registry = self.registry
+
+        class WorkerModule(Module):
+            def configure(self, binder):
+                binder.bind(EmailService, to=service, scope=singleton)
+                binder.bind(MailNotifier, to=notifier, scope=singleton)
+                binder.bind(WorkerRegistry, to=registry, scope=singleton)
+
+        apps.app_configs['django_injector'].injector = Injector([WorkerModule()])
+
+    def setUp(self):
+        self.service = StoppingEmailService()
+        self.registry = MockWorkerRegistry()
+        self.handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.handlers[0])
+        signal.signal(signal.SIGINT, self.handlers[1])
+
+    def test_worker_polls_until_sigterm(self):
+        self.bind(MockMailNotifier())
+        call_command('send_worker', batch=10, concurrency=4, min_sleep=0, max_sleep=0.01)
+
+        # single worker registered, owns the whole queue
+        self.assertEqual(self.service.batches, [(10, 4, (0, 1)), (10, 4, (0, 1)), (10, 4, (0, 1))])
+        self.assertTrue(self.service.stopped)
+        self.assertEqual(self.registry.members(), [])
+
+    def test_idle_worker_waits_for_notifications(self):
+        notifier = WakingMailNotifier()
+        self.bind(notifier)
+        call_command('send_worker', batch=10, min_sleep=0, max_sleep=0.01)
+
+        self.assertEqual(len(self.service.batches), 3)
+        # only the empty poll blocks on the notifier, woken up on its first slice
+        self.assertEqual(notifier.waits, [1])
+
+
+class ForkedEmailService(EmailService):
+
+    def __init__(self):
+        self.polls = 0
+
+    def process_pending_emails(self, batch: int, concurrency: int = None, shard: tuple = None) -> int:
+        self.polls += 1
+        if self.polls == 2:
+            # enough work done, ask the parent to stop all the workers
+            os.kill(os.getppid(), signal.SIGTERM)
+        time.sleep(0.01)
+        return 5
+
+
+class TestSendWorkerProcesses(SimpleTestCase):
+
+    def setUp(self):
+        service = ForkedEmailService()
+
+        class WorkerModule(Module):
+            def configure(self, binder):
+                binder.bind(EmailService, to=service, scope=singleton)
+                binder.bind(MailNotifier, to=MockMailNotifier(), scope=singleton)
+                binder.bind(WorkerRegistry, to=MockWorkerRegistry(), scope=singleton)
+
+        apps.app_configs['django_injector'].injector = Injector([WorkerModule()])
+        self.handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.handlers[0])
+        signal.signal(signal.SIGINT, self.handlers[1])
+
+    def test_children_counts_are_aggregated(self):
+        out = StringIO()
+        call_command('send_worker', batch=10, processes=2, min_sleep=0, max_sleep=0.01, stdout=out)
+
+        total = int(out.getvalue().split()[1])
+        # at least the two polls of the child that stopped the parent
+        self.assertGreaterEqual(total, 10)
+        self.assertEqual(total % 5, 0)
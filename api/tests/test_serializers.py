@@ -1,5 +1,9 @@
+import os
+import time
+from unittest import mock
+
 from django.test import TestCase
-from api.serializers import MailTemplateWriteSerializer
+from api.serializers import MailTemplateWriteSerializer, TimestampField
 from api.models import MailTemplate
 
 
@@ -44,4 +48,15 @@ class TestSerializers(TestCase):
         self.assertTrue(template is not None)
         self.assertEqual(template.identifier, 'identifier_1')
         self.assertEqual(template.subject, 'test subject')
-        self.assertEqual(template.from_email, 'test@test.com')
\ No newline at end of file
+        self.assertEqual(template.from_email, 'test@test.com')
+
+    def test_timestamp_round_trip(self):
+        # on a non UTC host
+        with mock.patch.dict(os.environ, {'TZ': 'America/Argentina/Buenos_Aires'}):
+            time.tzset()
+            self.addCleanup(time.tzset)
+            field = TimestampField()
+            epoch = 1700000000
+            value = field.to_internal_value(epoch)
+            self.assertEqual(value.timestamp(), epoch)
+            self.assertEqual(field.to_representation(value), epoch)
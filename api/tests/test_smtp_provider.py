@@ -0,0 +1,114 @@
+import base64
+import email
+import threading
+import unittest
+import warnings
+
+from django.test import SimpleTestCase, override_settings
+
+from api.services.smtp_provider import SmtpProvider
+from .test_delivery_providers import snapshot
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import asyncore
+        import smtpd
+except ImportError:
+    smtpd = None
+
+
+class LocalSmtpServer:
+    """
+    smtpd stand in, collects the received messages and counts the connections.
+    """
+
+    def __init__(self):
+        messages = self.messages = []
+        self.connections = 0
+        owner = self
+
+        class Server(smtpd.SMTPServer):
+
+            def handle_accepted(self, conn, addr):
+                owner.connections += 1
+                super().handle_accepted(conn, addr)
+
+            def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+                if 'rejected@test.com' in rcpttos:
+                    return '554 rejected'
+                messages.append((mailfrom, rcpttos, email.message_from_bytes(data)))
+
+        self.server = Server(('127.0.0.1', 0), None, decode_data=False)
+        self.port = self.server.socket.getsockname()[1]
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            asyncore.loop(timeout=0.05, count=1)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.server.close()
+        asyncore.close_all()
+
+
+@unittest.skipIf(smtpd is None, 'smtpd is not available')
+@override_settings(DEBUG=False)
+class TestSmtpProvider(SimpleTestCase):
+
+    def setUp(self):
+        self.smtp = LocalSmtpServer().start()
+        self.addCleanup(self.smtp.stop)
+        with self.settings(SEND_EMAILS_SMTP_HOST='127.0.0.1', SEND_EMAILS_SMTP_PORT=self.smtp.port,
+                           SEND_EMAILS_SMTP_MAX_MESSAGES=3, SEND_EMAILS_SMTP_TIMEOUT=5):
+            self.provider = SmtpProvider()
+        self.addCleanup(self.provider.close)
+
+    def test_builds_mime_from_mail_fields_and_attachments(self):
+        payload = {'attachments': [
+            {'name': 'qr.png', 'content': base64.b64encode(b'png').decode('ascii'), 'type': 'image/png',
+             'disposition': 'inline', 'content_id': 'qrcid'},
+            {'name': 'ticket.pdf', 'content': base64.b64encode(b'pdf').decode('ascii'), 'type': 'application/pdf'},
+        ]}
+        message = self.provider.build([snapshot(1, 'a@test.com,b@test.com', cc_email='c@test.com',
+                                                bcc_email='d@test.com', plain_content='test', payload=payload)])
+
+        response = self.provider.send(message)
+
+        self.assertEqual(response.status_code, 202)
+        mailfrom, rcpttos, received = self.smtp.messages[0]
+        self.assertEqual(mailfrom, 'test@test.com')
+        self.assertEqual(rcpttos, ['a@test.com', 'b@test.com', 'c@test.com', 'd@test.com'])
+        self.assertEqual(received['To'], 'a@test.com, b@test.com')
+        self.assertEqual(received['Cc'], 'c@test.com')
+        self.assertIsNone(received['Bcc'])
+        parts = {part.get_content_type(): part for part in received.walk()}
+        self.assertIn('text/plain', parts)
+        self.assertIn('text/html', parts)
+        self.assertEqual(parts['image/png']['Content-ID'], '<qrcid>')
+        self.assertEqual(parts['application/pdf'].get_filename(), 'ticket.pdf')
+        self.assertEqual(parts['application/pdf'].get_payload(decode=True), b'pdf')
+
+    def test_connections_are_reused(self):
+        for i in range(6):
+            self.assertEqual(self.provider.send(self.provider.build([snapshot(i)])).status_code, 202)
+
+        self.assertEqual(len(self.smtp.messages), 6)
+        # SEND_EMAILS_SMTP_MAX_MESSAGES = 3 per connection
+        self.assertEqual(self.provider.connections, 2)
+
+    def test_permanent_rejection(self):
+        response = self.provider.send(self.provider.build([snapshot(1, 'rejected@test.com')]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('554', response.body)
+        # the connection is still usable
+        self.assertEqual(self.provider.send(self.provider.build([snapshot(2)])).status_code, 202)
+        self.assertEqual(self.provider.connections, 1)
@@ -2,7 +2,7 @@ from django.urls import path, include
 from .views import ClientRetrieveUpdateDestroyAPIView, ClientListCreateAPIView, \
     MailTemplateListCreateAPIView, MailTemplateRetrieveUpdateDestroyAPIView, \
     RenderMailTemplateAPIView, MailTemplateAllowedClientsAPIView, \
-    MailListCreateAPIView
+    MailListCreateAPIView, AttachmentCreateAPIView
 
 client_patterns = ([
     path('', ClientListCreateAPIView.as_view(), name='list-create'),
@@ -18,6 +18,7 @@ mail_template_patterns = ([
 
 mail_patterns = ([
     path('', MailListCreateAPIView.as_view(), name='list-send'),
+    path('/attachments', AttachmentCreateAPIView.as_view(), name='upload-attachment'),
 ], 'mail-endpoints')
 
 private_urlpatterns = [
@@ -4,3 +4,8 @@ from .render import Render
 from .jinja_render import JinjaRender
 from .empty_str import is_empty
 from .file_lock import FileLock
+from .pipeline import Pipeline
+from .distributed_lock import DistributedLock
+from .circuit_breaker import CircuitBreaker
+from .retry_policy import RetryPolicy
+from .fake_sendgrid_server import FakeSendGridServer
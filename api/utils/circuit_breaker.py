@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """
+    Guards the calls to an external provider.
+    closed: calls go through while the error rate of the last `window` calls stays under `error_rate`.
+    open: calls are rejected for `open_timeout` seconds.
+    half open: trial calls are let through ( callers should send a single probe ), a success closes
+    the circuit and a failure opens it again.
+    After closing, capacity() ramps from `min_capacity` to 1 along `ramp_period` seconds ( slow start ),
+    so the backlog does not hit the recovered provider all at once.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, error_rate: float = 0.5, window: int = 20, min_calls: int = 10,
+                 open_timeout: float = 30, ramp_period: float = 60, min_capacity: float = 0.1,
+                 clock=time.monotonic):
+        self.name = name
+        self.error_rate = float(error_rate)
+        self.min_calls = max(1, int(min_calls))
+        self.open_timeout = float(open_timeout)
+        self.ramp_period = float(ramp_period)
+        self.min_capacity = float(min_capacity)
+        self.clock = clock
+        self.calls = deque(maxlen=max(self.min_calls, int(window)))
+        self.lock = threading.Lock()
+        self._state = CircuitBreaker.CLOSED
+        self.opened_at = None
+        self.ramp_start = None
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == CircuitBreaker.OPEN and self.clock() - self.opened_at >= self.open_timeout:
+            self._transition(CircuitBreaker.HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str):
+        logging.getLogger('jobs').warning('CircuitBreaker {name} {old} -> {new}'.format(name=self.name,
+                                                                                       old=self._state, new=state))
+        self._state = state
+        if state == CircuitBreaker.OPEN:
+            self.opened_at = self.clock()
+            self.ramp_start = None
+        elif state == CircuitBreaker.CLOSED:
+            self.calls.clear()
+            self.ramp_start = self.clock() if self.ramp_period > 0 else None
+
+    def allow(self) -> bool:
+        with self.lock:
+            return self._current_state() != CircuitBreaker.OPEN
+
+    def record(self, success: bool):
+        with self.lock:
+            state = self._current_state()
+            if state == CircuitBreaker.HALF_OPEN:
+                self._transition(CircuitBreaker.CLOSED if success else CircuitBreaker.OPEN)
+                return
+            if state == CircuitBreaker.OPEN:
+                return
+            self.calls.append(success)
+            failures = self.calls.count(False)
+            if len(self.calls) >= self.min_calls and failures / len(self.calls) >= self.error_rate:
+                self._transition(CircuitBreaker.OPEN)
+
+    def capacity(self) -> float:
+        """
+        :return: fraction ( 0 to 1 ) of the normal throughput callers should use right now
+        """
+        with self.lock:
+            state = self._current_state()
+            if state == CircuitBreaker.OPEN:
+                return 0
+            if state == CircuitBreaker.HALF_OPEN:
+                return self.min_capacity
+            if self.ramp_start is None:
+                return 1
+            ramp = (self.clock() - self.ramp_start) / self.ramp_period
+            if ramp >= 1:
+                self.ramp_start = None
+                return 1
+            return max(self.min_capacity, ramp)
+
+    def retry_in(self) -> float:
+        """
+        :return: seconds until the circuit lets calls through again
+        """
+        with self.lock:
+            if self._current_state() != CircuitBreaker.OPEN:
+                return 0
+            return max(0, self.open_timeout - (self.clock() - self.opened_at))
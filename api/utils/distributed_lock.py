@@ -0,0 +1,65 @@
+import logging
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .config import config
+
+
+class DistributedLock:
+    """
+    Same contract as FileLock but backed by the redis instance configured on CACHES,
+    so it serializes runs across all the hosts / containers and not only on a single one.
+    The lock auto expires after DISTRIBUTED_LOCK_TIMEOUT seconds, so a dead holder
+    does not block the next runs forever. If redis is down the run goes ahead unlocked,
+    so the jobs must be safe to run concurrently.
+    """
+
+    class LockFailedException(Exception):
+        pass
+
+    def __init__(self, cron_class, silent, *args, **kwargs):
+        self.job_name = cron_class.code
+        self.job_code = cron_class.code
+        self.parallel = getattr(cron_class, 'ALLOW_PARALLEL_RUNS', False)
+        self.silent = silent
+        self.timeout = int(kwargs.get('timeout', config('DISTRIBUTED_LOCK_TIMEOUT', 600)))
+        self.redis_lock = None
+
+    def get_lock_name(self):
+        return 'mailing_api:locks:{name}'.format(name=self.job_name)
+
+    def lock(self) -> bool:
+        try:
+            self.redis_lock = get_redis_connection('default').lock(self.get_lock_name(), timeout=self.timeout,
+                                                                   blocking_timeout=0)
+            return self.redis_lock.acquire(blocking=False)
+        except RedisError as e:
+            self.redis_lock = None
+            logging.getLogger('jobs').warning('DistributedLock.lock {name} running without lock {error}'.format(
+                name=self.job_name, error=e))
+            return True
+
+    def release(self):
+        if self.redis_lock is None:
+            return
+        try:
+            self.redis_lock.release()
+        except Exception as e:
+            # already expired and maybe taken by another run
+            logging.getLogger('jobs').warning('DistributedLock.release {name} {error}'.format(name=self.job_name,
+                                                                                              error=e))
+
+    def lock_failed_message(self):
+        return "%s: lock found. Will try later." % self.job_name
+
+    def __enter__(self):
+        if self.parallel:
+            return
+        else:
+            if not self.lock():
+                raise self.LockFailedException(self.lock_failed_message())
+
+    def __exit__(self, type, value, traceback):
+        if not self.parallel:
+            self.release()
@@ -0,0 +1,131 @@
+import json
+import logging
+import random
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class FakeSendGridServer:
+    """
+    Local stand in for the SendGrid v3 /mail/send endpoint, to load test the dispatcher without any network.
+    Point SEND_GRID_API_HOST to it. Every request waits a random latency ( min_latency to max_latency seconds ),
+    then fails with a 5xx with probability error_rate, gets a 429 with probability throttle_rate or
+    otherwise is accepted with a 202. Responses carry the X-RateLimit-* headers of a rate_limit requests
+    per second window.
+    """
+
+    class Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            logging.getLogger('api').debug('FakeSendGridServer ' + format % args)
+
+        def reply(self, status_code: int, body: dict = None, headers: dict = None):
+            content = json.dumps(body).encode('utf-8') if body is not None else b''
+            self.send_response(status_code)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        @staticmethod
+        def errors(message: str, field: str = None) -> dict:
+            return {'errors': [{'message': message, 'field': field, 'help': None}]}
+
+        def do_POST(self):
+            fake = self.server.fake
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            except ValueError:
+                self.reply(400, self.errors('Bad Request'))
+                return
+            if self.path.rstrip('/') != '/v3/mail/send':
+                self.reply(404, self.errors('Not Found'))
+                return
+            fake.handle(self, request)
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, min_latency: float = 0, max_latency: float = 0,
+                 error_rate: float = 0, throttle_rate: float = 0, rate_limit: int = 0):
+        self.min_latency = float(min_latency)
+        self.max_latency = max(float(max_latency), self.min_latency)
+        self.error_rate = float(error_rate)
+        self.throttle_rate = float(throttle_rate)
+        self.rate_limit = int(rate_limit)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.accepted = 0
+        self.window = None
+        self.window_requests = 0
+        self.server = FakeSendGridServer.Server((host, port), FakeSendGridServer.Handler)
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://{host}:{port}'.format(host=host, port=port)
+
+    def _rate_limit(self) -> tuple:
+        """
+        :return: ( X-RateLimit-* headers, True if the current window is over the limit )
+        """
+        if self.rate_limit <= 0:
+            return {}, False
+        now = int(time.time())
+        with self.lock:
+            if self.window != now:
+                self.window = now
+                self.window_requests = 0
+            self.window_requests += 1
+            remaining = self.rate_limit - self.window_requests
+        return {'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(max(0, remaining)),
+                'X-RateLimit-Reset': str(now + 1)}, remaining < 0
+
+    def handle(self, handler, request: dict):
+        if self.max_latency > 0:
+            time.sleep(random.uniform(self.min_latency, self.max_latency))
+        with self.lock:
+            self.requests += 1
+
+        headers, over = self._rate_limit()
+        if over or random.random() < self.throttle_rate:
+            headers['X-RateLimit-Remaining'] = '0'
+            headers.setdefault('X-RateLimit-Reset', str(int(time.time()) + 1))
+            handler.reply(429, handler.errors('too many requests'), headers)
+            return
+        if random.random() < self.error_rate:
+            handler.reply(random.choice([500, 502, 503]), handler.errors('internal error'), headers)
+            return
+
+        personalizations = request.get('personalizations') or []
+        if len(personalizations) == 0 or 'from' not in request or 'subject' not in request \
+                or len(request.get('content') or []) == 0:
+            handler.reply(400, handler.errors('The personalizations, from, subject and content fields are required.'),
+                          headers)
+            return
+
+        with self.lock:
+            self.accepted += len(personalizations)
+        headers['X-Message-Id'] = uuid.uuid4().hex
+        handler.reply(202, None, headers)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-sendgrid', daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
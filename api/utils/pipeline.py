@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+import traceback
+
+from django.db import connections
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages. Every stage is served by its own
+    pool of threads and is joined to the next one by a bounded queue, so a
+    slow stage applies back pressure instead of buffering the whole batch.
+    A stage handler receives an item and returns the item for the next
+    stage ( None drops it ). Errors are isolated per item: they are logged
+    and only the failing item is dropped.
+    """
+
+    _STOP = object()
+
+    class Stage:
+
+        def __init__(self, name: str, handler, workers: int):
+            self.name = name
+            self.handler = handler
+            self.workers = max(1, int(workers))
+            self.alive = self.workers
+            self.lock = threading.Lock()
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = max(1, int(queue_size))
+        self.stages = []
+
+    def add_stage(self, name: str, handler, workers: int = 1):
+        self.stages.append(Pipeline.Stage(name, handler, workers))
+        return self
+
+    def run(self, items) -> None:
+        if len(self.stages) == 0:
+            return
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for idx, stage in enumerate(self.stages):
+            stage.alive = stage.workers
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._work, args=(idx, queues),
+                                     name='pipeline-{name}-{n}'.format(name=stage.name, n=n), daemon=True)
+                t.start()
+                threads.append(t)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(self._STOP)
+            for t in threads:
+                t.join()
+
+    def _work(self, idx: int, queues: list):
+        stage = self.stages[idx]
+        is_last = idx == len(self.stages) - 1
+        try:
+            while True:
+                item = queues[idx].get()
+                if item is self._STOP:
+                    break
+                try:
+                    res = stage.handler(item)
+                    if not is_last and res is not None:
+                        queues[idx + 1].put(res)
+                except Exception:
+                    logging.getLogger('jobs').error(
+                        'Pipeline stage {name} error {error}'.format(name=stage.name, error=traceback.format_exc()))
+        finally:
+            # django db connections are per thread
+            connections.close_all()
+            with stage.lock:
+                stage.alive -= 1
+                last_one = stage.alive == 0
+            # the last worker of a stage signals the next one
+            if last_one and not is_last:
+                for _ in range(self.stages[idx + 1].workers):
+                    queues[idx + 1].put(self._STOP)
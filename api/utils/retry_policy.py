@@ -0,0 +1,94 @@
+import random
+import socket
+
+from .config import config
+
+
+class RetryPolicy:
+    """
+    Classifies send errors and computes when ( if ever ) a failed mail is retried.
+    Each error class has its own exponential backoff: base * factor ^ retries seconds, capped at `cap`,
+    with equal jitter ( half fixed, half random ) so mails that failed together do not retry together.
+    A class set to None is not retried at all.
+    Defaults come from SEND_EMAILS_RETRY_POLICY and could be overridden per MailTemplate.retry_policy.
+    """
+
+    PERMANENT = 'permanent'
+    TRANSIENT = 'transient'
+    TIMEOUT = 'timeout'
+    RATE_LIMITED = 'rate_limited'
+
+    CLASSES = [PERMANENT, TRANSIENT, TIMEOUT, RATE_LIMITED]
+    BACKOFF_KEYS = ['base', 'factor', 'cap']
+
+    DEFAULTS = {
+        PERMANENT: None,
+        TRANSIENT: {'base': 300, 'factor': 2, 'cap': 6 * 3600},
+        TIMEOUT: {'base': 60, 'factor': 2, 'cap': 3600},
+        RATE_LIMITED: {'base': 10, 'factor': 2, 'cap': 60},
+    }
+
+    def __init__(self, overrides: dict = None):
+        self.backoffs = dict(RetryPolicy.DEFAULTS)
+        for policy in [config('SEND_EMAILS_RETRY_POLICY', None), overrides]:
+            if policy:
+                self.backoffs.update(RetryPolicy.validate(policy))
+
+    @staticmethod
+    def validate(policy: dict) -> dict:
+        if not isinstance(policy, dict):
+            raise ValueError('retry policy should be an object')
+        for error_class, backoff in policy.items():
+            if error_class not in RetryPolicy.CLASSES:
+                raise ValueError('unknown error class {error_class}'.format(error_class=error_class))
+            if backoff is None:
+                continue
+            if not isinstance(backoff, dict) or set(backoff.keys()) - set(RetryPolicy.BACKOFF_KEYS):
+                raise ValueError('{error_class} backoff should only have {keys}'.format(
+                    error_class=error_class, keys=', '.join(RetryPolicy.BACKOFF_KEYS)))
+            for key, value in backoff.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError('{error_class}.{key} should be a positive number'.format(
+                        error_class=error_class, key=key))
+        return policy
+
+    @staticmethod
+    def classify(status_code: int = None, error: Exception = None) -> str:
+        if status_code is not None:
+            if status_code == 429:
+                return RetryPolicy.RATE_LIMITED
+            if status_code == 408:
+                return RetryPolicy.TIMEOUT
+            # bad credentials or account issues are not the mail fault, it will work once fixed
+            if status_code in [401, 403]:
+                return RetryPolicy.TRANSIENT
+            if 400 <= status_code < 500:
+                return RetryPolicy.PERMANENT
+            return RetryPolicy.TRANSIENT
+        if isinstance(error, (socket.timeout, TimeoutError, ConnectionError)):
+            return RetryPolicy.TIMEOUT
+        return RetryPolicy.TRANSIENT
+
+    def delay(self, error_class: str, retries: int = 0) -> float:
+        """
+        :param retries: retries already consumed by the mail
+        :return: seconds to wait before the next attempt, None if it should not be retried
+        """
+        if error_class not in RetryPolicy.CLASSES:
+            error_class = RetryPolicy.TRANSIENT
+        backoff = self.backoffs[error_class]
+        if backoff is None:
+            return None
+        defaults = RetryPolicy.DEFAULTS[error_class] or RetryPolicy.DEFAULTS[RetryPolicy.TRANSIENT]
+        base = float(backoff.get('base', defaults['base']))
+        factor = float(backoff.get('factor', defaults['factor']))
+        cap = float(backoff.get('cap', defaults['cap']))
+        delay = min(cap, base * (factor ** max(0, retries)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def cap(self, error_class: str) -> float:
+        backoff = self.backoffs.get(error_class)
+        if backoff is None:
+            return 0
+        defaults = RetryPolicy.DEFAULTS[error_class] or RetryPolicy.DEFAULTS[RetryPolicy.TRANSIENT]
+        return float(backoff.get('cap', defaults['cap']))
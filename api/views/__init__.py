@@ -5,4 +5,6 @@ from .mail_templates import MailTemplateListCreateAPIView, MailTemplateRetrieveU
 
 from .mails import MailListCreateAPIView
 
+from .attachments import AttachmentCreateAPIView
+
 from .openapi_schema import MailingApiSchemaGenerator
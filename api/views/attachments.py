@@ -0,0 +1,39 @@
+import logging
+import traceback
+
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import CreateAPIView
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+
+from .mails import CustomClientSchema
+from ..security import OAuth2Authentication, oauth2_scope_required
+from ..serializers import AttachmentWriteSerializer
+
+
+class AttachmentSchema(CustomClientSchema):
+    def _get_serializer(self, method, path):
+        return AttachmentWriteSerializer()
+
+
+class AttachmentCreateAPIView(CreateAPIView):
+    schema = AttachmentSchema()
+    authentication_classes = [OAuth2Authentication]
+    parser_classes = (MultiPartParser,)
+    serializer_class = AttachmentWriteSerializer
+
+    @oauth2_scope_required()
+    def post(self, request, *args, **kwargs):
+        try:
+            logging.getLogger('api').debug('calling AttachmentCreateAPIView::post')
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except ValidationError as e:
+            logging.getLogger('api').warning(e)
+            return Response(e.detail, status=status.HTTP_412_PRECONDITION_FAILED)
+        except:
+            logging.getLogger('api').error(traceback.format_exc())
+            return Response('server error', status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -49,6 +49,7 @@ class CustomClientSchema(AutoSchema):
 
 class MailFilter(FilterSet):
     is_sent = filters.BooleanFilter(method='filter_is_sent')
+    is_expired = filters.BooleanFilter(method='filter_is_expired')
     term = filters.CharFilter(method='filter_term')
     from_sent_date = filters.NumberFilter(method='filter_from_sent_date')
     to_sent_date = filters.NumberFilter(method='filter_to_sent_date')
@@ -61,6 +62,8 @@ class MailFilter(FilterSet):
             'to_email': ['contains'],
             'id': ['in'],
             'template__identifier': ['in'],
+            'provider': ['exact'],
+            'status': ['exact', 'in'],
         }
 
     def filter_term(self, queryset, name, value):
@@ -74,6 +77,9 @@ class MailFilter(FilterSet):
             return queryset.filter(sent_date__isnull=False)
         return queryset.filter(sent_date__isnull=True)
 
+    def filter_is_expired(self, queryset, name, value):
+        return queryset.filter(expired_date__isnull=not value)
+
     def filter_from_sent_date(self, queryset, name, value):
         if value:
             return queryset.filter(sent_date__gte=datetime.datetime.utcfromtimestamp(int(value)))
@@ -96,7 +102,11 @@ class MailListCreateAPIView(ListCreateAPIView):
     parser_classes = (JSONParser,)
 
     def get_queryset(self):
-        return Mail.objects.get_queryset().order_by('id')
+        queryset = Mail.objects.get_queryset().order_by('id')
+        # bodies are only loaded when asked for ( expand=body )
+        if 'body' in self.request.GET.get('expand', '').split(','):
+            queryset = queryset.select_related('body')
+        return queryset
 
     def get_serializer_class(self, *args, **kwargs):
         if self.request is not None and self.request.method == 'POST':
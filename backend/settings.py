@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
+import json
 import os
 from django.utils.translation import ugettext_lazy as _
 from dotenv import load_dotenv
@@ -412,6 +413,13 @@ OAUTH2 = {
                     'scopes': os.getenv('OAUTH2_SCOPE_SEND_EMAIL')
                 },
             },
+            '/api/v1/mails/attachments': {
+                'post': {
+                    'name': _('UploadAttachment'),
+                    'desc': _('Upload an attachment to be sent by reference'),
+                    'scopes': os.getenv('OAUTH2_SCOPE_SEND_EMAIL')
+                },
+            },
             '/api/v1/mails/sent': {
                 'get': {
                     'name': _('GetAllSentEmails'),
@@ -435,5 +443,108 @@ SUPPORTED_LOCALES = {
 
 INJECTOR_MODULES = ['api.ioc.ApiAppModule']
 
+# sendgrid | smtp | spool ( writes the mails as json files on SEND_EMAILS_SPOOL_DIR, for dev / load testing )
+EMAIL_DELIVERY_PROVIDER = os.getenv('EMAIL_DELIVERY_PROVIDER', 'sendgrid')
+# several providers, in failover order with optional weights ie sendgrid:3,smtp:1 ( default EMAIL_DELIVERY_PROVIDER )
+EMAIL_DELIVERY_PROVIDERS = os.getenv('EMAIL_DELIVERY_PROVIDERS', '')
+# failover ( first healthy provider with quota left ) | weighted ( split by weight between the healthy ones )
+EMAIL_DELIVERY_STRATEGY = os.getenv('EMAIL_DELIVERY_STRATEGY', 'failover')
+# could point to a local stand in ( python manage.py fake_sendgrid ) for load testing
+SEND_GRID_API_HOST = os.getenv('SEND_GRID_API_HOST', 'https://api.sendgrid.com')
+SEND_EMAILS_SPOOL_DIR = os.getenv('SEND_EMAILS_SPOOL_DIR', os.path.join(BASE_DIR, 'spool'))
+# smtp relay, authenticated connections are pooled and reused for up to SMTP_MAX_MESSAGES mails
+SEND_EMAILS_SMTP_HOST = os.getenv('SEND_EMAILS_SMTP_HOST', 'localhost')
+SEND_EMAILS_SMTP_PORT = int(os.getenv('SEND_EMAILS_SMTP_PORT', 25))
+SEND_EMAILS_SMTP_USER = os.getenv('SEND_EMAILS_SMTP_USER')
+SEND_EMAILS_SMTP_PASSWORD = os.getenv('SEND_EMAILS_SMTP_PASSWORD')
+SEND_EMAILS_SMTP_USE_TLS = os.getenv('SEND_EMAILS_SMTP_USE_TLS', '0') == '1'
+SEND_EMAILS_SMTP_USE_SSL = os.getenv('SEND_EMAILS_SMTP_USE_SSL', '0') == '1'
+SEND_EMAILS_SMTP_TIMEOUT = float(os.getenv('SEND_EMAILS_SMTP_TIMEOUT', 30))
+SEND_EMAILS_SMTP_POOL_SIZE = int(os.getenv('SEND_EMAILS_SMTP_POOL_SIZE', 8))
+SEND_EMAILS_SMTP_MAX_MESSAGES = int(os.getenv('SEND_EMAILS_SMTP_MAX_MESSAGES', 100))
+SEND_EMAILS_SMTP_MAX_IDLE = float(os.getenv('SEND_EMAILS_SMTP_MAX_IDLE', 30))
 SEND_EMAILS_JOB_BATCH = os.getenv('SEND_EMAILS_JOB_BATCH', 1000)
+# number of build/send workers and size of the queues between pipeline stages
+SEND_EMAILS_JOB_CONCURRENCY = int(os.getenv('SEND_EMAILS_JOB_CONCURRENCY', 1))
+SEND_EMAILS_JOB_QUEUE_SIZE = int(os.getenv('SEND_EMAILS_JOB_QUEUE_SIZE', 100))
+# send results are written back to the db in batches of this size
+SEND_EMAILS_JOB_ACK_BATCH = int(os.getenv('SEND_EMAILS_JOB_ACK_BATCH', 100))
+# mails loaded from db at once to be grouped
+SEND_EMAILS_JOB_LOAD_BATCH = int(os.getenv('SEND_EMAILS_JOB_LOAD_BATCH', 500))
+# identical content mails are sent on a single request with up to N personalizations ( 1 disables it )
+SEND_GRID_MAX_PERSONALIZATIONS = int(os.getenv('SEND_GRID_MAX_PERSONALIZATIONS', 1000))
+# requests per second to SendGrid shared by all the workers ( redis token bucket, 0 disables it ),
+# adapted at runtime from the X-RateLimit-* response headers
+SEND_GRID_RATE_LIMIT = float(os.getenv('SEND_GRID_RATE_LIMIT', 100))
+SEND_GRID_RATE_LIMIT_BURST = int(os.getenv('SEND_GRID_RATE_LIMIT_BURST', 100))
+RATE_LIMITER_KEY_PREFIX = os.getenv('RATE_LIMITER_KEY_PREFIX', 'mailing_api:rate_limit')
+# circuit breaker: opens when the provider error rate of the last N calls reaches the threshold,
+# stops claiming for OPEN_TIMEOUT seconds, probes with a single mail and then ramps up along RAMP_PERIOD seconds
+SEND_GRID_CIRCUIT_ERROR_RATE = float(os.getenv('SEND_GRID_CIRCUIT_ERROR_RATE', 0.5))
+SEND_GRID_CIRCUIT_WINDOW = int(os.getenv('SEND_GRID_CIRCUIT_WINDOW', 20))
+SEND_GRID_CIRCUIT_MIN_CALLS = int(os.getenv('SEND_GRID_CIRCUIT_MIN_CALLS', 10))
+SEND_GRID_CIRCUIT_OPEN_TIMEOUT = float(os.getenv('SEND_GRID_CIRCUIT_OPEN_TIMEOUT', 30))
+SEND_GRID_CIRCUIT_RAMP_PERIOD = float(os.getenv('SEND_GRID_CIRCUIT_RAMP_PERIOD', 120))
+# backoff per error class ( permanent, transient, timeout, rate_limited ), ie
+# {"transient": {"base": 300, "factor": 2, "cap": 21600}, "permanent": null}
+# permanent errors ( 4xx ) are not retried, rate limited ( 429 ) mails are requeued without consuming a retry
+SEND_EMAILS_RETRY_POLICY = json.loads(os.getenv('SEND_EMAILS_RETRY_POLICY', '{}'))
+# share of each claimed batch per priority lane ( 2 transactional, 1 normal, 0 bulk ), unused shares go to the higher lanes
+SEND_EMAILS_PRIORITY_WEIGHTS = json.loads(os.getenv('SEND_EMAILS_PRIORITY_WEIGHTS', '{"2": 6, "1": 3, "0": 1}'))
+# deficit round robin between the clients of each lane, SEND_EMAILS_FAIR_QUANTUM mails per client per round
+# ( 0 = the lane share split evenly between its clients )
+SEND_EMAILS_FAIR_QUEUING = os.getenv('SEND_EMAILS_FAIR_QUEUING', '1') == '1'
+SEND_EMAILS_FAIR_QUANTUM = int(os.getenv('SEND_EMAILS_FAIR_QUANTUM', 0))
+# mails past their ttl are marked expired before each claim, in chunks of SEND_EMAILS_EXPIRE_CHUNK
+SEND_EMAILS_EXPIRE_CHUNK = int(os.getenv('SEND_EMAILS_EXPIRE_CHUNK', 1000))
+# claimed emails are leased for SEND_EMAILS_LEASE_TTL seconds, after that they go back to the queue
+# a heartbeat interval ( seconds, well below the ttl, 0 disables it ) keeps the lease alive for long batches,
+# so they are not given back to the queue ( and sent twice ) while still being sent
+SEND_EMAILS_LEASE_TTL = int(os.getenv('SEND_EMAILS_LEASE_TTL', 600))
+SEND_EMAILS_LEASE_HEARTBEAT_INTERVAL = int(os.getenv('SEND_EMAILS_LEASE_HEARTBEAT_INTERVAL', 120))
+# send_worker adaptive poll interval ( seconds )
+SEND_WORKER_MIN_SLEEP = float(os.getenv('SEND_WORKER_MIN_SLEEP', 0.5))
+SEND_WORKER_MAX_SLEEP = float(os.getenv('SEND_WORKER_MAX_SLEEP', 5))
+# idle workers block on a redis pub/sub channel and wake up as soon as a mail is created,
+# the fallback poll interval ( seconds ) covers missed notifications
+SEND_WORKER_NOTIFY_CHANNEL = os.getenv('SEND_WORKER_NOTIFY_CHANNEL', 'mailing_api:mails')
+SEND_WORKER_FALLBACK_POLL_INTERVAL = float(os.getenv('SEND_WORKER_FALLBACK_POLL_INTERVAL', 30))
+# worker processes forked by send_worker ( use all the cores of the host )
+SEND_WORKER_PROCESSES = int(os.getenv('SEND_WORKER_PROCESSES', 1))
+# send workers register on a redis membership registry and each one gets a shard of the queue ( id % workers )
+SEND_WORKER_SHARDING = os.getenv('SEND_WORKER_SHARDING', '1') == '1'
+SEND_WORKER_REGISTRY_KEY = os.getenv('SEND_WORKER_REGISTRY_KEY', 'mailing_api:workers')
+SEND_WORKER_REGISTRY_TTL = int(os.getenv('SEND_WORKER_REGISTRY_TTL', 60))
+# daily retention job: sent / failed mails due more than SEND_EMAILS_RETENTION_DAYS ago are moved to the archive
+# ( ndjson: gzipped files on SEND_EMAILS_ARCHIVE_DIR | table: api_archivedmail ), or with mode purge_bodies
+# only their bodies are deleted. SEND_EMAILS_RETENTION_CHUNK mails per transaction, sleeping
+# SEND_EMAILS_RETENTION_SLEEP seconds between chunks, up to SEND_EMAILS_RETENTION_MAX_CHUNKS ( 0 = all ) per run.
+# then the attachment blobs unreferenced for more than SEND_EMAILS_RETENTION_DAYS are deleted the same way
+SEND_EMAILS_RETENTION_DAYS = int(os.getenv('SEND_EMAILS_RETENTION_DAYS', 30))
+SEND_EMAILS_RETENTION_MODE = os.getenv('SEND_EMAILS_RETENTION_MODE', 'archive')
+SEND_EMAILS_RETENTION_CHUNK = int(os.getenv('SEND_EMAILS_RETENTION_CHUNK', 1000))
+SEND_EMAILS_RETENTION_SLEEP = float(os.getenv('SEND_EMAILS_RETENTION_SLEEP', 0.5))
+SEND_EMAILS_RETENTION_MAX_CHUNKS = int(os.getenv('SEND_EMAILS_RETENTION_MAX_CHUNKS', 0))
+SEND_EMAILS_ARCHIVE_BACKEND = os.getenv('SEND_EMAILS_ARCHIVE_BACKEND', 'ndjson')
+SEND_EMAILS_ARCHIVE_DIR = os.getenv('SEND_EMAILS_ARCHIVE_DIR') or os.path.join(BASE_DIR, 'archive')
+# opt in, attachments content is extracted on create to a content addressed store ( sha256 ), each file is
+# stored once ( filesystem: ATTACHMENT_STORE_DIR, must be a volume shared by the api and every worker | storage:
+# DEFAULT_FILE_STORAGE under ATTACHMENT_STORE_PREFIX ), unset keeps them inline on the payload.
+# send workers keep up to SEND_EMAILS_BLOB_CACHE_SIZE bytes of them per poll
+ATTACHMENT_STORE = os.getenv('ATTACHMENT_STORE', '')
+ATTACHMENT_STORE_DIR = os.getenv('ATTACHMENT_STORE_DIR', '')
+ATTACHMENT_STORE_PREFIX = os.getenv('ATTACHMENT_STORE_PREFIX', 'attachments/')
+SEND_EMAILS_BLOB_CACHE_SIZE = int(os.getenv('SEND_EMAILS_BLOB_CACHE_SIZE', 64 * 1024 * 1024))
+# attachments could also be sent by reference ( url ), fetched by the send workers thru a LRU disk cache of
+# ATTACHMENT_CACHE_SIZE bytes on ATTACHMENT_CACHE_DIR, revalidated ( ETag ) after ATTACHMENT_CACHE_MAX_AGE seconds.
+# ATTACHMENT_FETCH_ALLOWED_HOSTS ( comma separated ) are the hosts they could be fetched from, none by default.
+# * allows any host that resolves to public addresses only ( no loopback, private or link local ones )
+ATTACHMENT_MAX_SIZE = int(os.getenv('ATTACHMENT_MAX_SIZE', 20 * 1024 * 1024))
+ATTACHMENT_CACHE_DIR = os.getenv('ATTACHMENT_CACHE_DIR') or os.path.join(BASE_DIR, 'attachments_cache')
+ATTACHMENT_CACHE_SIZE = int(os.getenv('ATTACHMENT_CACHE_SIZE', 512 * 1024 * 1024))
+ATTACHMENT_CACHE_MAX_AGE = float(os.getenv('ATTACHMENT_CACHE_MAX_AGE', 300))
+ATTACHMENT_FETCH_TIMEOUT = float(os.getenv('ATTACHMENT_FETCH_TIMEOUT', 30))
+ATTACHMENT_FETCH_ALLOWED_HOSTS = os.getenv('ATTACHMENT_FETCH_ALLOWED_HOSTS', '')
+# redis lock used to serialize the daily cron jobs across hosts ( seconds ), skipped while redis is down
+DISTRIBUTED_LOCK_TIMEOUT = int(os.getenv('DISTRIBUTED_LOCK_TIMEOUT', 600))
 DEV_EMAIL = os.getenv('DEV_EMAIL')
\ No newline at end of file